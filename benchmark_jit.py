@@ -0,0 +1,77 @@
+"""
+JIT バックエンド (markov_tensor_numba.py) の計測
+
+乱数で作った疎なテンソルについて、辞書による実装 (python)、SciPy の疎行列 (sparse)、Numba (jit) の
+所要時間を BACKEND を固定して計測し、結果が一致することを確認する。
+  python benchmark_jit.py --size 300 --density 0.05 --repeat 3
+JIT の最初の呼び出しはコンパイルを含むので、計測の前に一度ずつ呼んでおく。
+"""
+import argparse
+import time
+import numpy as np
+import markov_tensor
+import markov_tensor_numpy
+
+
+def random_tensor(profile, density, seed, normalize=True):
+    """
+    乱数で重みが 0 でないストランドを選んだ float64 のテンソルを作成
+    @param profile プロファイル
+    @param density 重みが 0 でないストランドの割合
+    @param seed 乱数の種
+    @param normalize True なら域の格子点ごとに正規化する
+    """
+    generator = np.random.default_rng(seed)
+    shape = tuple(int(np.prod(markov_tensor_numpy.profile_sizes(side))) for side in profile)
+    matrix = generator.random(shape) * (generator.random(shape) < density)
+    if normalize:
+        total = matrix.sum(axis=1, keepdims=True)
+        np.divide(matrix, total, out=matrix, where=total > 0)
+    tensor = markov_tensor_numpy.from_matrix(matrix, profile)
+    tensor["strands"] = {strand: weight for strand, weight in tensor["strands"].items() if weight != 0}
+    return tensor
+
+
+def measure(backend, function, repeat):
+    # BACKEND を固定して function を repeat 回呼び、最短の所要時間と結果を返す
+    markov_tensor.BACKEND = backend
+    try:
+        function()
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            best = min(best, time.perf_counter() - start)
+    finally:
+        markov_tensor.BACKEND = None
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the JIT backend")
+    parser.add_argument("--size", type=int, default=300, help="number of states")
+    parser.add_argument("--density", type=float, default=0.05, help="fraction of non-zero strands")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions (the best time is reported)")
+    arguments = parser.parse_args()
+    markov_tensor.DEBUG = False
+
+    size = arguments.size
+    kernel_x = random_tensor([[size], [size]], arguments.density, 0)
+    kernel_y = random_tensor([[size], [size]], arguments.density, 1)
+    joint = random_tensor([[], [size, size]], arguments.density, 2, normalize=False)
+    workloads = [
+        ("composition", lambda: markov_tensor.composition(kernel_x, kernel_y), ["sparse", "jit"]),
+        ("conditionalization", lambda: markov_tensor.conditionalization(joint, 2), ["python", "jit"]),
+        ("is_markov", lambda: markov_tensor.is_markov(kernel_x), ["python", "jit"])
+    ]
+    print("{0:<20} {1:>8} {2:>12} {3:>9} {4}".format("operation", "backend", "seconds", "speedup", "same"))
+    for name, function, backends in workloads:
+        baseline_seconds, baseline = measure(backends[0], function, arguments.repeat)
+        for backend in backends:
+            seconds, result = measure(backend, function, arguments.repeat)
+            same = result == baseline if type(result) == bool else result["strands"] == baseline["strands"]
+            print("{0:<20} {1:>8} {2:>12.6f} {3:>8.2f}x {4}".format(name, backend, seconds, baseline_seconds / seconds, same))
+
+
+if __name__ == "__main__":
+    main()
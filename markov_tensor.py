@@ -24,15 +24,60 @@ FXTens の Python による表現
 - 第二周辺化: メソッド second_marginalization
 - 反転: メソッド: conversion
 
+テンソル積を展開せずに保持する場合は tensor_product(tensor_x, tensor_y, factored=True) とする。
+展開されていないテンソル積どうしの結合は因子ごとに計算し、それ以外の演算では materialize で展開する。
+独立な因子の積になっているテンソルは factorize で展開されていないテンソル積に分解できる。
+
 テンソルを構成
 - 単位テンソル: メソッド unit_tensor
 - マルコフ・テンソル Δ: メソッド delta
 - マルコフ・テンソル ！: メソッド exclamation
 - マルコフ・テンソル Xa,b (スワップ): メソッド swap
+
+決定的なテンソル (域の格子点ごとに重み 1 のストランドが 1 個のみ) との結合は、写像による
+散布 (後から結合) または収集 (先に結合) として、もう一方のテンソルのストランド数に比例する時間で算出する。
+判定: メソッド is_deterministic、宣言 (判定の走査を省く): メソッド as_deterministic、重み 0 のストランドを作らない Δ: delta(list_x, zeros=False)
+
+数値モード
+- テンソルの辞書にキー "mode" を持たせると、重みをそのモードで計算する。
+  "rational" (Fraction), "float64", "float32", "log" (対数空間) から選ぶ。
+- モードの変換: メソッド convert_mode
+- 小さい重みのストランドを捨てる近似: メソッド prune, approximate_composition
+  (捨てた重みの和を全変動の誤差の上界としてキー "error_bound" に加える)
+
+ストランドの索引
+- 域の格子点や因子の値を指定したストランドの取得: メソッド select_strands
+- 因子の値を固定した切り口: メソッド slice_tensor、域の格子点を与えたときの分布: メソッド get_column
+
+表形式
+- pandas の DataFrame との変換: メソッド to_dataframe, from_dataframe
+- 列が域、行が余域の表の文字列: メソッド format_tensor
+- JSON との変換: メソッド tensor_to_json, tensor_from_json, save_tensor, load_tensor
+
+計算結果のキャッシュ
+- enable_cache を呼ぶと、各演算の結果を入力テンソルの内容のハッシュと引数をキーとして保持する。
+- 統計: メソッド cache_stats、無効化: メソッド disable_cache
+
+メモリの予算
+- MEMORY_BUDGET (バイト) を設定すると、各演算の前にプロファイルから結果の大きさを見積もり (markov_tensor_cost)、
+  予算を超える場合は MemoryError を送出する。MEMORY_BUDGET_ACTION を "out_of_core" とすると、
+  結合、周辺化、条件化はブロック単位の計算 (markov_tensor_out_of_core) に回す (厳密な重みのテンソルは回さない)。
+
+バックエンド
+- float64, float32, log モードのテンソルの演算は、大きさと密度に応じて NumPy (密)、SciPy (疎)、
+  Numba (JIT) のバックエンドに振り分ける。各バックエンドは最初に使うときに import する。
+- 選択: メソッド select_backend、固定: BACKEND にバックエンド名を設定
 """
-import pandas as pd
 from fractions import Fraction
 import itertools
+import importlib
+import sys
+import math
+import operator
+import struct
+import functools
+import unicodedata
+from collections import OrderedDict
 
 DEBUG = True
 
@@ -41,6 +86,472 @@ CODOMAIN_PROFILE = 1
 DOMAIN_LATTICE_POINT = 0
 CODOMAIN_LATTICE_POINT = 1
 
+MODE_RATIONAL = "rational"
+MODE_FLOAT64 = "float64"
+MODE_FLOAT32 = "float32"
+MODE_LOG = "log"
+# モードが混在したときは順位の大きいモードへ昇格する
+MODE_RANKS = {
+    MODE_RATIONAL: 0,
+    MODE_FLOAT32: 1,
+    MODE_FLOAT64: 2,
+    MODE_LOG: 3
+}
+
+# rational モードの計算結果の分母のビット数がこの値を超えたら RATIONAL_FALLBACK_MODE に切り替える (None なら切り替えない)
+RATIONAL_DENOMINATOR_BITS = None
+RATIONAL_FALLBACK_MODE = MODE_FLOAT64
+
+
+# バックエンド名と、そのバックエンドを実装するモジュール名 (None は辞書による本モジュールの実装)
+BACKENDS = {
+    "python": None,
+    "numpy": "markov_tensor_numpy",
+    "sparse": "markov_tensor_sparse",
+    "jit": "markov_tensor_numba"
+}
+# import 済み (import できなかった場合は None) のバックエンド
+LOADED_BACKENDS = {}
+# バックエンドを固定する場合にバックエンド名を設定 (None なら自動選択)
+BACKEND = None
+# 自動選択の閾値: 格子点の対の数がこれ未満なら辞書のまま計算
+PYTHON_MAX_CELLS = 64
+# ストランドの数 / 格子点の対の数がこれ以下なら疎なバックエンドを使う
+SPARSE_MAX_DENSITY = 0.1
+# 疎な場合に、格子点の対の数がこれ以上なら JIT のバックエンドを使う
+JIT_MIN_CELLS = 1000000
+
+
+def register_backend(name, module_name):
+    """
+    バックエンドを登録
+    モジュールは OPERATIONS (演算名をキー、関数 (tensor_x, tensor_y, mode) などを値とする辞書) をもつ。
+    @param name バックエンド名
+    @param module_name モジュール名
+    """
+    BACKENDS[name] = module_name
+    LOADED_BACKENDS.pop(name, None)
+
+
+def get_backend(name):
+    """
+    バックエンドのモジュールを取得 (最初に呼ばれたときに import する)
+    @param name バックエンド名
+    @return モジュール (辞書による実装、または import できない場合は None)
+    """
+    if name not in LOADED_BACKENDS:
+        module = None
+        if BACKENDS.get(name) is not None:
+            try:
+                module = importlib.import_module(BACKENDS[name])
+            except ImportError:
+                if DEBUG:
+                    print("backend {0} is not available".format(name))
+        LOADED_BACKENDS[name] = module
+    return LOADED_BACKENDS[name]
+
+
+def count_nonzero(tensor):
+    # 重みが 0 でないストランドの数 (log モードでは -inf が 0)
+    zero = -math.inf if get_mode(tensor) == MODE_LOG else 0
+    return len(tensor["strands"]) - operator.countOf(tensor["strands"].values(), zero)
+
+
+def count_cells(tensor):
+    # 格子点の対の数 (密な行列の要素数)
+    total = 1
+    for item in tensor["profile"][DOMAIN_PROFILE] + tensor["profile"][CODOMAIN_PROFILE]:
+        total *= item if type(item) == int else len(item)
+    return total
+
+
+def select_backend(operation, *tensors):
+    """
+    演算に用いるバックエンドを選択
+    数値モードの指定がないテンソルや rational モードのテンソルは、厳密な結果を保つため辞書のまま計算する。
+    それ以外は、格子点の対の数と密度 (重みが 0 でないストランドの割合) から、JIT → 疎 → 密の順に、
+    import でき、演算を実装しているものを選ぶ。
+    @param operation 演算名
+    @param tensors 入力テンソル
+    @return バックエンド名
+    """
+    candidates = []
+    modes = [get_mode(tensor) for tensor in tensors]
+    if BACKEND is not None:
+        candidates = [BACKEND]
+    elif all(mode in (MODE_FLOAT64, MODE_FLOAT32, MODE_LOG) for mode in modes):
+        cells = max(count_cells(tensor) for tensor in tensors)
+        density = max(count_nonzero(tensor) / max(count_cells(tensor), 1) for tensor in tensors)
+        if cells >= PYTHON_MAX_CELLS:
+            if density <= SPARSE_MAX_DENSITY and MODE_LOG not in modes:
+                candidates = (["jit"] if cells >= JIT_MIN_CELLS else []) + ["sparse", "numpy"]
+            else:
+                candidates = ["numpy"]
+
+    for name in candidates:
+        module = get_backend(name)
+        if module is not None and operation in getattr(module, "OPERATIONS", {}):
+            return name
+    return "python"
+
+
+def dispatch(operation, *tensors):
+    """
+    選択したバックエンドの演算の関数を取得
+    @param operation 演算名
+    @param tensors 入力テンソル
+    @return 関数 (辞書のまま計算する場合は None)
+    """
+    name = select_backend(operation, *tensors)
+    if name == "python":
+        return None
+    return get_backend(name).OPERATIONS[operation]
+
+
+# enable_cache で作成する演算結果のキャッシュ (None ならキャッシュしない)
+CACHE = None
+
+
+def enable_cache(max_entries=256, max_strands=None):
+    """
+    演算結果のキャッシュを有効化
+    最も長く使われていない結果から、エントリ数が max_entries 以下、
+    保持するストランドの総数が max_strands 以下になるまで破棄する。
+    @param max_entries 保持する結果の最大数
+    @param max_strands 保持するストランドの総数の上限 (None なら無制限)
+    """
+    global CACHE
+    CACHE = {
+        "entries": OrderedDict(),
+        "max_entries": max_entries,
+        "max_strands": max_strands,
+        "strands": 0,
+        "hits": 0,
+        "misses": 0,
+        "evictions": 0
+    }
+
+
+def disable_cache():
+    """
+    演算結果のキャッシュを無効化して破棄
+    """
+    global CACHE
+    CACHE = None
+
+
+def cache_stats():
+    """
+    演算結果のキャッシュの統計を取得
+    @return hits, misses, hit_rate, entries, strands, evictions をキーとする辞書
+    """
+    if CACHE is None:
+        return None
+    requests = CACHE["hits"] + CACHE["misses"]
+    return {
+        "hits": CACHE["hits"],
+        "misses": CACHE["misses"],
+        "hit_rate": CACHE["hits"] / requests if requests > 0 else 0.0,
+        "entries": len(CACHE["entries"]),
+        "strands": CACHE["strands"],
+        "evictions": CACHE["evictions"]
+    }
+
+
+def is_tensor(value):
+    # テンソルの辞書であるか
+    return type(value) == dict and "profile" in value
+
+
+def tensor_hash(tensor):
+    """
+    テンソルのプロファイル、数値モード、誤差の上界、ストランドの重みの内容から正規化したハッシュ値を算出
+    @param tensor テンソル
+    @return 16 進数のハッシュ値
+    """
+    import hashlib
+
+    digest = hashlib.sha256()
+    digest.update(repr(tensor["profile"]).encode())
+    digest.update(repr(tensor.get("mode")).encode())
+    digest.update(repr(tensor.get("error_bound")).encode())
+    if "factors" in tensor:
+        for factor in tensor["factors"]:
+            digest.update(tensor_hash(factor).encode())
+    else:
+        for strand, weight in sorted(tensor["strands"].items()):
+            digest.update(strand.encode())
+            digest.update(repr(weight).encode())
+    return digest.hexdigest()
+
+
+def count_strands(tensor):
+    # キャッシュの大きさを測るためのストランド数
+    if "factors" in tensor:
+        return sum(count_strands(factor) for factor in tensor["factors"])
+    return len(tensor["strands"])
+
+
+def cached_operation(function):
+    """
+    演算の結果をキャッシュするデコレータ
+    キーは演算名と、結果に影響する設定 (BACKEND, RATIONAL_DENOMINATOR_BITS, RATIONAL_FALLBACK_MODE)、
+    入力テンソルの内容のハッシュ値、その他の引数の repr から作る。
+    入力や結果の辞書が後から変更されても影響しないよう、保持と返却の際に結果を複製する。
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        # ブロックに分けたテンソルはディレクトリの内容が変わりうるのでキャッシュしない
+        if CACHE is None or any(is_tensor(arg) and is_blocked(arg) for arg in args):
+            return function(*args, **kwargs)
+        import copy
+
+        key = (function.__name__, BACKEND, RATIONAL_DENOMINATOR_BITS, RATIONAL_FALLBACK_MODE) + tuple(
+            tensor_hash(arg) if is_tensor(arg) else repr(arg) for arg in args) + tuple(
+            (name, tensor_hash(kwargs[name]) if is_tensor(kwargs[name]) else repr(kwargs[name])) for name in sorted(kwargs.keys()))
+        entries = CACHE["entries"]
+        if key in entries:
+            CACHE["hits"] += 1
+            entries.move_to_end(key)
+            return copy.deepcopy(entries[key])
+
+        CACHE["misses"] += 1
+        result = function(*args, **kwargs)
+        if CACHE is None or not is_tensor(result) or is_blocked(result):
+            return result
+        entries[key] = copy.deepcopy(result)
+        CACHE["strands"] += count_strands(result)
+        while entries and (len(entries) > CACHE["max_entries"] or (
+                CACHE["max_strands"] is not None and CACHE["strands"] > CACHE["max_strands"])):
+            _, evicted = entries.popitem(last=False)
+            CACHE["strands"] -= count_strands(evicted)
+            CACHE["evictions"] += 1
+        return result
+
+    return wrapper
+
+
+# メモリの予算 (バイト)。設定すると演算の前に markov_tensor_cost で結果の大きさを見積もって確認する (None なら確認しない)
+MEMORY_BUDGET = None
+# 予算を超える場合の動作: "raise" (MemoryError を送出) または "out_of_core" (ブロック単位の計算に回す)
+MEMORY_BUDGET_ACTION = "raise"
+
+
+def is_blocked(tensor):
+    # ブロックに分けてディレクトリに置いたテンソル (markov_tensor_out_of_core) であるか
+    return "blocked" in tensor
+
+
+def budgeted_operation(function):
+    """
+    演算の前にメモリの予算を確認するデコレータ
+    予算が設定されているか、ブロックに分けたテンソルが渡された場合のみ markov_tensor_cost.guard を呼び、
+    予算を超えるなら MemoryError を送出するか、ブロック単位で計算した結果を返す。
+    cached_operation の内側に置き、キャッシュにある結果は予算を確認せずに返す。
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if MEMORY_BUDGET is not None or any(is_tensor(arg) and is_blocked(arg) for arg in args):
+            result = importlib.import_module("markov_tensor_cost").guard(function.__name__, args, kwargs)
+            if result is not None:
+                return result
+        return function(*args, **kwargs)
+
+    return wrapper
+
+
+def get_mode(tensor):
+    """
+    テンソルの数値モードを取得
+    @param tensor テンソル
+    @return 数値モード (指定がなければ None)
+    """
+    return tensor.get("mode")
+
+
+def promote_mode(mode_x, mode_y):
+    """
+    2 個の数値モードから昇格後の数値モードを決定
+    @param mode_x 数値モード
+    @param mode_y 数値モード
+    @return 数値モード
+    """
+    if mode_x is None:
+        return mode_y
+    if mode_y is None:
+        return mode_x
+    return mode_x if MODE_RANKS[mode_x] >= MODE_RANKS[mode_y] else mode_y
+
+
+def to_float32(value):
+    """
+    単精度浮動小数点数に丸める
+    @param value 数値
+    """
+    return struct.unpack("f", struct.pack("f", value))[0]
+
+
+def to_probability(value, mode):
+    """
+    数値モードで表現された重みを確率 (対数でない値) に戻す
+    @param value 重み
+    @param mode 数値モード
+    """
+    return math.exp(value) if mode == MODE_LOG else value
+
+
+def convert_value(value, mode_from, mode_to):
+    """
+    重みを数値モード mode_from から mode_to へ変換
+    @param value 重み
+    @param mode_from 変換前の数値モード
+    @param mode_to 変換後の数値モード
+    """
+    probability = to_probability(value, mode_from)
+    if mode_to == MODE_RATIONAL:
+        return Fraction(probability)
+    if mode_to == MODE_FLOAT64:
+        return float(probability)
+    if mode_to == MODE_FLOAT32:
+        return to_float32(probability)
+    if mode_to == MODE_LOG:
+        return math.log(probability) if probability > 0 else -math.inf
+    raise ValueError("unknown mode: {0}".format(mode_to))
+
+
+def convert_mode(tensor, mode):
+    """
+    テンソルを数値モード mode に変換
+    丸めにより生じる誤差を、域の格子点ごとの重みの絶対誤差の総和の最大値 (L1 ノルム) として
+    キー "error_bound" に積算する。
+    @param tensor テンソル
+    @param mode 数値モード
+    @return tensor_result テンソル
+    """
+    mode_from = get_mode(tensor)
+    if mode_from == mode:
+        return tensor
+    if is_factored(tensor):
+        tensor_result = {}
+        tensor_result["profile"] = tensor["profile"]
+        tensor_result["factors"] = [convert_mode(factor, mode) for factor in get_factors(tensor)]
+        return tensor_result
+
+    tensor_result = {}
+    strands_result = {}
+    errors = {}
+    tensor_result["profile"] = tensor["profile"]
+    for strand in list(tensor["strands"].keys()):
+        value = tensor["strands"][strand]
+        converted = convert_value(value, mode_from, mode)
+        strands_result[strand] = converted
+        # 変換前後の確率の差を Fraction で厳密に評価
+        error = abs(Fraction(to_probability(value, mode_from)) - Fraction(to_probability(converted, mode)))
+        if error > 0:
+            strand_from, _ = get_lattice_points(strand)
+            strand_from_str = str(strand_from)
+            errors[strand_from_str] = errors.get(strand_from_str, 0) + error
+    tensor_result["strands"] = strands_result
+    tensor_result["mode"] = mode
+    error_bound = tensor.get("error_bound", 0) + (float(max(errors.values())) if errors else 0)
+    if error_bound > 0:
+        tensor_result["error_bound"] = error_bound
+
+    return tensor_result
+
+
+def align_modes(tensor_x, tensor_y):
+    """
+    2 個のテンソルの数値モードを昇格規則に従って揃える
+    @param tensor_x テンソル
+    @param tensor_y テンソル
+    @return tensor_x, tensor_y, mode
+    """
+    mode = promote_mode(get_mode(tensor_x), get_mode(tensor_y))
+    if mode is not None:
+        tensor_x = convert_mode(tensor_x, mode)
+        tensor_y = convert_mode(tensor_y, mode)
+    return tensor_x, tensor_y, mode
+
+
+def set_result_mode(tensor_result, mode, error_bound=0):
+    """
+    演算結果のテンソルに数値モードと誤差の上界を設定
+    rational モードで分母が RATIONAL_DENOMINATOR_BITS を超えた場合は RATIONAL_FALLBACK_MODE に切り替える。
+    @param tensor_result 結果のテンソル
+    @param mode 数値モード
+    @param error_bound 入力から引き継ぐ誤差の上界
+    @return tensor_result 結果のテンソル
+    """
+    if error_bound > 0:
+        tensor_result["error_bound"] = error_bound
+    if mode is None:
+        return tensor_result
+    tensor_result["mode"] = mode
+    if mode == MODE_RATIONAL and RATIONAL_DENOMINATOR_BITS is not None:
+        for value in tensor_result["strands"].values():
+            if Fraction(value).denominator.bit_length() > RATIONAL_DENOMINATOR_BITS:
+                return convert_mode(tensor_result, RATIONAL_FALLBACK_MODE)
+    return tensor_result
+
+
+def drop_zero_strands(tensor_result):
+    """
+    数値モードが float64, float32, log の結果から重みが 0 のストランドを除く
+    バックエンドに振り分ける演算 (結合、テンソル積、条件化) の結果が、どのバックエンドでも同じストランドの集合になるようにする。
+    数値モードの指定がない、または rational モードの結果は辞書による実装のまま (到達した重み 0 のストランドを残す) とする。
+    @param tensor_result 結果のテンソル
+    @return tensor_result 結果のテンソル
+    """
+    mode = get_mode(tensor_result)
+    if mode not in (MODE_FLOAT64, MODE_FLOAT32, MODE_LOG):
+        return tensor_result
+    zero = -math.inf if mode == MODE_LOG else 0
+    if operator.countOf(tensor_result["strands"].values(), zero) > 0:
+        tensor_result["strands"] = {strand: weight for strand, weight in tensor_result["strands"].items() if weight != zero}
+    return tensor_result
+
+
+def mode_mult(mode, value_x, value_y):
+    # 数値モードに応じた積
+    if mode == MODE_LOG:
+        return value_x + value_y
+    if mode == MODE_FLOAT32:
+        return to_float32(value_x * value_y)
+    return value_x * value_y
+
+
+def mode_add(mode, value_x, value_y):
+    # 数値モードに応じた和 (対数空間では log-sum-exp)
+    if mode == MODE_LOG:
+        larger = max(value_x, value_y)
+        if larger == -math.inf:
+            return larger
+        return larger + math.log1p(math.exp(min(value_x, value_y) - larger))
+    if mode == MODE_FLOAT32:
+        return to_float32(value_x + value_y)
+    return value_x + value_y
+
+
+def mode_divide(mode, value_x, value_y):
+    # 数値モードに応じた商
+    if mode == MODE_LOG:
+        return value_x - value_y
+    if mode == MODE_FLOAT32:
+        return to_float32(value_x / value_y)
+    return value_x / value_y
+
+
+def mode_is_positive(mode, value):
+    # 数値モードに応じて、確率として正であるか
+    return value > -math.inf if mode == MODE_LOG else value > 0
+
+
+def mode_is_one(mode, value):
+    # 数値モードに応じて、確率として 1 であるか
+    return value == 0.0 if mode == MODE_LOG else value == 1.0
+
+
 def get_lattice_points(strand):
     """
     格子点の情報を取得
@@ -67,20 +578,26 @@ def is_markov(tensor):
     マルコフ性のチェック
     @param tensor
     """
-    total = {}
-    total_strands = {}
-    total["strands"] = {}
-    for strand in list(tensor["strands"].keys()):
-        strand_from, _ = get_lattice_points(strand)
-        strand_from_str = str(strand_from)
-        if strand_from_str in total_strands.keys():
-            total_strands[strand_from_str] += tensor["strands"][strand]
-        else:
-            total_strands[strand_from_str] = tensor["strands"][strand]
-    total["strands"] = total_strands
-    ret = True
-    for strand_from_str in total["strands"].keys():
-        ret = ret and (total["strands"][strand_from_str] == 1.0)
+    tensor = materialize(tensor)
+    mode = get_mode(tensor)
+    backend_is_markov = dispatch("is_markov", tensor)
+    if backend_is_markov is not None:
+        ret = backend_is_markov(tensor, mode)
+    else:
+        total = {}
+        total_strands = {}
+        total["strands"] = {}
+        for strand in list(tensor["strands"].keys()):
+            strand_from, _ = get_lattice_points(strand)
+            strand_from_str = str(strand_from)
+            if strand_from_str in total_strands.keys():
+                total_strands[strand_from_str] = mode_add(mode, total_strands[strand_from_str], tensor["strands"][strand])
+            else:
+                total_strands[strand_from_str] = tensor["strands"][strand]
+        total["strands"] = total_strands
+        ret = True
+        for strand_from_str in total["strands"].keys():
+            ret = ret and mode_is_one(mode, total["strands"][strand_from_str])
     if ret:
         print("this tensor is Markov")
 
@@ -100,6 +617,24 @@ def create_indexies(base_list):
     return [list(item) for item in list(itertools.product(*base_list))]
 
 
+def get_factor_values(profile_item):
+    """
+    プロファイルの要素 (自然数、またはラベルのリスト) から、その因子がとる値のリストを作成
+    @param profile_item プロファイルの要素
+    """
+    return create_n_bar(profile_item) if type(profile_item) == int else list(profile_item)
+
+
+def create_lattice_component(profile_item, value):
+    # 因子の値から格子点の成分を作成 (ラベルの場合は [ラベル] とする)
+    return value if type(profile_item) == int else [value]
+
+
+def get_component_value(component):
+    # 格子点の成分から因子の値を取得
+    return component[0] if type(component) == list else component
+
+
 def identity(tensor):
     """
     恒等射
@@ -125,7 +660,8 @@ def composition_process(tensor_x, tensor_y, strand_x, strand_y, strands_result,
         # 結合演算の結果のストランドの始点と終点の設定
         # キー strand_result はストランドの始点と終点を表す格子点を表す。
         strand_lattice_points = str([strand_from_x, strand_to_y])
-        mult = tensor_x["strands"][strand_x] * tensor_y["strands"][strand_y]
+        mode = get_mode(tensor_result)
+        mult = mode_mult(mode, tensor_x["strands"][strand_x], tensor_y["strands"][strand_y])
         if DEBUG:
             print("---")
             print("  strand_from_x: {0}, strand_to_x: {1}, tensor_x[strand_x]: {2}".format(
@@ -135,13 +671,15 @@ def composition_process(tensor_x, tensor_y, strand_x, strand_y, strands_result,
             print(
                 "tensor_x[strands][strand_x] * tensor_y[strands][strand_y]: {0}".format(mult))
         if strand_lattice_points in strands_result.keys():  # もし既にキー strand_result に値が設定されていれば加算
-            strands_result[strand_lattice_points] += mult
+            strands_result[strand_lattice_points] = mode_add(mode, strands_result[strand_lattice_points], mult)
         else:  # もし既にキー strand_result に値が設定されていなければ設定
             strands_result[strand_lattice_points] = mult
 
     return tensor_result, strands_result
 
 
+@cached_operation
+@budgeted_operation
 def composition(tensor_x, tensor_y):
     """
     結合を算出
@@ -149,13 +687,37 @@ def composition(tensor_x, tensor_y):
     @param tensor_y テンソル
     """
 
+    if is_factored(tensor_x) and is_factored(tensor_y):
+        tensor_result = factored_composition(tensor_x, tensor_y)
+        if tensor_result is not None:
+            return tensor_result
+    tensor_x = materialize(tensor_x)
+    tensor_y = materialize(tensor_y)
+
+    tensor_x, tensor_y, mode = align_modes(tensor_x, tensor_y)
     tensor_result = {}
     strands_result = {}
+    if mode is not None:
+        tensor_result["mode"] = mode
     if check_composable(tensor_x, tensor_y):
         tensor_result["profile"] = [
             tensor_x["profile"][DOMAIN_PROFILE],
             tensor_y["profile"][CODOMAIN_PROFILE]
         ]
+        # 決定的なテンソルとの結合は、写像による散布 (後から結合) または収集 (先に結合) とする
+        index_map_y = get_index_map(tensor_y)
+        index_map_x = get_index_map(tensor_x) if index_map_y is None else None
+        if index_map_y is not None or index_map_x is not None:
+            if index_map_y is not None:
+                tensor_result["strands"] = scatter_composition(tensor_x, index_map_y, mode)
+            else:
+                tensor_result["strands"] = gather_composition(tensor_x, tensor_y, mode)
+            return drop_zero_strands(set_result_mode(
+                tensor_result, mode, tensor_x.get("error_bound", 0) + tensor_y.get("error_bound", 0)))
+        backend_composition = dispatch("composition", tensor_x, tensor_y)
+        if backend_composition is not None:
+            return drop_zero_strands(set_result_mode(backend_composition(tensor_x, tensor_y, mode), mode,
+                tensor_x.get("error_bound", 0) + tensor_y.get("error_bound", 0)))
         for strand_x in [item for item in list(tensor_x["strands"].keys())]:
             for strand_y in [item for item in list(tensor_y["strands"].keys())]:
                 tensor_result, strands_result = composition_process(
@@ -164,9 +726,133 @@ def composition(tensor_x, tensor_y):
         print("cannot compose")
     tensor_result["strands"] = strands_result
 
-    return tensor_result
+    return drop_zero_strands(set_result_mode(
+        tensor_result, mode, tensor_x.get("error_bound", 0) + tensor_y.get("error_bound", 0)))
+
+
+# get_index_map で判定した写像 (ストランドの辞書の id をキーとし、最近使った順に INDEX_MAP_CACHE_SIZE 個まで保持)
+# 決定的でないと判定したテンソルも None として保持し、同じテンソルとの結合では走査を省く
+INDEX_MAPS = OrderedDict()
+INDEX_MAP_CACHE_SIZE = 16
+
+
+def find_index_map(tensor):
+    # ストランドを走査して写像を求める (決定的でなければ None)
+    mode = get_mode(tensor)
+    strands = tensor["strands"]
+    # 格子点を解析する前に、重みが 0 か 1 のみであるかを調べる (重み 0 のストランドは解析しない)
+    for weight in strands.values():
+        if mode_is_positive(mode, weight) and not mode_is_one(mode, weight):
+            return None
+    index_map = {}
+    for strand, weight in strands.items():
+        if mode_is_one(mode, weight):
+            strand_from, strand_to = get_lattice_points(strand)
+            key = str(strand_from)
+            if key in index_map:
+                return None
+            index_map[key] = strand_to
+    size = 1
+    for item in tensor["profile"][DOMAIN_PROFILE]:
+        size *= len(get_factor_values(item))
+    return index_map if len(index_map) == size else None
+
+
+def store_index_map(tensor, index_map):
+    # 写像をテンソルの辞書とは別に INDEX_MAPS に保持 (id が再利用されないよう、ストランドの辞書への参照も保持する)
+    strands = tensor["strands"]
+    INDEX_MAPS[id(strands)] = {"strands": strands, "size": len(strands), "map": index_map}
+    INDEX_MAPS.move_to_end(id(strands))
+    while len(INDEX_MAPS) > INDEX_MAP_CACHE_SIZE:
+        INDEX_MAPS.popitem(last=False)
+    return index_map
+
 
+def get_index_map(tensor):
+    """
+    決定的なテンソル (域の格子点ごとに重み 1 のストランドがちょうど 1 個あり、他のストランドの重みが 0) の写像を取得
+    swap, unit_tensor, exclamation, delta や、shadow.py の tensor_n のような関数を表すテンソルが該当する。
+    判定の結果は INDEX_MAPS に保持し、同じストランドの辞書 (置き換えられておらず、数も同じ) については走査しない。
+    重みをその場で書き換えた場合は as_deterministic で宣言し直すこと。
+    @param tensor テンソル a -> b
+    @return 域の格子点の文字列をキー、余域の格子点を値とする辞書 (決定的でなければ None)
+    """
+    strands = tensor["strands"]
+    entry = INDEX_MAPS.get(id(strands))
+    if entry is not None and entry["strands"] is strands and entry["size"] == len(strands):
+        INDEX_MAPS.move_to_end(id(strands))
+        return entry["map"]
+    return store_index_map(tensor, find_index_map(tensor))
+
+
+def as_deterministic(tensor):
+    """
+    テンソルが決定的であることを宣言し、写像を INDEX_MAPS に保持する
+    以後の結合では、このテンソルの判定のための走査を省く。
+    @param tensor 決定的なテンソル a -> b
+    @return tensor 同じテンソル (展開されていないテンソル積は展開したテンソル)
+    """
+    tensor = materialize(tensor)
+    if store_index_map(tensor, find_index_map(tensor)) is None:
+        raise ValueError("the tensor is not deterministic")
+    return tensor
+
+
+def is_deterministic(tensor):
+    """
+    テンソルが決定的 (関数を表す) であるかチェック
+    @param tensor テンソル
+    """
+    return get_index_map(materialize(tensor)) is not None
+
+
+def scatter_composition(tensor_x, index_map_y, mode):
+    """
+    決定的なテンソル tensor_y との結合 tensor_x; tensor_y を、tensor_x の重みの散布加算として算出
+    tensor_x のストランドの数に比例する時間で済む。tensor_y の重み 0 のストランドに対応する結果のストランドは作らない。
+    @param tensor_x テンソル a -> b
+    @param index_map_y tensor_y: b -> c の写像
+    @param mode 数値モード
+    @return strands_result 結果のストランド
+    """
+    strands_result = {}
+    for strand_x, weight in tensor_x["strands"].items():
+        strand_from_x, strand_to_x = get_lattice_points(strand_x)
+        strand_lattice_points = str([strand_from_x, index_map_y[str(strand_to_x)]])
+        if strand_lattice_points in strands_result:
+            strands_result[strand_lattice_points] = mode_add(mode, strands_result[strand_lattice_points], weight)
+        else:
+            strands_result[strand_lattice_points] = weight
+    return strands_result
 
+
+def gather_composition(tensor_x, tensor_y, mode, index_y=None):
+    """
+    決定的なテンソル tensor_x との結合 tensor_x; tensor_y を、tensor_y の列の収集として算出
+    域 a の格子点ごとに、写した先の tensor_y の列のみを索引から取り出す。
+    @param tensor_x 決定的なテンソル a -> b
+    @param tensor_y テンソル b -> c
+    @param mode 数値モード
+    @param index_y tensor_y の索引 (省略時は get_index で取得)
+    @return strands_result 結果のストランド
+    """
+    if index_y is None:
+        index_y = get_index(tensor_y)
+    strands_result = {}
+    for strand_x, weight in tensor_x["strands"].items():
+        if mode_is_one(mode, weight):
+            strand_from_x, strand_to_x = get_lattice_points(strand_x)
+            for strand_y in index_y["domain"].get(str(strand_to_x), []):
+                if strand_y not in tensor_y["strands"]:
+                    # 索引の作成後にキーが置き換えられたので、作り直して計算し直す
+                    return gather_composition(tensor_x, tensor_y, mode, build_index(tensor_y))
+                strand_lattice_points = str([strand_from_x, index_y["points"][strand_y][CODOMAIN_LATTICE_POINT]])
+                strands_result[strand_lattice_points] = tensor_y["strands"][strand_y]
+    return strands_result
+
+
+@cached_operation
+@budgeted_operation
 def partial_composition(tensor_a_b_sharp_c, tensor_b_d, concat_start_index):
     """
     部分結合を算出
@@ -196,6 +882,76 @@ def partial_composition(tensor_a_b_sharp_c, tensor_b_d, concat_start_index):
     return composition(tensor_a_b_sharp_c, tensor_product(tensor_b_d, unit_tensor_c))
 
 
+def prune(tensor, threshold=0, relative=0, top_k=None, renormalize=False):
+    """
+    小さい重みのストランドを捨てた近似のテンソルを作成
+    域の格子点ごとに、重みが threshold 以下、または重みの和の relative 倍未満のストランドと、
+    大きい方から top_k 個に入らないストランドを捨てる (重み 0 のストランドは常に捨てる)。
+    捨てた重みの和 d の域の格子点ごとの最大値を、全変動 (列の L1) の誤差としてキー "error_bound" に加える。
+    renormalize で残りの重みに 元の和 / 残りの和 を掛けて和を元に戻す場合 (マルコフ・テンソルなら正規化)、
+    重みの増分の和も d なので、誤差は高々 2d となる。
+    @param tensor テンソル
+    @param threshold 重みの絶対的な閾値
+    @param relative 域の格子点ごとの重みの和に対する閾値の割合
+    @param top_k 域の格子点ごとに残すストランドの最大数 (None なら制限しない)
+    @param renormalize True なら残りの重みを域の格子点ごとに和が元に戻るように拡大
+    @return tensor_result テンソル
+    """
+    tensor = materialize(tensor)
+    mode = get_mode(tensor)
+    columns = {}
+    for strand in tensor["strands"].keys():
+        strand_from, _ = get_lattice_points(strand)
+        columns.setdefault(str(strand_from), []).append(strand)
+
+    tensor_result = {}
+    strands_result = {}
+    tensor_result["profile"] = tensor["profile"]
+    max_discarded = 0
+    for strands in columns.values():
+        probabilities = {strand: to_probability(tensor["strands"][strand], mode) for strand in strands}
+        total = sum(probabilities.values())
+        kept = [strand for strand in strands
+                if probabilities[strand] > threshold and probabilities[strand] > 0 and probabilities[strand] >= relative * total]
+        if top_k is not None:
+            kept = sorted(kept, key=lambda strand: probabilities[strand], reverse=True)[0:top_k]
+        discarded = total - sum(probabilities[strand] for strand in kept)
+        max_discarded = max(max_discarded, float(discarded))
+
+        # 残りの重みに 元の和 / 残りの和 を掛けて、域の格子点ごとの和を元に戻す
+        total_kept = None
+        for strand in kept:
+            total_kept = tensor["strands"][strand] if total_kept is None else mode_add(mode, total_kept, tensor["strands"][strand])
+        total_original = total_kept
+        kept_set = set(kept)
+        for strand in strands:
+            if strand not in kept_set:
+                total_original = mode_add(mode, total_original, tensor["strands"][strand])
+        for strand in kept:
+            if renormalize and discarded > 0:
+                strands_result[strand] = mode_mult(
+                    mode, mode_divide(mode, tensor["strands"][strand], total_kept), total_original)
+            else:
+                strands_result[strand] = tensor["strands"][strand]
+    tensor_result["strands"] = strands_result
+
+    error_bound = tensor.get("error_bound", 0) + (2 * max_discarded if renormalize else max_discarded)
+    return set_result_mode(tensor_result, mode, error_bound)
+
+
+@cached_operation
+@budgeted_operation
+def approximate_composition(tensor_x, tensor_y, threshold=0, relative=0, top_k=None, renormalize=False):
+    """
+    結合を算出し、小さい重みのストランドを捨てる (引数は prune と同じ)
+    マルコフ・テンソルとの結合は列の L1 の誤差を拡大しないので、繰り返し結合しても誤差の上界は捨てた重みの和となる。
+    @param tensor_x テンソル
+    @param tensor_y テンソル
+    @return tensor_result テンソル
+    """
+    return prune(composition(tensor_x, tensor_y), threshold, relative, top_k, renormalize)
+
+
 def create_profile_tensor_product(tensor_x, tensor_y, tensor_result):
     # テンソル積のプロファイルを作成
     domain = []
@@ -233,7 +989,7 @@ def tensor_product_process(tensor_x, tensor_y, strand_x, strand_y, strands_resul
     strand_to.extend(strand_to_y)
 
     strand_lattice_points = str([strand_from, strand_to])
-    mult = tensor_x["strands"][strand_x] * tensor_y["strands"][strand_y]
+    mult = mode_mult(get_mode(tensor_result), tensor_x["strands"][strand_x], tensor_y["strands"][strand_y])
     if DEBUG:
         print("---")
         print("  strand_from_x: {0}, strand_to_x: {1}, tensor_x[strands][strand_x]: {2}".format(
@@ -249,21 +1005,42 @@ def tensor_product_process(tensor_x, tensor_y, strand_x, strand_y, strands_resul
     return tensor_result, strands_result
 
 
-def tensor_product(tensor_x, tensor_y):
+@cached_operation
+@budgeted_operation
+def tensor_product(tensor_x, tensor_y, factored=False):
     """
     テンソル積を算出
     @param tensor_x テンソル
     @param tensor_y テンソル
+    @param factored True ならストランドを展開せず、因子のリストをもつテンソルを返す
     """
 
+    if factored:
+        tensor_result = {}
+        tensor_result = create_profile_tensor_product(
+            tensor_x, tensor_y, tensor_result)
+        tensor_result["factors"] = get_factors(tensor_x) + get_factors(tensor_y)
+        return tensor_result
+
+    tensor_x = materialize(tensor_x)
+    tensor_y = materialize(tensor_y)
+
     if DEBUG:
         print('tensor_x')
         print_tensor(tensor_x)
         print('tensor_y')
         print_tensor(tensor_y)
 
+    tensor_x, tensor_y, mode = align_modes(tensor_x, tensor_y)
+    backend_tensor_product = dispatch("tensor_product", tensor_x, tensor_y)
+    if backend_tensor_product is not None:
+        return drop_zero_strands(set_result_mode(backend_tensor_product(tensor_x, tensor_y, mode), mode,
+            tensor_x.get("error_bound", 0) + tensor_y.get("error_bound", 0)))
+
     tensor_result = {}
     strands_result = {}
+    if mode is not None:
+        tensor_result["mode"] = mode
     tensor_result = create_profile_tensor_product(
         tensor_x, tensor_y, tensor_result)
 
@@ -273,9 +1050,186 @@ def tensor_product(tensor_x, tensor_y):
                 tensor_x, tensor_y, strand_x, strand_y, strands_result, tensor_result)
     tensor_result["strands"] = strands_result
 
+    return drop_zero_strands(set_result_mode(
+        tensor_result, mode, tensor_x.get("error_bound", 0) + tensor_y.get("error_bound", 0)))
+
+
+def is_factored(tensor):
+    """
+    テンソルが展開されていないテンソル積 (因子のリストをもつテンソル) であるかチェック
+    @param tensor テンソル
+    """
+    return "factors" in tensor
+
+
+def get_factors(tensor):
+    """
+    テンソル積の因子のリストを取得
+    @param tensor テンソル
+    @return 因子のリスト (展開されたテンソルであれば、そのテンソルのみのリスト)
+    """
+    return list(tensor["factors"]) if is_factored(tensor) else [tensor]
+
+
+def materialize(tensor):
+    """
+    展開されていないテンソル積 (またはブロックに分けたテンソル) のストランドを展開
+    @param tensor テンソル
+    @return tensor_result ストランドをもつテンソル
+    """
+    if is_blocked(tensor):
+        return importlib.import_module("markov_tensor_out_of_core").from_blocked(tensor["blocked"])
+    if not is_factored(tensor):
+        return tensor
+    factors = get_factors(tensor)
+    tensor_result = factors[0]
+    for factor in factors[1:]:
+        tensor_result = tensor_product(tensor_result, factor)
     return tensor_result
 
 
+def group_factors(factors):
+    # 因子のまとまりを 1 個のテンソルにする (因子が 1 個であれば展開しない)
+    return factors[0] if len(factors) == 1 else materialize({"factors": factors})
+
+
+def factorize(tensor, tolerance=0):
+    """
+    テンソルを独立な因子の展開されていないテンソル積に分解
+    域と余域の因子の列をそれぞれ前後に区切り、すべてのストランドの重みが前の部分 a1 -> b1 と後の部分 a2 -> b2 の
+    重みの積になる区切りを探して、分けた部分をさらに分解する。分布 [] -> a#b では余域の因子の独立性、
+    カーネルでは I#K のようなブロック対角を含むクロネッカー積の構造を検出する。
+    @param tensor テンソル
+    @param tolerance 重みとその積の差の許容値 (0 なら厳密に比較し、Fraction の重みは誤差なく判定する)
+    @return tensor_result 分解できれば因子のリストをもつテンソル、できなければ元のテンソル
+    """
+    tensor = materialize(tensor)
+    factors = split_independent_factors(tensor, tolerance)
+    if len(factors) == 1:
+        return tensor
+    if tolerance > 0:
+        # 重みごとの差が tolerance 以下なので、列の L1 の誤差は高々 tolerance x |b|
+        size = 1
+        for item in tensor["profile"][CODOMAIN_PROFILE]:
+            size *= len(get_factor_values(item))
+        factors[0]["error_bound"] = factors[0].get("error_bound", 0) + tolerance * size
+    tensor_result = {}
+    tensor_result["profile"] = tensor["profile"]
+    tensor_result["factors"] = factors
+    return tensor_result
+
+
+def split_independent_factors(tensor, tolerance):
+    """
+    独立な前後の部分に分けられる最初の区切りで 2 個に分け、それぞれをさらに分けた因子のリストを作成
+    @param tensor テンソル
+    @param tolerance 重みとその積の差の許容値
+    @return factors 因子のリスト (分けられなければ tensor のみのリスト)
+    """
+    mode = get_mode(tensor)
+    domain_profile = tensor["profile"][DOMAIN_PROFILE]
+    codomain_profile = tensor["profile"][CODOMAIN_PROFILE]
+    domain_points = [tuple(point) for point in create_indexies([get_factor_values(item) for item in domain_profile])]
+    codomain_points = [tuple(point) for point in create_indexies([get_factor_values(item) for item in codomain_profile])]
+    weights = {}
+    for strand, weight in tensor["strands"].items():
+        strand_from, strand_to = get_lattice_points(strand)
+        weights[(tuple(get_component_value(component) for component in strand_from),
+                 tuple(get_component_value(component) for component in strand_to))] = to_probability(weight, mode)
+
+    for domain_cut in range(len(domain_profile) + 1):
+        for codomain_cut in range(len(codomain_profile) + 1):
+            if (domain_cut, codomain_cut) in [(0, 0), (len(domain_profile), len(codomain_profile))]:
+                continue
+            # 域の格子点の前後の部分の一方を最初の格子点に固定し、余域のもう一方の部分で和をとる
+            reference = domain_points[0]
+            weights_front = {}
+            weights_back = {}
+            for domain_point in domain_points:
+                for codomain_point in codomain_points:
+                    if domain_point[domain_cut:] == reference[domain_cut:]:
+                        key = (domain_point[:domain_cut], codomain_point[:codomain_cut])
+                        weights_front[key] = weights_front.get(key, 0) + weights.get((domain_point, codomain_point), 0)
+                    if domain_point[:domain_cut] == reference[:domain_cut]:
+                        key = (domain_point[domain_cut:], codomain_point[codomain_cut:])
+                        weights_back[key] = weights_back.get(key, 0) + weights.get((domain_point, codomain_point), 0)
+            if all(abs(weights.get((domain_point, codomain_point), 0) -
+                       weights_front[(domain_point[:domain_cut], codomain_point[:codomain_cut])] *
+                       weights_back[(domain_point[domain_cut:], codomain_point[codomain_cut:])]) <= tolerance
+                   for domain_point in domain_points for codomain_point in codomain_points):
+                tensor_front = create_factor_tensor(
+                    [domain_profile[:domain_cut], codomain_profile[:codomain_cut]], weights_front, mode)
+                tensor_back = create_factor_tensor(
+                    [domain_profile[domain_cut:], codomain_profile[codomain_cut:]], weights_back, mode)
+                if "error_bound" in tensor:
+                    tensor_front["error_bound"] = tensor["error_bound"]
+                return split_independent_factors(tensor_front, tolerance) + split_independent_factors(tensor_back, tolerance)
+    return [tensor]
+
+
+def create_factor_tensor(profile, weights, mode):
+    # 因子の値のタプルの対をキーとする確率の辞書から、数値モード mode のテンソルを作成
+    tensor_result = {}
+    strands_result = {}
+    tensor_result["profile"] = profile
+    for (domain_values, codomain_values), weight in weights.items():
+        strand_from = [create_lattice_component(item, value) for item, value in zip(profile[DOMAIN_PROFILE], domain_values)]
+        strand_to = [create_lattice_component(item, value) for item, value in zip(profile[CODOMAIN_PROFILE], codomain_values)]
+        strands_result[str([strand_from, strand_to])] = convert_value(weight, MODE_FLOAT64, MODE_LOG) if mode == MODE_LOG else weight
+    tensor_result["strands"] = strands_result
+    return set_result_mode(tensor_result, mode)
+
+
+def factored_composition(tensor_x, tensor_y):
+    """
+    展開されていないテンソル積どうしの結合を因子ごとに算出
+    (A#B)(C#D) = (AC)#(BD) を用いる。tensor_x の余域と tensor_y の域の因子の区切りが一致しない部分は、
+    区切りが一致するまで因子をまとめてから結合する。
+    @param tensor_x テンソル
+    @param tensor_y テンソル
+    @return tensor_result テンソル (因子の区切りを揃えられなければ None)
+    """
+    factors_x = get_factors(tensor_x)
+    factors_y = get_factors(tensor_y)
+    factors_result = []
+    group_x = []
+    group_y = []
+    codomain_x = []
+    domain_y = []
+    while factors_x or factors_y:
+        # 余域と域のプロファイルの長さが短い側に因子を追加
+        if factors_x and (len(codomain_x) <= len(domain_y) or not factors_y):
+            factor = factors_x.pop(0)
+            group_x.append(factor)
+            codomain_x.extend(factor["profile"][CODOMAIN_PROFILE])
+        else:
+            factor = factors_y.pop(0)
+            group_y.append(factor)
+            domain_y.extend(factor["profile"][DOMAIN_PROFILE])
+        if group_x and group_y and len(codomain_x) == len(domain_y):
+            if codomain_x != domain_y:
+                return None
+            factors_result.append(composition(group_factors(group_x), group_factors(group_y)))
+            group_x = []
+            group_y = []
+            codomain_x = []
+            domain_y = []
+    if group_x or group_y:
+        return None
+
+    if len(factors_result) == 1:
+        return factors_result[0]
+    tensor_result = {}
+    tensor_result["profile"] = [
+        tensor_x["profile"][DOMAIN_PROFILE],
+        tensor_y["profile"][CODOMAIN_PROFILE]
+    ]
+    tensor_result["factors"] = factors_result
+    return tensor_result
+
+
+@cached_operation
+@budgeted_operation
 def unit_tensor(list_x):
     """
     リストから単位テンソルを作成
@@ -305,10 +1259,13 @@ def unit_tensor(list_x):
     return tensor_result
 
 
-def delta(list_x):
+@cached_operation
+@budgeted_operation
+def delta(list_x, zeros=True):
     """
     リストが与えられたとき、マルコフ・テンソル Δ を構成
     @param list_x リスト
+    @param zeros False なら重み 0 のストランドを作らず、重み 1 の |a| 個のストランドのみとする
     """
     tensor_result = {}
     strands_result = {}
@@ -331,6 +1288,14 @@ def delta(list_x):
         base_list_a = [create_n_bar(item) for item in domain]
         base_list_a_a = [create_n_bar(item) for item in codomain]
 
+    if not zeros:
+        for x in create_indexies(base_list_a):
+            if is_number:
+                tensor_result["strands"][str([x, x + x])] = 1
+            else:
+                tensor_result["strands"][str([[[item_] for item_ in x], [[item_] for item_ in x + x]])] = 1
+        return tensor_result
+
     for item in itertools.product(create_indexies(base_list_a), create_indexies(base_list_a_a)):
         x = item[DOMAIN_LATTICE_POINT]
         codomain_lattice_point = item[CODOMAIN_LATTICE_POINT]
@@ -353,6 +1318,8 @@ def delta(list_x):
     return tensor_result
 
 
+@cached_operation
+@budgeted_operation
 def exclamation(list_x):
     """
     リストが与えられたとき、マルコフ・テンソル ! を構成
@@ -406,7 +1373,7 @@ def jointification_process(tensor_x, tensor_y, strand_x, strand_y, strands_resul
 
     if strand_to_x == strand_from_y:  # tensor_x のあるストランドの終点と、tensor_y のあるストランドの始点が一致した場合
         strand_lattice_points = str([strand_from, strand_to])
-        mult = tensor_x["strands"][strand_x] * tensor_y["strands"][strand_y]
+        mult = mode_mult(get_mode(tensor_result), tensor_x["strands"][strand_x], tensor_y["strands"][strand_y])
         if DEBUG:
             print("---")
             print("  strand_from_x: {0}, strand_to_x: {1}, tensor_x[strands][strand_x]: {2}".format(
@@ -422,6 +1389,8 @@ def jointification_process(tensor_x, tensor_y, strand_x, strand_y, strands_resul
     return tensor_result, strands_result
 
 
+@cached_operation
+@budgeted_operation
 def jointification(tensor_x, tensor_y):
     """
     同時化を算出
@@ -429,8 +1398,13 @@ def jointification(tensor_x, tensor_y):
     @param tensor_y テンソル a -> b
     @return tensor_result テンソル [] -> a#b
     """
+    tensor_x = materialize(tensor_x)
+    tensor_y = materialize(tensor_y)
+    tensor_x, tensor_y, mode = align_modes(tensor_x, tensor_y)
     tensor_result = {}
     strands_result = {}
+    if mode is not None:
+        tensor_result["mode"] = mode
     if check_composable(tensor_x, tensor_y):
         domain = []
         codomain = []
@@ -444,9 +1418,12 @@ def jointification(tensor_x, tensor_y):
                 tensor_x, tensor_y, strand_x, strand_y, strands_result, tensor_result)
     tensor_result["strands"] = strands_result
 
-    return tensor_result
+    return drop_zero_strands(set_result_mode(
+        tensor_result, mode, tensor_x.get("error_bound", 0) + tensor_y.get("error_bound", 0)))
 
 
+@cached_operation
+@budgeted_operation
 def conditionalization(tensor_x, concat_start_index):
     """
     条件化を算出
@@ -455,6 +1432,11 @@ def conditionalization(tensor_x, concat_start_index):
     @return tensor_result テンソル a -> b 
     """
 
+    tensor_x = materialize(tensor_x)
+    mode = get_mode(tensor_x)
+    backend_conditionalization = dispatch("conditionalization", tensor_x)
+    if backend_conditionalization is not None:
+        return drop_zero_strands(backend_conditionalization(tensor_x, concat_start_index, mode))
     tensor_result = {}
     strands_result = {}
     total = {}
@@ -469,7 +1451,7 @@ def conditionalization(tensor_x, concat_start_index):
         _, strand_to = get_lattice_points(strand)
         total_strand_from = str([strand_to[0:concat_start_index - 1]])
         if total_strand_from in total.keys():  # もし既にキー strand_result に値が設定されていれば加算
-            total[total_strand_from] += tensor_x["strands"][strand]
+            total[total_strand_from] = mode_add(mode, total[total_strand_from], tensor_x["strands"][strand])
         else:
             total[total_strand_from] = tensor_x["strands"][strand]
 
@@ -478,13 +1460,21 @@ def conditionalization(tensor_x, concat_start_index):
         total_strand_from = str([strand_to[0:concat_start_index - 1]])
         strand_lattice_points = str(
             [strand_to[0:concat_start_index - 1], strand_to[concat_start_index - 1:len(codomain_profile)]])
-        strands_result[strand_lattice_points] = tensor_x["strands"][strand] / \
-            (total[total_strand_from] if total[total_strand_from] > 0 else 99999) # TODO: ゼロ除算に対応すること
+        strands_result[strand_lattice_points] = mode_divide(mode, tensor_x["strands"][strand],
+            (total[total_strand_from] if mode_is_positive(mode, total[total_strand_from]) else 99999)) # TODO: ゼロ除算に対応すること
     tensor_result["strands"] = strands_result
 
-    return tensor_result
+    # 同時分布の誤差 e は、周辺の重み P' で割ることで各列について高々 2e / P' に拡大する
+    error_bound = tensor_x.get("error_bound", 0)
+    if error_bound > 0:
+        positive_totals = [to_probability(value, mode) for value in total.values() if mode_is_positive(mode, value)]
+        error_bound = 2 * error_bound / min(positive_totals) if positive_totals else math.inf
 
+    return drop_zero_strands(set_result_mode(tensor_result, mode, error_bound))
 
+
+@cached_operation
+@budgeted_operation
 def first_marginalization(tensor, concat_start_index):
     """
     第一周辺化を算出
@@ -517,6 +1507,8 @@ def first_marginalization(tensor, concat_start_index):
         print("cannot compute first marginalization")
 
 
+@cached_operation
+@budgeted_operation
 def second_marginalization(tensor, concat_start_index):
     """
     第二周辺化を算出
@@ -545,6 +1537,8 @@ def second_marginalization(tensor, concat_start_index):
         print("cannot compute second marginalization")
 
 
+@cached_operation
+@budgeted_operation
 def swap(list_a, list_b):
     """
     リストからテンソル Xa,b を作成
@@ -604,6 +1598,8 @@ def swap(list_a, list_b):
     return tensor_result
 
 
+@cached_operation
+@budgeted_operation
 def conversion(tensor_empty_a, tensor_a_b):
     """
     反転
@@ -623,11 +1619,341 @@ def conversion(tensor_empty_a, tensor_a_b):
     ) # [] -> b&a => b -> a
 
 
+# build_index で作成したストランドの索引 (ストランドの辞書の id をキーとし、最近使った順に INDEX_CACHE_SIZE 個まで保持)
+INDEXES = OrderedDict()
+INDEX_CACHE_SIZE = 16
+
+
+def build_index(tensor):
+    """
+    ストランドの索引を作成し、テンソルの辞書とは別に INDEXES に保持
+    索引は、ストランドごとの格子点の対、域の格子点ごとのストランドのリスト、
+    (域または余域, 因子の位置, 値) ごとのストランドのリストからなる。
+    @param tensor テンソル
+    @return index 索引
+    """
+    index = {}
+    points = {}
+    domain = {}
+    factors = {}
+    for strand in tensor["strands"].keys():
+        strand_from, strand_to = get_lattice_points(strand)
+        points[strand] = (strand_from, strand_to)
+        domain.setdefault(str(strand_from), []).append(strand)
+        for side, lattice_point in ((DOMAIN_PROFILE, strand_from), (CODOMAIN_PROFILE, strand_to)):
+            for position, component in enumerate(lattice_point):
+                factors.setdefault((side, position, get_component_value(component)), []).append(strand)
+    # 索引が残っている間に id が再利用されないよう、ストランドの辞書への参照を保持する
+    index["strands"] = tensor["strands"]
+    index["points"] = points
+    index["domain"] = domain
+    index["factors"] = factors
+    INDEXES[id(tensor["strands"])] = index
+    INDEXES.move_to_end(id(tensor["strands"]))
+    while len(INDEXES) > INDEX_CACHE_SIZE:
+        INDEXES.popitem(last=False)
+    return index
+
+
+def get_index(tensor):
+    """
+    ストランドの索引を取得 (ストランドの辞書が置き換えられたり、数が変わっていれば作り直す)
+    同じ数のまま辞書のキーを置き換えた場合は、索引を引く側で候補のキーを確かめ、ない場合に build_index で作り直す。
+    @param tensor テンソル
+    @return index 索引
+    """
+    strands = tensor["strands"]
+    index = INDEXES.get(id(strands))
+    if index is None or index["strands"] is not strands or len(index["points"]) != len(strands):
+        return build_index(tensor)
+    INDEXES.move_to_end(id(strands))
+    return index
+
+
+def select_strands(tensor, domain_point=None, domain_values=None, codomain_values=None, index=None):
+    """
+    索引を用いて条件に合うストランドを取得
+    @param tensor テンソル
+    @param domain_point 域の格子点 (例: [['H'], ['S-'], ['C-']])
+    @param domain_values 域の因子の位置 (0 始まり) をキー、値を値とする辞書 (例: {0: 'H'})
+    @param codomain_values 余域の因子の位置 (0 始まり) をキー、値を値とする辞書
+    @param index build_index で作成した索引 (省略時は get_index で取得)
+    @return ストランドをキー、重みを値とする辞書
+    """
+    tensor = materialize(tensor)
+    if index is None:
+        index = get_index(tensor)
+    domain_profile = tensor["profile"][DOMAIN_PROFILE]
+    if domain_point is None and domain_values and len(domain_values) == len(domain_profile):
+        # 域の因子がすべて固定されていれば域の格子点で引く
+        domain_point = [
+            create_lattice_component(item, get_component_value(domain_values[position]))
+            for position, item in enumerate(domain_profile)]
+    conditions = []
+    for side, values in ((DOMAIN_PROFILE, domain_values), (CODOMAIN_PROFILE, codomain_values)):
+        for position in (values or {}).keys():
+            conditions.append((side, position, get_component_value(values[position])))
+
+    # 最も候補の少ない条件から絞り込む
+    if domain_point is not None:
+        candidates = index["domain"].get(str(domain_point), [])
+    elif conditions:
+        candidates = min((index["factors"].get(condition, []) for condition in conditions), key=len)
+    else:
+        candidates = list(tensor["strands"].keys())
+
+    strands_result = {}
+    for strand in candidates:
+        if strand not in tensor["strands"]:
+            # 索引の作成後にキーが置き換えられたので、作り直して引き直す
+            return select_strands(tensor, domain_point, domain_values, codomain_values, build_index(tensor))
+        lattice_points = index["points"][strand]
+        if all(get_component_value(lattice_points[side][position]) == value for side, position, value in conditions):
+            strands_result[strand] = tensor["strands"][strand]
+    return strands_result
+
+
+def slice_tensor(tensor, domain_values=None, codomain_values=None):
+    """
+    因子の値を固定した切り口を作成 (固定した因子はプロファイルから除く)
+    @param tensor テンソル
+    @param domain_values 域の因子の位置 (0 始まり) をキー、値を値とする辞書
+    @param codomain_values 余域の因子の位置 (0 始まり) をキー、値を値とする辞書
+    @return tensor_result テンソル
+    """
+    tensor = materialize(tensor)
+    domain_values = domain_values or {}
+    codomain_values = codomain_values or {}
+
+    tensor_result = {}
+    strands_result = {}
+    tensor_result["profile"] = [
+        [item for position, item in enumerate(tensor["profile"][DOMAIN_PROFILE]) if position not in domain_values],
+        [item for position, item in enumerate(tensor["profile"][CODOMAIN_PROFILE]) if position not in codomain_values]
+    ]
+    strands = select_strands(tensor, domain_values=domain_values, codomain_values=codomain_values)
+    # select_strands が索引を作り直した場合も、取得した時点の索引を使う
+    index = get_index(tensor)
+    for strand, weight in strands.items():
+        strand_from, strand_to = index["points"][strand]
+        strand_lattice_points = str([
+            [component for position, component in enumerate(strand_from) if position not in domain_values],
+            [component for position, component in enumerate(strand_to) if position not in codomain_values]
+        ])
+        strands_result[strand_lattice_points] = weight
+    tensor_result["strands"] = strands_result
+    if "mode" in tensor:
+        tensor_result["mode"] = tensor["mode"]
+
+    return tensor_result
+
+
+def get_column(tensor, domain_point):
+    """
+    域の格子点を与えたときの余域上の分布を取得
+    @param tensor テンソル a -> b
+    @param domain_point 域 a の格子点
+    @return tensor_result テンソル [] -> b
+    """
+    return slice_tensor(tensor, domain_values={position: component for position, component in enumerate(domain_point)})
+
+
+def to_dataframe(tensor):
+    """
+    テンソルを pandas の DataFrame に変換
+    域と余域の各因子を MultiIndex の階層 (domain_0, ..., codomain_0, ...) とし、重みを列 weight にもつ。
+    プロファイルと数値モードは DataFrame の attrs に保持する。
+    @param tensor テンソル
+    @return frame DataFrame
+    """
+    tensor = materialize(tensor)
+    domain_profile = tensor["profile"][DOMAIN_PROFILE]
+    codomain_profile = tensor["profile"][CODOMAIN_PROFILE]
+    names = ["domain_{0}".format(position) for position in range(len(domain_profile))] + [
+        "codomain_{0}".format(position) for position in range(len(codomain_profile))]
+
+    import pandas as pd
+
+    tuples = []
+    for strand in tensor["strands"].keys():
+        strand_from, strand_to = get_lattice_points(strand)
+        tuples.append(tuple(get_component_value(component) for component in strand_from + strand_to))
+    weights = list(tensor["strands"].values())
+    if get_mode(tensor) in (MODE_FLOAT64, MODE_LOG):
+        weights = pd.array(weights, dtype="float64")
+    elif get_mode(tensor) == MODE_FLOAT32:
+        weights = pd.array(weights, dtype="float32")
+
+    if names:
+        index = pd.MultiIndex.from_tuples(tuples, names=names)
+    else:
+        index = pd.RangeIndex(len(tuples))
+    frame = pd.DataFrame({"weight": weights}, index=index, copy=False)
+    frame.attrs["profile"] = tensor["profile"]
+    frame.attrs["mode"] = get_mode(tensor)
+    return frame
+
+
+def from_dataframe(frame, profile=None, column="weight"):
+    """
+    pandas の DataFrame からテンソルを作成
+    @param frame to_dataframe と同じ形式の DataFrame
+    @param profile プロファイル (省略時は attrs に保持したもの、なければ各階層の値から作成)
+    @param column 重みの列名
+    @return tensor_result テンソル
+    """
+    if profile is None:
+        profile = frame.attrs.get("profile")
+    names = [name for name in frame.index.names if name is not None]
+    domain_names = [name for name in names if name.startswith("domain_")]
+    codomain_names = [name for name in names if name.startswith("codomain_")]
+    if profile is None:
+        def infer(name):
+            values = list(frame.index.get_level_values(name).unique())
+            if all(type(value) == int for value in values):
+                return max(values)
+            return values
+        profile = [[infer(name) for name in domain_names], [infer(name) for name in codomain_names]]
+
+    tensor_result = {}
+    strands_result = {}
+    tensor_result["profile"] = profile
+    number_of_domain = len(profile[DOMAIN_PROFILE])
+    weights = frame[column].tolist()
+    keys = frame.index.tolist() if names else [()] * len(weights)
+    for key, weight in zip(keys, weights):
+        key = key if type(key) == tuple else (key,)
+        strand_from = [
+            create_lattice_component(item, value) for item, value in zip(profile[DOMAIN_PROFILE], key[:number_of_domain])]
+        strand_to = [
+            create_lattice_component(item, value) for item, value in zip(profile[CODOMAIN_PROFILE], key[number_of_domain:])]
+        strands_result[str([strand_from, strand_to])] = weight
+    tensor_result["strands"] = strands_result
+    if frame.attrs.get("mode") is not None:
+        tensor_result["mode"] = frame.attrs["mode"]
+
+    return tensor_result
+
+
+def display_width(text):
+    # 全角文字を 2 文字分として表示幅を算出
+    return sum(2 if unicodedata.east_asian_width(character) in ("F", "W") else 1 for character in text)
+
+
+def format_lattice_point(lattice_point):
+    # 格子点を (黒, 金) のような見出しにする
+    values = [str(get_component_value(component)) for component in lattice_point]
+    if len(values) == 1:
+        return values[0]
+    return "(" + ", ".join(values) + ")"
+
+
+def format_tensor(tensor, max_rows=20, max_columns=8):
+    """
+    テンソルを、列が域の格子点、行が余域の格子点の表 (各列の総和が 1) の文字列にする
+    表示する格子点のキーを直接作って辞書を引くので、手間は表示するセルの数に比例する。
+    @param tensor テンソル
+    @param max_rows 表示する行の最大数 (超えた分は ... と表示)
+    @param max_columns 表示する列の最大数 (超えた分は ... と表示)
+    @return 表の文字列
+    """
+    tensor = materialize(tensor)
+    mode = get_mode(tensor)
+    domain_profile = tensor["profile"][DOMAIN_PROFILE]
+    codomain_profile = tensor["profile"][CODOMAIN_PROFILE]
+
+    def lattice_points(profile, limit):
+        values = itertools.product(*[get_factor_values(item) for item in profile])
+        points = [
+            [create_lattice_component(item, value) for item, value in zip(profile, point)]
+            for point in itertools.islice(values, limit + 1)]
+        return points[:limit], len(points) > limit
+
+    columns, more_columns = lattice_points(domain_profile, max_columns)
+    rows, more_rows = lattice_points(codomain_profile, max_rows)
+
+    table = [[""] + [format_lattice_point(column) for column in columns] + (["..."] if more_columns else [])]
+    for row in rows:
+        line = [format_lattice_point(row)]
+        for column in columns:
+            weight = tensor["strands"].get(str([column, row]), 0)
+            line.append(str(to_probability(weight, mode) if mode == MODE_LOG else weight))
+        if more_columns:
+            line.append("...")
+        table.append(line)
+    if more_rows:
+        table.append(["..."] + [""] * (len(table[0]) - 1))
+
+    widths = [max(display_width(line[position]) for line in table) for position in range(len(table[0]))]
+    lines = []
+    for number, line in enumerate(table):
+        lines.append("  ".join(
+            cell + " " * (width - display_width(cell)) for cell, width in zip(line, widths)).rstrip())
+        if number == 0:
+            lines.append("-" * (sum(widths) + 2 * (len(widths) - 1)))
+    return "\n".join(lines)
+
+
+def tensor_to_json(tensor):
+    """
+    テンソルを JSON に変換できる辞書にする (Fraction の重みは "1/10" のような文字列にする)
+    @param tensor テンソル
+    """
+    tensor = materialize(tensor)
+    tensor_result = {}
+    tensor_result["profile"] = tensor["profile"]
+    tensor_result["strands"] = {
+        strand: str(weight) if type(weight) == Fraction else weight for strand, weight in tensor["strands"].items()}
+    for key in ("mode", "error_bound"):
+        if key in tensor:
+            tensor_result[key] = tensor[key]
+    return tensor_result
+
+
+def tensor_from_json(data):
+    """
+    tensor_to_json の形式の辞書からテンソルを作成 (文字列の重みは Fraction とする)
+    @param data 辞書
+    """
+    tensor_result = {}
+    tensor_result["profile"] = data["profile"]
+    tensor_result["strands"] = {
+        strand: Fraction(weight) if type(weight) == str else weight for strand, weight in data["strands"].items()}
+    for key in ("mode", "error_bound"):
+        if key in data:
+            tensor_result[key] = data[key]
+    return tensor_result
+
+
+def save_tensor(tensor, path):
+    """
+    テンソルを JSON ファイルに保存
+    @param tensor テンソル
+    @param path ファイルのパス
+    """
+    import json
+
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(tensor_to_json(tensor), file, ensure_ascii=False)
+
+
+def load_tensor(path):
+    """
+    JSON ファイルからテンソルを読み込む
+    @param path ファイルのパス
+    """
+    import json
+
+    with open(path, encoding="utf-8") as file:
+        return tensor_from_json(json.load(file))
+
+
 def print_tensor(tensor):
     """
     テンソルを標準出力に表示
     @param tensor テンソル
     """
+    tensor = materialize(tensor)
     print("---")
     print("profile: ", tensor["profile"])
     strands = tensor["strands"]
@@ -815,4 +2141,8 @@ def main():
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # 引数があればバッチ実行 (python -m markov_tensor --help を参照)
+        import markov_tensor_runner
+        sys.exit(markov_tensor_runner.main(sys.argv[1:]))
     main()
@@ -0,0 +1,228 @@
+"""
+吸収的なマルコフ連鎖の解析
+
+テンソル a -> a を状態 a 上のマルコフ連鎖の遷移とみなし、多くのステップを結合する代わりに連立一次方程式を解いて次を求める。
+- 閉じたクラス (出ていく遷移のない強連結成分。吸収状態は大きさ 1 の閉じたクラス) と過渡的な状態: absorbing_classes
+- 各状態から各閉じたクラスに吸収される確率: absorption_probabilities
+- 吸収されるまでの期待ステップ数: expected_steps
+- 基本行列 N = (I - Q)^-1 (Q は過渡的な状態の間の遷移): fundamental_matrix
+
+過渡的な状態の数が EXACT_MAX_STATES 以下で、重みが Fraction (または整数) のテンソルは Fraction のまま厳密に解く。
+それ以外は SciPy の疎行列の LU 分解で float64 として解く。
+"""
+from fractions import Fraction
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
+import markov_tensor
+import markov_tensor_numpy
+import markov_tensor_sparse
+
+EXACT_MAX_STATES = 64
+
+
+def analyze(tensor):
+    """
+    遷移の強連結成分から、閉じたクラスと過渡的な状態を求める
+    @param tensor テンソル a -> a
+    @return structure 状態の格子点、遷移の疎行列、閉じたクラス (状態の番号のリスト) のリスト、過渡的な状態の番号のリストをもつ辞書
+    """
+    tensor = markov_tensor.materialize(tensor)
+    domain_profile = tensor["profile"][markov_tensor.DOMAIN_PROFILE]
+    if domain_profile != tensor["profile"][markov_tensor.CODOMAIN_PROFILE]:
+        raise ValueError("tensor must be a -> a")
+
+    matrix = markov_tensor_sparse.to_csr(tensor, np.float64)
+    matrix.eliminate_zeros()
+    _, components = scipy.sparse.csgraph.connected_components(matrix, directed=True, connection="strong")
+    coo = matrix.tocoo()
+    leaving = components[coo.row] != components[coo.col]
+    open_components = set(components[coo.row[leaving]].tolist())
+
+    classes = {}
+    transient = []
+    for state, component in enumerate(components.tolist()):
+        if component in open_components:
+            transient.append(state)
+        else:
+            classes.setdefault(component, []).append(state)
+
+    structure = {}
+    structure["tensor"] = tensor
+    structure["states"] = markov_tensor_numpy.lattice_points(domain_profile)
+    structure["matrix"] = matrix
+    structure["classes"] = sorted(classes.values())
+    structure["transient"] = transient
+    return structure
+
+
+def absorbing_classes(tensor):
+    """
+    閉じたクラスと過渡的な状態を求める
+    @param tensor テンソル a -> a
+    @return {"classes": 閉じたクラス (格子点のリスト) のリスト, "transient": 過渡的な状態の格子点のリスト}
+    """
+    structure = analyze(tensor)
+    return {
+        "classes": [[structure["states"][state] for state in states] for states in structure["classes"]],
+        "transient": [structure["states"][state] for state in structure["transient"]]
+    }
+
+
+def is_exact(structure):
+    # Fraction のまま厳密に解くか
+    tensor = structure["tensor"]
+    return markov_tensor.get_mode(tensor) in [None, markov_tensor.MODE_RATIONAL] and \
+        len(structure["transient"]) <= EXACT_MAX_STATES and \
+        all(type(weight) in [int, Fraction] for weight in tensor["strands"].values())
+
+
+def exact_transient_matrix(structure):
+    # 過渡的な状態の行について、遷移の重みを Fraction の辞書 {(行, 列): 重み} とする
+    tensor = structure["tensor"]
+    profile = tensor["profile"][markov_tensor.DOMAIN_PROFILE]
+    positions = markov_tensor_numpy.factor_positions(profile)
+    transient = set(structure["transient"])
+    weights = {}
+    for strand in tensor["strands"].keys():
+        strand_from, strand_to = markov_tensor.get_lattice_points(strand)
+        row = markov_tensor_numpy.lattice_point_index(profile, strand_from, positions)
+        if row in transient and tensor["strands"][strand] != 0:
+            weights[(row, markov_tensor_numpy.lattice_point_index(profile, strand_to, positions))] = Fraction(tensor["strands"][strand])
+    return weights
+
+
+def solve_exact(structure, right_hand_sides):
+    """
+    (I - Q) X = B を Fraction のガウス・ジョルダン消去法で解く
+    @param structure analyze の結果
+    @param right_hand_sides 過渡的な状態の行ごとの B の行のリスト
+    @return X の行のリスト
+    """
+    transient = structure["transient"]
+    position = {state: index for index, state in enumerate(transient)}
+    weights = exact_transient_matrix(structure)
+    size = len(transient)
+    rows = []
+    for index, state in enumerate(transient):
+        row = [Fraction(int(index == column)) for column in range(size)]
+        for column_state in transient:
+            row[position[column_state]] -= weights.get((state, column_state), 0)
+        rows.append(row + [Fraction(value) for value in right_hand_sides[index]])
+
+    for column in range(size):
+        pivot = next(index for index in range(column, size) if rows[index][column] != 0)
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        pivot_value = rows[column][column]
+        rows[column] = [value / pivot_value for value in rows[column]]
+        for index in range(size):
+            if index != column and rows[index][column] != 0:
+                factor = rows[index][column]
+                rows[index] = [value - factor * pivot_row_value for value, pivot_row_value in zip(rows[index], rows[column])]
+    return [row[size:] for row in rows]
+
+
+def solve_sparse(structure, right_hand_sides):
+    """
+    (I - Q) X = B を疎行列の LU 分解で解く
+    @param structure analyze の結果
+    @param right_hand_sides 過渡的な状態の行ごとの B の配列 (|T| x k)
+    @return X の配列
+    """
+    transient = structure["transient"]
+    matrix_q = structure["matrix"][transient][:, transient]
+    matrix_a = (scipy.sparse.identity(len(transient), format="csc") - matrix_q).tocsc()
+    solution = scipy.sparse.linalg.splu(matrix_a).solve(np.asarray(right_hand_sides, dtype=np.float64))
+    return solution.reshape(len(transient), -1)
+
+
+def solve(structure, right_hand_sides):
+    # 厳密に解けるなら Fraction、そうでなければ float64 で解く
+    if not structure["transient"]:
+        return []
+    if is_exact(structure):
+        return solve_exact(structure, right_hand_sides)
+    return solve_sparse(structure, right_hand_sides).tolist()
+
+
+def create_result(structure, profile, weights):
+    # 行列の要素 {(行, 列): 重み} からテンソルを作成 (ない要素は 0)
+    tensor_result = {}
+    strands_result = {}
+    tensor_result["profile"] = profile
+    codomain_points = markov_tensor_numpy.lattice_points(profile[markov_tensor.CODOMAIN_PROFILE])
+    for row, domain_point in enumerate(structure["states"]):
+        for column, codomain_point in enumerate(codomain_points):
+            strands_result[str([domain_point, codomain_point])] = weights.get((row, column), 0)
+    tensor_result["strands"] = strands_result
+    mode = markov_tensor.get_mode(structure["tensor"]) if is_exact(structure) else markov_tensor.MODE_FLOAT64
+    return markov_tensor.set_result_mode(tensor_result, mode)
+
+
+def absorption_probabilities(tensor):
+    """
+    各状態から各閉じたクラスに吸収される確率を算出
+    @param tensor テンソル a -> a
+    @return tensor_result テンソル a -> [["class 1", "class 2", ...]] (クラスの順序は absorbing_classes と同じ)
+    """
+    structure = analyze(tensor)
+    classes = structure["classes"]
+    matrix = structure["matrix"]
+    exact = is_exact(structure)
+    weights = exact_transient_matrix(structure) if exact else None
+
+    if exact:
+        right_hand_sides = [
+            [sum((weights.get((state, column), 0) for column in states), Fraction(0)) for states in classes]
+            for state in structure["transient"]]
+    else:
+        # 過渡的な状態の行とクラスの指示行列の積で、すべてのクラスへの遷移の和を一度に求める
+        indicator = scipy.sparse.csr_matrix(
+            (np.ones(sum(len(states) for states in classes)),
+             ([state for states in classes for state in states],
+              [index for index, states in enumerate(classes) for _ in states])),
+            shape=(matrix.shape[0], len(classes)))
+        right_hand_sides = (matrix[structure["transient"]] @ indicator).toarray()
+
+    probabilities = {}
+    for state, row in zip(structure["transient"], solve(structure, right_hand_sides)):
+        for index, value in enumerate(row):
+            probabilities[(state, index)] = value
+    for index, states in enumerate(classes):
+        for state in states:
+            probabilities[(state, index)] = 1
+
+    labels = ["class {0}".format(index + 1) for index in range(len(classes))]
+    return create_result(structure, [tensor["profile"][markov_tensor.DOMAIN_PROFILE], [labels]], probabilities)
+
+
+def expected_steps(tensor):
+    """
+    各状態から閉じたクラスに吸収されるまでの期待ステップ数を算出 (閉じたクラスの状態は 0)
+    @param tensor テンソル a -> a
+    @return tensor_result テンソル a -> [] (重みが期待ステップ数)
+    """
+    structure = analyze(tensor)
+    steps = {}
+    for state, row in zip(structure["transient"], solve(structure, [[1] for _ in structure["transient"]])):
+        steps[(state, 0)] = row[0]
+    return create_result(structure, [tensor["profile"][markov_tensor.DOMAIN_PROFILE], []], steps)
+
+
+def fundamental_matrix(tensor):
+    """
+    基本行列 N = (I - Q)^-1 を算出
+    N の (i, j) 要素は、過渡的な状態 i から出発して吸収されるまでに状態 j を訪れる回数の期待値。
+    過渡的な状態の個数の 2 乗の大きさの密な行列になる。
+    @param tensor テンソル a -> a
+    @return tensor_result テンソル a -> a (過渡的でない状態の行と列は 0)
+    """
+    structure = analyze(tensor)
+    transient = structure["transient"]
+    identity = [[int(row == column) for column in range(len(transient))] for row in range(len(transient))]
+    visits = {}
+    for state, row in zip(transient, solve(structure, identity)):
+        for column_state, value in zip(transient, row):
+            visits[(state, column_state)] = value
+    return create_result(structure, tensor["profile"], visits)
@@ -0,0 +1,398 @@
+"""
+プロファイルからの計算量の見積もりと、メモリの予算の確認
+
+演算を実行する前に、入力のプロファイル (とストランド数) から、結果のプロファイルとストランド数、
+メモリのバイト数、おおよその浮動小数点演算の回数 (FLOPs) を見積もる。
+  estimate = estimate_operation("composition", tensor_x, tensor_y)
+  estimate = estimate_expression("conversion(first_marginalization(p, 2), h)", {"p": tensor_p, "h": tensor_h["profile"]})
+  print(format_estimate(estimate))
+
+テンソルの代わりにプロファイルのみを渡してもよい (すべての格子点の対にストランドがあるとみなす)。
+見積もりは密な場合の上界で、FLOPs は密な行列として計算した場合の積和の回数とする。
+"peak_bytes" は途中で作るテンソル (周辺化の単位テンソルとテンソル積、反転の同時化とスワップなど) が
+同時にメモリにある量の最大値で、入力のテンソルは含めない。
+
+markov_tensor.MEMORY_BUDGET (バイト) を設定すると、各演算の前に guard で "peak_bytes" を確認し、
+予算を超える場合は列挙を始める前に、見積もりを含むメッセージの MemoryError を送出する。
+markov_tensor.MEMORY_BUDGET_ACTION を "out_of_core" とすると、markov_tensor_out_of_core が実装する演算
+(結合、周辺化、条件化) はブロック単位の計算に回し、結果を OUT_OF_CORE_DIRECTORY の下のディレクトリに置いた
+テンソル {"profile": ..., "blocked": パス} として返す。このテンソルを渡された演算も同様にブロック単位で計算し、
+materialize で辞書のテンソルに戻す。ブロックは float64 で保存するので、厳密な重み (Fraction) の入力は回さない。
+結果のディレクトリは remove_blocked で削除するか、out_of_core_directory の with の中で計算して抜けるときにまとめて削除する。
+"""
+import ast
+import contextlib
+from fractions import Fraction
+import os
+import shutil
+import tempfile
+import markov_tensor
+
+# ストランド 1 本あたりの辞書のメモリのバイト数 (キーの文字列と重みを含む、数値モードごとの目安)
+BYTES_PER_STRAND = {
+    markov_tensor.MODE_RATIONAL: 170,
+    markov_tensor.MODE_FLOAT64: 90,
+    markov_tensor.MODE_FLOAT32: 90,
+    markov_tensor.MODE_LOG: 90
+}
+# ブロック単位の計算の結果を置くディレクトリ (None なら一時ディレクトリ)
+OUT_OF_CORE_DIRECTORY = None
+# ブロック単位で計算できる演算
+OUT_OF_CORE_OPERATIONS = ["composition", "first_marginalization", "second_marginalization", "conditionalization"]
+
+
+def side_size(profile_side):
+    # 域または余域の格子点の数
+    total = 1
+    for item in profile_side:
+        total *= item if type(item) == int else len(item)
+    return total
+
+
+def describe(value):
+    """
+    テンソル、プロファイル、見積もりを、見積もりに使う形 (プロファイル、ストランド数、数値モード) にする
+    入力のテンソルは既にメモリにあるので、バイト数は 0 とする。
+    @param value テンソル、プロファイル [domain, codomain]、または見積もり
+    @return 見積もりの形の辞書
+    """
+    if type(value) == dict and "operation" in value:
+        return value
+    if type(value) == dict and markov_tensor.is_blocked(value):
+        profile = value["profile"]
+        strands = side_size(profile[markov_tensor.DOMAIN_PROFILE]) * side_size(profile[markov_tensor.CODOMAIN_PROFILE])
+    elif markov_tensor.is_tensor(value):
+        profile = value["profile"]
+        strands = 1
+        for factor in markov_tensor.get_factors(value):
+            strands *= len(factor["strands"])
+    else:
+        profile = value
+        strands = side_size(profile[markov_tensor.DOMAIN_PROFILE]) * side_size(profile[markov_tensor.CODOMAIN_PROFILE])
+    return {
+        "operation": None,
+        "profile": profile,
+        "mode": value.get("mode") if type(value) == dict else None,
+        "strands": strands,
+        "bytes": 0,
+        "flops": 0,
+        "peak_bytes": 0,
+        "parts": []
+    }
+
+
+def create_estimate(operation, profile, mode, strands, flops, parts):
+    """
+    見積もりを作成
+    parts (引数の見積もり) を順に計算して保持したまま、最後に結果を作るものとして、
+    FLOPs の合計と同時にメモリにある量の最大値を求める。
+    """
+    number_of_bytes = strands * BYTES_PER_STRAND[mode or markov_tensor.MODE_RATIONAL]
+    peak_bytes = 0
+    held = 0
+    for part in parts:
+        peak_bytes = max(peak_bytes, held + part["peak_bytes"])
+        held += part["bytes"]
+    return {
+        "operation": operation,
+        "profile": profile,
+        "mode": mode,
+        "strands": strands,
+        "bytes": number_of_bytes,
+        "flops": flops + sum(part["flops"] for part in parts),
+        "peak_bytes": max(peak_bytes, held + number_of_bytes),
+        "parts": parts
+    }
+
+
+def promote_modes(*estimates):
+    mode = None
+    for estimate in estimates:
+        mode = markov_tensor.promote_mode(mode, estimate["mode"]) if mode is not None else estimate["mode"]
+    return mode
+
+
+def estimate_composition(tensor_x, tensor_y, *options, **keywords):
+    x, y = describe(tensor_x), describe(tensor_y)
+    size_a = side_size(x["profile"][markov_tensor.DOMAIN_PROFILE])
+    size_b = side_size(x["profile"][markov_tensor.CODOMAIN_PROFILE])
+    size_c = side_size(y["profile"][markov_tensor.CODOMAIN_PROFILE])
+    profile = [x["profile"][markov_tensor.DOMAIN_PROFILE], y["profile"][markov_tensor.CODOMAIN_PROFILE]]
+    return create_estimate("composition", profile, promote_modes(x, y), size_a * size_c, 2 * size_a * size_b * size_c, [x, y])
+
+
+def estimate_tensor_product(tensor_x, tensor_y, factored=False):
+    x, y = describe(tensor_x), describe(tensor_y)
+    profile = [
+        x["profile"][markov_tensor.DOMAIN_PROFILE] + y["profile"][markov_tensor.DOMAIN_PROFILE],
+        x["profile"][markov_tensor.CODOMAIN_PROFILE] + y["profile"][markov_tensor.CODOMAIN_PROFILE]
+    ]
+    strands = 0 if factored else x["strands"] * y["strands"]
+    return create_estimate("tensor_product", profile, promote_modes(x, y), strands, strands, [x, y])
+
+
+def estimate_identity(tensor):
+    x = describe(tensor)
+    return create_estimate("identity", x["profile"], x["mode"], x["strands"], x["strands"], [x])
+
+
+def estimate_unit_tensor(list_x):
+    size = side_size(list_x)
+    # 格子点の対をすべて走査して対角のみを残す
+    return create_estimate("unit_tensor", [list_x, list_x], None, size, size * size, [])
+
+
+def estimate_delta(list_x, zeros=True):
+    size = side_size(list_x)
+    strands = size ** 3 if zeros else size
+    return create_estimate("delta", [list_x, list_x + list_x], None, strands, strands, [])
+
+
+def estimate_exclamation(list_x):
+    size = side_size(list_x)
+    return create_estimate("exclamation", [list_x, []], None, size, size, [])
+
+
+def estimate_swap(list_a, list_b):
+    size = side_size(list_a) * side_size(list_b)
+    return create_estimate("swap", [list_a + list_b, list_b + list_a], None, size, size, [])
+
+
+def estimate_jointification(tensor_x, tensor_y):
+    x, y = describe(tensor_x), describe(tensor_y)
+    profile = [[], x["profile"][markov_tensor.CODOMAIN_PROFILE] + y["profile"][markov_tensor.CODOMAIN_PROFILE]]
+    strands = min(side_size(profile[markov_tensor.CODOMAIN_PROFILE]), x["strands"] * y["strands"])
+    return create_estimate("jointification", profile, promote_modes(x, y), strands, x["strands"] * y["strands"], [x, y])
+
+
+def split_codomain(estimate, concat_start_index):
+    codomain_profile = estimate["profile"][markov_tensor.CODOMAIN_PROFILE]
+    return codomain_profile[0:concat_start_index - 1], codomain_profile[concat_start_index - 1:]
+
+
+def estimate_conditionalization(tensor_x, concat_start_index):
+    x = describe(tensor_x)
+    profile_a, profile_b = split_codomain(x, concat_start_index)
+    return create_estimate("conditionalization", [profile_a, profile_b], x["mode"], x["strands"], 2 * x["strands"], [x])
+
+
+def estimate_first_marginalization(tensor, concat_start_index):
+    x = describe(tensor)
+    profile_a, profile_b = split_codomain(x, concat_start_index)
+    estimate = estimate_composition(x, estimate_tensor_product(estimate_unit_tensor(profile_a), estimate_exclamation(profile_b)))
+    estimate["operation"] = "first_marginalization"
+    return estimate
+
+
+def estimate_second_marginalization(tensor, concat_start_index):
+    x = describe(tensor)
+    profile_a, profile_b = split_codomain(x, concat_start_index)
+    estimate = estimate_composition(x, estimate_tensor_product(estimate_exclamation(profile_a), estimate_unit_tensor(profile_b)))
+    estimate["operation"] = "second_marginalization"
+    return estimate
+
+
+def estimate_partial_composition(tensor_a_b_sharp_c, tensor_b_d, concat_start_index):
+    x = describe(tensor_a_b_sharp_c)
+    _, profile_c = split_codomain(x, concat_start_index)
+    estimate = estimate_composition(x, estimate_tensor_product(tensor_b_d, estimate_unit_tensor(profile_c)))
+    estimate["operation"] = "partial_composition"
+    return estimate
+
+
+def estimate_approximate_composition(tensor_x, tensor_y, *options, **keywords):
+    estimate = estimate_composition(tensor_x, tensor_y)
+    estimate["operation"] = "approximate_composition"
+    return estimate
+
+
+def estimate_conversion(tensor_empty_a, tensor_a_b):
+    y = describe(tensor_a_b)
+    estimate = estimate_conditionalization(
+        estimate_composition(
+            estimate_jointification(tensor_empty_a, y),
+            estimate_swap(y["profile"][markov_tensor.DOMAIN_PROFILE], y["profile"][markov_tensor.CODOMAIN_PROFILE])),
+        len(y["profile"][markov_tensor.CODOMAIN_PROFILE]) + 1)
+    estimate["operation"] = "conversion"
+    return estimate
+
+
+# 演算名と見積もりの関数 (引数は演算と同じ)
+ESTIMATORS = {
+    "composition": estimate_composition,
+    "approximate_composition": estimate_approximate_composition,
+    "partial_composition": estimate_partial_composition,
+    "tensor_product": estimate_tensor_product,
+    "identity": estimate_identity,
+    "unit_tensor": estimate_unit_tensor,
+    "delta": estimate_delta,
+    "exclamation": estimate_exclamation,
+    "swap": estimate_swap,
+    "jointification": estimate_jointification,
+    "conditionalization": estimate_conditionalization,
+    "first_marginalization": estimate_first_marginalization,
+    "second_marginalization": estimate_second_marginalization,
+    "conversion": estimate_conversion
+}
+
+
+def estimate_operation(operation, *args, **kwargs):
+    """
+    演算の結果と計算量を見積もる
+    @param operation 演算名 (markov_tensor の関数名)
+    @param args 演算の引数 (テンソルの代わりにプロファイルや見積もりを渡してもよい)
+    @return estimate operation, profile, mode, strands, bytes, flops, peak_bytes, parts (引数の見積もり) をキーとする辞書
+    """
+    if operation not in ESTIMATORS:
+        raise ValueError("cannot estimate {0}".format(operation))
+    return ESTIMATORS[operation](*args, **kwargs)
+
+
+def estimate_node(syntax, tensors):
+    # 式の構文木を評価し、演算の呼び出しを見積もりに置き換える
+    if isinstance(syntax, ast.Name):
+        if syntax.id not in tensors:
+            raise ValueError("unknown tensor {0}".format(syntax.id))
+        return describe(tensors[syntax.id])
+    if isinstance(syntax, ast.Call) and isinstance(syntax.func, ast.Name):
+        args = [estimate_node(arg, tensors) for arg in syntax.args]
+        kwargs = {keyword.arg: estimate_node(keyword.value, tensors) for keyword in syntax.keywords}
+        return estimate_operation(syntax.func.id, *args, **kwargs)
+    return ast.literal_eval(syntax)
+
+
+def estimate_expression(expression, tensors):
+    """
+    式全体の結果と計算量を見積もる
+    @param expression markov_tensor の演算とテンソルの名前による式
+    @param tensors テンソルの名前をキー、テンソルまたはプロファイルを値とする辞書
+    @return estimate 式の最後の演算の見積もり (parts に途中の演算の見積もりを入れ子でもつ)
+    """
+    return estimate_node(ast.parse(expression, mode="eval").body, tensors)
+
+
+def format_bytes(number_of_bytes):
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if number_of_bytes < 1024 or unit == "TB":
+            return "{0:.1f} {1}".format(number_of_bytes, unit)
+        number_of_bytes /= 1024
+
+
+def format_estimate(estimate):
+    """
+    見積もりを 1 行の文字列にする
+    @param estimate 見積もり
+    """
+    return "{0} -> {1}: {2:,} strands, {3}, peak {4}, {5:.3g} FLOPs".format(
+        estimate["operation"], estimate["profile"], estimate["strands"],
+        format_bytes(estimate["bytes"]), format_bytes(estimate["peak_bytes"]), float(estimate["flops"]))
+
+
+def is_exact(tensor):
+    """
+    テンソルの重みが厳密 (rational モード、またはモードの指定がなく Fraction の重み) かを判定
+    @param tensor テンソル
+    """
+    if markov_tensor.is_factored(tensor):
+        return any(is_exact(factor) for factor in markov_tensor.get_factors(tensor))
+    mode = markov_tensor.get_mode(tensor)
+    if mode == markov_tensor.MODE_RATIONAL:
+        return True
+    return mode is None and any(type(weight) == Fraction for weight in tensor["strands"].values())
+
+
+def run_out_of_core(operation, args):
+    """
+    演算をブロック単位で計算する
+    辞書のテンソルの引数はブロックに分けて一時的に保存し、計算の後に削除する。
+    @param operation OUT_OF_CORE_OPERATIONS の演算名
+    @param args 演算の引数
+    @return tensor_result テンソル {"profile": ..., "blocked": 結果のディレクトリのパス, "directory": 作成したディレクトリ}
+    """
+    import markov_tensor_out_of_core
+
+    directory = tempfile.mkdtemp(prefix="markov_tensor_", dir=OUT_OF_CORE_DIRECTORY)
+    paths = []
+    inputs = []
+    for number, arg in enumerate(args):
+        if not markov_tensor.is_tensor(arg):
+            paths.append(arg)
+        elif markov_tensor.is_blocked(arg):
+            paths.append(arg["blocked"])
+        else:
+            path = os.path.join(directory, "input_{0}".format(number))
+            markov_tensor_out_of_core.to_blocked(arg, path)
+            paths.append(path)
+            inputs.append(path)
+    path_result = os.path.join(directory, "result")
+    try:
+        meta = getattr(markov_tensor_out_of_core, operation)(*paths, path_result)
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    for path in inputs:
+        shutil.rmtree(path, ignore_errors=True)
+    return {"profile": meta["profile"], "blocked": path_result, "mode": meta["mode"], "directory": directory}
+
+
+def remove_blocked(tensor):
+    """
+    run_out_of_core が作成した結果のディレクトリを削除する (削除した後のテンソルは使えない)
+    @param tensor ブロック単位で計算した結果のテンソル
+    """
+    if "directory" not in tensor:
+        raise ValueError("{0} was not created by run_out_of_core".format(tensor["blocked"]))
+    shutil.rmtree(tensor["directory"], ignore_errors=True)
+
+
+@contextlib.contextmanager
+def out_of_core_directory(parent=None):
+    """
+    with の間だけブロック単位の計算の結果を置くディレクトリを作成して OUT_OF_CORE_DIRECTORY とし、
+    抜けるときに中身ごと削除する (結果を残す場合は with の中で materialize する)
+    @param parent ディレクトリを作る場所 (None なら一時ディレクトリの場所)
+    @return directory 作成したディレクトリ
+    """
+    global OUT_OF_CORE_DIRECTORY
+    previous = OUT_OF_CORE_DIRECTORY
+    directory = tempfile.mkdtemp(prefix="markov_tensor_", dir=parent)
+    OUT_OF_CORE_DIRECTORY = directory
+    try:
+        yield directory
+    finally:
+        OUT_OF_CORE_DIRECTORY = previous
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def guard(operation, args, kwargs):
+    """
+    演算の前にメモリの予算を確認する (markov_tensor の演算から呼ばれる)
+    ブロック単位の計算は float64 なので、厳密な重みのテンソルが含まれる場合は回さずに送出する。
+    @param operation 演算名
+    @param args 演算の引数
+    @param kwargs 演算のキーワード引数
+    @return ブロック単位で計算した結果 (辞書のまま計算してよい場合は None)
+    """
+    blocked = any(markov_tensor.is_tensor(arg) and markov_tensor.is_blocked(arg) for arg in args)
+    estimate = None
+    if not blocked:
+        if operation not in ESTIMATORS or markov_tensor.MEMORY_BUDGET is None:
+            return None
+        estimate = estimate_operation(operation, *args, **kwargs)
+        if estimate["peak_bytes"] <= markov_tensor.MEMORY_BUDGET:
+            return None
+
+    exact = any(
+        markov_tensor.is_tensor(arg) and not markov_tensor.is_blocked(arg) and is_exact(arg) for arg in args)
+    if operation in OUT_OF_CORE_OPERATIONS and not kwargs and not exact and (
+            blocked or markov_tensor.MEMORY_BUDGET_ACTION == "out_of_core"):
+        return run_out_of_core(operation, args)
+    if blocked and exact:
+        raise ValueError("{0} out of core would convert exact weights to float64; convert_mode the tensor first".format(operation))
+    if blocked:
+        raise ValueError("{0} cannot be computed out of core; materialize the tensor first".format(operation))
+    if exact and markov_tensor.MEMORY_BUDGET_ACTION == "out_of_core":
+        raise MemoryError("{0} exceeds the memory budget of {1}; exact weights are not computed out of core".format(
+            format_estimate(estimate), format_bytes(markov_tensor.MEMORY_BUDGET)))
+    raise MemoryError("{0} exceeds the memory budget of {1}".format(
+        format_estimate(estimate), format_bytes(markov_tensor.MEMORY_BUDGET)))
@@ -0,0 +1,198 @@
+"""
+観測された遷移の記録からのマルコフ・テンソルの最尤推定
+
+(域の格子点, 余域の格子点) の観測を順に読み、格子点の対ごとの回数のみを保持する推定器に数え上げる。
+回数は観測された対のみを辞書 (行列の行優先の番号をキー) に持つので、記録の長さによらず
+メモリは異なる対の数で抑えられる。
+  estimator = create_estimator(tensor_d["profile"])
+  update(estimator, [([1, 1], [1, 2]), ([1, 1], [2, 1])])
+  tensor = estimate(estimator, smoothing=1)
+
+記録のファイルは、1 行に 1 個の [域の格子点, 余域の格子点] (ストランドのキーと同じ形) をもつ JSON Lines とする。
+別々の記録から数えた推定器は merge でまとめられるので、estimate_files はファイルごとにプロセスを分けて数える。
+"""
+import concurrent.futures
+import itertools
+import json
+from fractions import Fraction
+import numpy as np
+import markov_tensor
+import markov_tensor_numpy
+
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def create_estimator(profile):
+    """
+    推定器を作成
+    @param profile 推定するテンソルのプロファイル [a, b]
+    @return estimator 推定器
+    """
+    estimator = {}
+    estimator["profile"] = profile
+    estimator["shape"] = [
+        int(np.prod(markov_tensor_numpy.profile_sizes(profile[markov_tensor.DOMAIN_PROFILE]))),
+        int(np.prod(markov_tensor_numpy.profile_sizes(profile[markov_tensor.CODOMAIN_PROFILE])))
+    ]
+    estimator["counts"] = {}
+    estimator["observations"] = 0
+    return estimator
+
+
+def get_positions(estimator):
+    # 因子ごとの値から位置への辞書 (推定器には保持せず、都度作成)
+    return (
+        markov_tensor_numpy.factor_positions(estimator["profile"][markov_tensor.DOMAIN_PROFILE]),
+        markov_tensor_numpy.factor_positions(estimator["profile"][markov_tensor.CODOMAIN_PROFILE]))
+
+
+def observation_index(estimator, positions, domain_point, codomain_point):
+    # 観測の行列における行優先の番号
+    domain_positions, codomain_positions = positions
+    row = markov_tensor_numpy.lattice_point_index(
+        estimator["profile"][markov_tensor.DOMAIN_PROFILE], domain_point, domain_positions)
+    column = markov_tensor_numpy.lattice_point_index(
+        estimator["profile"][markov_tensor.CODOMAIN_PROFILE], codomain_point, codomain_positions)
+    return row * estimator["shape"][1] + column
+
+
+def add_counts(estimator, indexies):
+    # 行優先の番号の配列を回数にまとめて足し込む
+    values, counts = np.unique(np.asarray(indexies, dtype=np.int64), return_counts=True)
+    estimator_counts = estimator["counts"]
+    for value, count in zip(values.tolist(), counts.tolist()):
+        estimator_counts[value] = estimator_counts.get(value, 0) + count
+    estimator["observations"] += int(counts.sum())
+
+
+def update(estimator, observations, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    観測を推定器に数え上げる
+    @param estimator 推定器
+    @param observations (域の格子点, 余域の格子点) の iterable (ジェネレータでもよい)
+    @param chunk_size まとめて数える観測の数
+    @return estimator 推定器
+    """
+    positions = get_positions(estimator)
+    observations = iter(observations)
+    while True:
+        chunk = [
+            observation_index(estimator, positions, domain_point, codomain_point)
+            for domain_point, codomain_point in itertools.islice(observations, chunk_size)]
+        if not chunk:
+            return estimator
+        add_counts(estimator, chunk)
+
+
+def update_indexies(estimator, rows, columns):
+    """
+    行列の行番号と列番号の配列として与えた観測を数え上げる
+    @param estimator 推定器
+    @param rows 域の格子点の番号の配列
+    @param columns 余域の格子点の番号の配列
+    @return estimator 推定器
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    columns = np.asarray(columns, dtype=np.int64)
+    if rows.size and (rows.min() < 0 or rows.max() >= estimator["shape"][0] or
+                      columns.min() < 0 or columns.max() >= estimator["shape"][1]):
+        raise ValueError("observation out of range")
+    add_counts(estimator, rows * estimator["shape"][1] + columns)
+    return estimator
+
+
+def read_observations(path):
+    """
+    記録のファイルから観測を 1 個ずつ読む
+    @param path JSON Lines ファイルのパス
+    """
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                domain_point, codomain_point = json.loads(line)
+                yield domain_point, codomain_point
+
+
+def merge(estimator_x, estimator_y):
+    """
+    2 個の推定器の回数を合わせた推定器を作成
+    @param estimator_x 推定器
+    @param estimator_y 推定器
+    @return estimator_result 推定器
+    """
+    if estimator_x["profile"] != estimator_y["profile"]:
+        raise ValueError("profiles differ")
+    estimator_result = create_estimator(estimator_x["profile"])
+    estimator_result["counts"] = dict(estimator_x["counts"])
+    for index, count in estimator_y["counts"].items():
+        estimator_result["counts"][index] = estimator_result["counts"].get(index, 0) + count
+    estimator_result["observations"] = estimator_x["observations"] + estimator_y["observations"]
+    return estimator_result
+
+
+def estimate(estimator, smoothing=0, mode=markov_tensor.MODE_RATIONAL):
+    """
+    回数を域の格子点ごとに正規化してマルコフ・テンソルを作成
+    重みは (回数 + smoothing) / (域の格子点の回数の和 + smoothing x |b|) とする。
+    観測がなく smoothing が 0 の域の格子点は一様分布とする。
+    @param estimator 推定器
+    @param smoothing 加算スムージングの擬似回数
+    @param mode 数値モード (既定は Fraction による rational)
+    @return tensor_result テンソル a -> b
+    """
+    rows, columns = estimator["shape"]
+    smoothing = Fraction(str(smoothing)) if type(smoothing) == float else Fraction(smoothing)
+    counts = estimator["counts"]
+    totals = [0] * rows
+    for index, count in counts.items():
+        totals[index // columns] += count
+
+    profile = estimator["profile"]
+    tensor_result = {}
+    strands_result = {}
+    tensor_result["profile"] = profile
+    codomain_points = markov_tensor_numpy.lattice_points(profile[markov_tensor.CODOMAIN_PROFILE])
+    for row, domain_point in enumerate(markov_tensor_numpy.lattice_points(profile[markov_tensor.DOMAIN_PROFILE])):
+        denominator = totals[row] + smoothing * columns
+        for column, codomain_point in enumerate(codomain_points):
+            if denominator > 0:
+                weight = (counts.get(row * columns + column, 0) + smoothing) / denominator
+            else:
+                weight = Fraction(1, columns)
+            strands_result[str([domain_point, codomain_point])] = markov_tensor.convert_value(
+                weight, markov_tensor.MODE_RATIONAL, mode)
+    tensor_result["strands"] = strands_result
+    tensor_result["mode"] = mode
+    return tensor_result
+
+
+def count_file(path, profile, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    記録のファイル 1 個を数え上げた推定器を作成
+    @param path JSON Lines ファイルのパス
+    @param profile 推定するテンソルのプロファイル
+    @param chunk_size まとめて数える観測の数
+    """
+    return update(create_estimator(profile), read_observations(path), chunk_size)
+
+
+def estimate_files(paths, profile, workers=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    複数の記録のファイルを、ファイルごとにプロセスを分けて数え上げ、1 個の推定器にまとめる
+    @param paths JSON Lines ファイルのパスのリスト
+    @param profile 推定するテンソルのプロファイル
+    @param workers ワーカープロセス数 (1 以下なら同じプロセスで順に数える)
+    @param chunk_size まとめて数える観測の数
+    @return estimator 推定器
+    """
+    estimator = create_estimator(profile)
+    if workers <= 1:
+        for path in paths:
+            estimator = merge(estimator, count_file(path, profile, chunk_size))
+        return estimator
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(count_file, path, profile, chunk_size) for path in paths]
+        for future in concurrent.futures.as_completed(futures):
+            estimator = merge(estimator, future.result())
+    return estimator
@@ -0,0 +1,185 @@
+"""
+観測を 1 個ずつ受け取る逐次ベイズ・フィルタ
+
+事前分布 [] -> a、観測のテンソル a -> b (と、省略可能な遷移のテンソル a -> a) からフィルタを作り、
+観測を受け取るたびに事後分布を更新する。
+  state = create_filter(tensor_prior, tensor_h)
+  update(state, "H")
+  get_posterior(state)
+
+観測ごとの尤度の列 (状態の順の P(観測 | 状態) のリスト) を作成時に索引化しておくので、
+観測による更新はストランドのキーを走査せず O(|a|) で済む。
+遷移がある場合は 2 個目以降の観測の前に事前の予測をする (遷移の 0 でない重みの数に比例)。
+重みは入力と同じ型 (Fraction なら厳密) の確率として計算し、状態全体を to_json で JSON に変換できる。
+事後分布は、事前分布、観測、遷移の数値モードを昇格した数値モード (log なら対数に戻して) で返す。
+"""
+from fractions import Fraction
+import math
+import markov_tensor
+import markov_tensor_numpy
+
+
+def create_filter(prior, observation_kernel, transition=None):
+    """
+    フィルタを作成
+    @param prior 事前分布のテンソル [] -> a
+    @param observation_kernel 観測のテンソル a -> b
+    @param transition 遷移のテンソル a -> a (省略時は状態が変化しない)
+    @return state フィルタの状態
+    """
+    prior = markov_tensor.materialize(prior)
+    observation_kernel = markov_tensor.materialize(observation_kernel)
+    profile_states = prior["profile"][markov_tensor.CODOMAIN_PROFILE]
+    if prior["profile"][markov_tensor.DOMAIN_PROFILE] != [] or \
+            observation_kernel["profile"][markov_tensor.DOMAIN_PROFILE] != profile_states:
+        raise ValueError("profiles must be [] -> a and a -> b")
+    if transition is not None and transition["profile"] != [profile_states, profile_states]:
+        raise ValueError("transition must be a -> a")
+
+    states = markov_tensor_numpy.lattice_points(profile_states)
+    positions = markov_tensor_numpy.factor_positions(profile_states)
+    prior_mode = markov_tensor.get_mode(prior)
+
+    state = {}
+    state["profile"] = [profile_states, observation_kernel["profile"][markov_tensor.CODOMAIN_PROFILE]]
+    state["states"] = [str(point) for point in states]
+    state["posterior"] = [0] * len(states)
+    for strand in prior["strands"].keys():
+        _, strand_to = markov_tensor.get_lattice_points(strand)
+        state["posterior"][markov_tensor_numpy.lattice_point_index(profile_states, strand_to, positions)] = \
+            markov_tensor.to_probability(prior["strands"][strand], prior_mode)
+
+    # 観測の格子点の文字列をキー、状態の順の尤度のリストを値とする索引
+    kernel_mode = markov_tensor.get_mode(observation_kernel)
+    state["likelihoods"] = {
+        str(point): [0] * len(states)
+        for point in markov_tensor_numpy.lattice_points(state["profile"][markov_tensor.CODOMAIN_PROFILE])}
+    for strand in observation_kernel["strands"].keys():
+        strand_from, strand_to = markov_tensor.get_lattice_points(strand)
+        state["likelihoods"][str(strand_to)][markov_tensor_numpy.lattice_point_index(profile_states, strand_from, positions)] = \
+            markov_tensor.to_probability(observation_kernel["strands"][strand], kernel_mode)
+
+    # 遷移は域の状態ごとの (余域の状態の番号, 重み) のリスト (重み 0 は除く)
+    state["transition"] = None
+    transition_mode = None
+    if transition is not None:
+        transition = markov_tensor.materialize(transition)
+        transition_mode = markov_tensor.get_mode(transition)
+        state["transition"] = [[] for _ in states]
+        for strand in transition["strands"].keys():
+            weight = markov_tensor.to_probability(transition["strands"][strand], transition_mode)
+            if weight != 0:
+                strand_from, strand_to = markov_tensor.get_lattice_points(strand)
+                state["transition"][markov_tensor_numpy.lattice_point_index(profile_states, strand_from, positions)].append(
+                    [markov_tensor_numpy.lattice_point_index(profile_states, strand_to, positions), weight])
+
+    state["mode"] = markov_tensor.promote_mode(markov_tensor.promote_mode(prior_mode, kernel_mode), transition_mode)
+    state["observations"] = 0
+    state["log_likelihood"] = 0.0
+    return state
+
+
+def observation_key(state, observation):
+    # 観測 (b の格子点、b の因子が 1 個なら値そのものでもよい) を索引のキーにする
+    observation_profile = state["profile"][markov_tensor.CODOMAIN_PROFILE]
+    if len(observation_profile) == 1 and type(observation) != list:
+        observation = [markov_tensor.create_lattice_component(observation_profile[0], observation)]
+    key = str(observation)
+    if key not in state["likelihoods"]:
+        raise ValueError("unknown observation {0}".format(observation))
+    return key
+
+
+def predict(state):
+    """
+    遷移により事前の予測をする
+    @param state フィルタの状態
+    @return state フィルタの状態
+    """
+    if state["transition"] is None:
+        return state
+    predicted = [0] * len(state["posterior"])
+    for source, targets in enumerate(state["transition"]):
+        weight = state["posterior"][source]
+        if weight != 0:
+            for target, transition_weight in targets:
+                predicted[target] += weight * transition_weight
+    state["posterior"] = predicted
+    return state
+
+
+def update(state, observation):
+    """
+    観測を受け取り、事後分布を更新する
+    確率 0 の観測の場合は ValueError を送出し、状態を変更しない。
+    @param state フィルタの状態
+    @param observation 観測
+    @return state フィルタの状態
+    """
+    likelihood = state["likelihoods"][observation_key(state, observation)]
+    prior = state["posterior"]
+    if state["observations"] > 0 and state["transition"] is not None:
+        prior = predict(dict(state))["posterior"]
+    joint = [weight * value for weight, value in zip(prior, likelihood)]
+    total = sum(joint)
+    if not total > 0:
+        raise ValueError("observation {0} has zero probability".format(observation))
+    state["posterior"] = [value / total for value in joint]
+    state["observations"] += 1
+    state["log_likelihood"] += math.log(total)
+    return state
+
+
+def get_posterior(state):
+    """
+    現在の事後分布をテンソルとして取得
+    @param state フィルタの状態
+    @return tensor_result テンソル [] -> a (数値モードが log なら重みは対数)
+    """
+    tensor_result = {}
+    tensor_result["profile"] = [[], state["profile"][markov_tensor.DOMAIN_PROFILE]]
+    tensor_result["strands"] = {
+        "[[], {0}]".format(point): weight for point, weight in zip(state["states"], state["posterior"])}
+    # 状態の重みは確率なので、log モードの場合は float64 として作ってから対数に変換する
+    if state["mode"] == markov_tensor.MODE_LOG:
+        tensor_result = markov_tensor.set_result_mode(tensor_result, markov_tensor.MODE_FLOAT64)
+        return markov_tensor.convert_mode(tensor_result, markov_tensor.MODE_LOG)
+    return markov_tensor.set_result_mode(tensor_result, state["mode"])
+
+
+def encode_weight(weight):
+    return str(weight) if type(weight) == Fraction else weight
+
+
+def decode_weight(weight):
+    return Fraction(weight) if type(weight) == str else weight
+
+
+def to_json(state):
+    """
+    フィルタの状態を JSON に変換できる辞書にする (Fraction の重みは "1/10" のような文字列にする)
+    @param state フィルタの状態
+    """
+    data = dict(state)
+    data["posterior"] = [encode_weight(weight) for weight in state["posterior"]]
+    data["likelihoods"] = {
+        key: [encode_weight(weight) for weight in column] for key, column in state["likelihoods"].items()}
+    if state["transition"] is not None:
+        data["transition"] = [
+            [[target, encode_weight(weight)] for target, weight in targets] for targets in state["transition"]]
+    return data
+
+
+def from_json(data):
+    """
+    to_json の形式の辞書からフィルタの状態を作成
+    @param data 辞書
+    """
+    state = dict(data)
+    state["posterior"] = [decode_weight(weight) for weight in data["posterior"]]
+    state["likelihoods"] = {
+        key: [decode_weight(weight) for weight in column] for key, column in data["likelihoods"].items()}
+    if data["transition"] is not None:
+        state["transition"] = [
+            [[target, decode_weight(weight)] for target, weight in targets] for targets in data["transition"]]
+    return state
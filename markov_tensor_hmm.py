@@ -0,0 +1,192 @@
+"""
+隠れマルコフ・モデルの前向き・後ろ向きアルゴリズムと Viterbi アルゴリズム
+
+遷移のテンソル a -> a、放出のテンソル a -> o、初期分布 [] -> a から隠れマルコフ・モデルを作り、
+長さの異なる複数の観測系列をまとめて計算する。
+  hmm = create_hmm(tensor_t, tensor_h, tensor_prior)
+  result = forward_backward(hmm, [["H", "M", "L"], ["L", "L"]])
+
+各系列の観測ごとに conversion を呼ぶ代わりに、対数空間の行列 (markov_tensor_numpy の順序) を一度だけ作り、
+時刻の漸化式のみをループとして、バッチの軸と状態の軸を NumPy でまとめて計算する。
+系列は最長の系列に合わせて詰め、長さを超えた時刻の結果は 0 (確率) とする。
+"""
+import numpy as np
+import markov_tensor
+import markov_tensor_numpy
+
+
+def create_hmm(transition, emission, prior):
+    """
+    隠れマルコフ・モデルを作成
+    @param transition 遷移のテンソル a -> a
+    @param emission 放出のテンソル a -> o
+    @param prior 初期分布のテンソル [] -> a
+    @return hmm 隠れマルコフ・モデル
+    """
+    states = transition["profile"][markov_tensor.DOMAIN_PROFILE]
+    if transition["profile"][markov_tensor.CODOMAIN_PROFILE] != states or \
+            emission["profile"][markov_tensor.DOMAIN_PROFILE] != states or \
+            prior["profile"] != [[], states]:
+        raise ValueError("profiles must be a -> a, a -> o and [] -> a")
+    observations = emission["profile"][markov_tensor.CODOMAIN_PROFILE]
+
+    hmm = {}
+    hmm["states"] = states
+    hmm["observations"] = observations
+    hmm["log_transition"] = markov_tensor_numpy.to_log_matrix(transition)
+    hmm["log_emission"] = markov_tensor_numpy.to_log_matrix(emission)
+    hmm["log_prior"] = markov_tensor_numpy.to_log_matrix(prior)[0]
+    hmm["observation_positions"] = markov_tensor_numpy.factor_positions(observations)
+    return hmm
+
+
+def encode_observations(hmm, sequences):
+    """
+    観測系列を放出の行列の列番号の配列に変換
+    観測は余域 o の格子点 (o の因子が 1 個なら値そのものでもよい) とする。
+    @param hmm 隠れマルコフ・モデル
+    @param sequences 観測系列のリスト
+    @return indexies 形が (B, T) の列番号の配列 (長さを超えた時刻は 0), lengths 形が (B,) の系列の長さ
+    """
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    indexies = np.zeros((len(sequences), max(lengths, default=0)), dtype=np.int64)
+    for row, sequence in enumerate(sequences):
+        for time, observation in enumerate(sequence):
+            if len(hmm["observations"]) == 1 and type(observation) != list:
+                observation = [observation]
+            indexies[row, time] = markov_tensor_numpy.lattice_point_index(
+                hmm["observations"], observation, hmm["observation_positions"])
+    return indexies, lengths
+
+
+def log_normalize(log_values):
+    # 最後の軸について対数の和が 0 となるように正規化し、確率に戻す (すべて -inf なら 0)
+    shift = np.max(log_values, axis=-1, keepdims=True)
+    shift = np.where(np.isfinite(shift), shift, 0.0)
+    values = np.exp(log_values - shift)
+    total = values.sum(axis=-1, keepdims=True)
+    return np.divide(values, total, out=np.zeros_like(values), where=total > 0)
+
+
+def log_sum(log_values):
+    # 最後の軸についての log(sum(exp(x)))
+    shift = np.max(log_values, axis=-1)
+    shift = np.where(np.isfinite(shift), shift, 0.0)
+    with np.errstate(divide="ignore"):
+        return np.log(np.exp(log_values - shift[..., None]).sum(axis=-1)) + shift
+
+
+def forward_log(hmm, indexies, lengths):
+    # 前向き変数 log P(o_0..o_t, x_t) (B, T, |a|)。長さを超えた時刻は直前の値を引き継ぐ
+    log_emissions = hmm["log_emission"].T[indexies]
+    batch, steps = indexies.shape
+    log_alpha = np.full((batch, steps, len(hmm["log_prior"])), -np.inf)
+    if steps == 0:
+        return log_alpha, log_emissions
+    log_alpha[:, 0] = hmm["log_prior"] + log_emissions[:, 0]
+    for time in range(1, steps):
+        log_next = markov_tensor_numpy.log_matmul(log_alpha[:, time - 1], hmm["log_transition"]) + log_emissions[:, time]
+        active = (time < lengths)[:, None]
+        log_alpha[:, time] = np.where(active, log_next, log_alpha[:, time - 1])
+    return log_alpha, log_emissions
+
+
+def forward(hmm, sequences):
+    """
+    前向きアルゴリズムによるフィルタリング
+    @param hmm 隠れマルコフ・モデル
+    @param sequences 観測系列のリスト
+    @return {"filtered": 形が (B, T, |a|) の P(x_t | o_0..o_t), "log_likelihood": 形が (B,) の log P(o), "lengths": 系列の長さ}
+    """
+    indexies, lengths = encode_observations(hmm, sequences)
+    log_alpha, _ = forward_log(hmm, indexies, lengths)
+    return {
+        "filtered": mask(log_normalize(log_alpha), lengths),
+        "log_likelihood": last_log_likelihood(log_alpha, lengths),
+        "lengths": lengths
+    }
+
+
+def mask(values, lengths):
+    # 長さを超えた時刻の値を 0 とする
+    active = np.arange(values.shape[1])[None, :] < lengths[:, None]
+    return values * active[:, :, None]
+
+
+def last_log_likelihood(log_alpha, lengths):
+    # 各系列の最後の時刻の前向き変数から log P(o) を算出 (長さ 0 の系列は 0)
+    if log_alpha.shape[1] == 0:
+        return np.zeros(len(lengths))
+    last = log_alpha[np.arange(len(lengths)), np.maximum(lengths - 1, 0)]
+    return np.where(lengths > 0, log_sum(last), 0.0)
+
+
+def forward_backward(hmm, sequences):
+    """
+    前向き・後ろ向きアルゴリズムによる平滑化
+    @param hmm 隠れマルコフ・モデル
+    @param sequences 観測系列のリスト
+    @return {"filtered": P(x_t | o_0..o_t), "smoothed": 形が (B, T, |a|) の P(x_t | o), "log_likelihood": log P(o), "lengths": 系列の長さ}
+    """
+    indexies, lengths = encode_observations(hmm, sequences)
+    log_alpha, log_emissions = forward_log(hmm, indexies, lengths)
+    batch, steps = indexies.shape
+    log_beta = np.zeros((batch, steps, len(hmm["log_prior"])))
+    for time in range(steps - 2, -1, -1):
+        log_next = markov_tensor_numpy.log_matmul(
+            hmm["log_transition"], (log_emissions[:, time + 1] + log_beta[:, time + 1]).T).T
+        active = (time + 1 < lengths)[:, None]
+        log_beta[:, time] = np.where(active, log_next, 0.0)
+    return {
+        "filtered": mask(log_normalize(log_alpha), lengths),
+        "smoothed": mask(log_normalize(log_alpha + log_beta), lengths),
+        "log_likelihood": last_log_likelihood(log_alpha, lengths),
+        "lengths": lengths
+    }
+
+
+def viterbi(hmm, sequences):
+    """
+    Viterbi アルゴリズムによる最も確からしい状態の系列の復号
+    @param hmm 隠れマルコフ・モデル
+    @param sequences 観測系列のリスト
+    @return {"paths": 系列ごとの状態の格子点のリスト, "log_probability": 形が (B,) の log P(x, o) の最大値}
+    """
+    indexies, lengths = encode_observations(hmm, sequences)
+    log_emissions = hmm["log_emission"].T[indexies]
+    batch, steps = indexies.shape
+    size = len(hmm["log_prior"])
+    backpointers = np.zeros((batch, steps, size), dtype=np.int64)
+    log_delta = hmm["log_prior"] + log_emissions[:, 0] if steps > 0 else np.zeros((batch, size))
+    for time in range(1, steps):
+        candidates = log_delta[:, :, None] + hmm["log_transition"][None]
+        backpointers[:, time] = np.argmax(candidates, axis=1)
+        log_next = np.max(candidates, axis=1) + log_emissions[:, time]
+        active = (time < lengths)[:, None]
+        log_delta = np.where(active, log_next, log_delta)
+
+    states = markov_tensor_numpy.lattice_points(hmm["states"])
+    best = np.argmax(log_delta, axis=1)
+    paths = []
+    for row in range(batch):
+        path = [int(best[row])]
+        for time in range(int(lengths[row]) - 1, 0, -1):
+            path.append(int(backpointers[row, time, path[-1]]))
+        path.reverse()
+        paths.append([states[state] for state in path] if lengths[row] > 0 else [])
+    return {
+        "paths": paths,
+        "log_probability": np.where(lengths > 0, log_delta[np.arange(batch), best], 0.0)
+    }
+
+
+def get_distribution(hmm, probabilities, row, time):
+    """
+    結果の配列から、系列 row の時刻 time の分布をテンソルとして取り出す
+    @param hmm 隠れマルコフ・モデル
+    @param probabilities forward または forward_backward の "filtered" や "smoothed"
+    @param row 系列の番号
+    @param time 時刻
+    @return tensor_result テンソル [] -> a (モード float64)
+    """
+    return markov_tensor_numpy.from_matrix(probabilities[row, time][None], [[], hmm["states"]])
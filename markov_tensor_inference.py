@@ -0,0 +1,298 @@
+"""
+変数消去によるマルコフ・テンソルのネットワークの推論
+
+共有する変数名で結線したマルコフ・テンソルの集まりを、次のような辞書で与える。
+  network = create_network({
+      "p": {"tensor": tensor_p, "domain": [], "codomain": ["X", "O"]},
+      "h": {"tensor": tensor_h, "domain": ["X"], "codomain": ["H"]},
+      "s": {"tensor": tensor_s, "domain": ["X"], "codomain": ["S"]},
+      "c": {"tensor": tensor_c, "domain": ["O"], "codomain": ["C"]}
+  })
+  query(network, ["X", "O"], {"H": "H", "S": "S-", "C": "C-"})
+
+同時分布を展開せず、証拠で絞り込んだ因子から min-fill (または min-degree) の順序で変数を消去する。
+途中の因子はネットワークの辞書のキー "cache" に保持し、以降の問い合わせで再利用する。
+結果は [] -> 問い合わせ変数 のテンソルとして返す。証拠にもある問い合わせ変数は観測値に集中した分布とし、
+証拠の確率が 0 の場合は ValueError を送出する。
+"""
+import itertools
+import markov_tensor
+
+HEURISTIC_MIN_FILL = "min_fill"
+HEURISTIC_MIN_DEGREE = "min_degree"
+
+
+def create_network(nodes):
+    """
+    ネットワークを作成
+    @param nodes 名前をキー、{"tensor": テンソル, "domain": 域の変数名のリスト, "codomain": 余域の変数名のリスト} を値とする辞書
+    @return network ネットワーク
+    """
+    network = {}
+    network["nodes"] = {}
+    network["variables"] = {}
+    network["cache"] = {}
+    network["cache_hits"] = 0
+    network["cache_misses"] = 0
+
+    for name in nodes.keys():
+        node = nodes[name]
+        tensor = markov_tensor.materialize(node["tensor"])
+        domain_profile = tensor["profile"][markov_tensor.DOMAIN_PROFILE]
+        codomain_profile = tensor["profile"][markov_tensor.CODOMAIN_PROFILE]
+        if len(node["domain"]) != len(domain_profile) or len(node["codomain"]) != len(codomain_profile):
+            raise ValueError("variables of node {0} do not match its profile".format(name))
+        for variable, profile_item in zip(node["domain"] + node["codomain"], domain_profile + codomain_profile):
+            if variable in network["variables"] and network["variables"][variable] != profile_item:
+                raise ValueError("variable {0} has inconsistent profiles".format(variable))
+            network["variables"][variable] = profile_item
+        network["nodes"][name] = {
+            "domain": list(node["domain"]),
+            "codomain": list(node["codomain"]),
+            "factor": create_factor(tensor, node["domain"] + node["codomain"])
+        }
+
+    return network
+
+
+def create_factor(tensor, variables):
+    """
+    テンソルから因子 (変数名のタプルと、値のタプルをキーとする重みの辞書の対) を作成
+    @param tensor テンソル
+    @param variables 域と余域の変数名のリスト
+    """
+    mode = markov_tensor.get_mode(tensor)
+    table = {}
+    for strand in tensor["strands"].keys():
+        strand_from, strand_to = markov_tensor.get_lattice_points(strand)
+        values = tuple(markov_tensor.get_component_value(component) for component in strand_from + strand_to)
+        table[values] = markov_tensor.to_probability(tensor["strands"][strand], mode)
+    return (tuple(variables), table)
+
+
+def reduce_factor(factor, evidence):
+    """
+    証拠の値に一致する重みのみを残し、証拠の変数を因子から除く
+    @param factor 因子
+    @param evidence 変数名をキー、観測値を値とする辞書
+    """
+    variables, table = factor
+    positions = [index for index, variable in enumerate(variables) if variable in evidence]
+    if not positions:
+        return factor
+    kept = [index for index in range(len(variables)) if index not in positions]
+    table_result = {}
+    for values in table.keys():
+        if all(values[index] == evidence[variables[index]] for index in positions):
+            table_result[tuple(values[index] for index in kept)] = table[values]
+    return (tuple(variables[index] for index in kept), table_result)
+
+
+def multiply_factors(factor_x, factor_y):
+    """
+    2 個の因子の積を算出
+    @param factor_x 因子
+    @param factor_y 因子
+    """
+    variables_x, table_x = factor_x
+    variables_y, table_y = factor_y
+    shared = [variable for variable in variables_x if variable in variables_y]
+    extra = [variable for variable in variables_y if variable not in variables_x]
+    shared_x = [variables_x.index(variable) for variable in shared]
+    shared_y = [variables_y.index(variable) for variable in shared]
+    extra_y = [variables_y.index(variable) for variable in extra]
+
+    # 共有する変数の値で factor_y を索引化
+    index_y = {}
+    for values in table_y.keys():
+        index_y.setdefault(tuple(values[index] for index in shared_y), []).append(values)
+
+    table_result = {}
+    for values_x in table_x.keys():
+        for values_y in index_y.get(tuple(values_x[index] for index in shared_x), []):
+            values = values_x + tuple(values_y[index] for index in extra_y)
+            table_result[values] = table_x[values_x] * table_y[values_y]
+    return (tuple(variables_x) + tuple(extra), table_result)
+
+
+def sum_out(factor, variable):
+    """
+    因子から変数を和により消去
+    @param factor 因子
+    @param variable 変数名
+    """
+    variables, table = factor
+    position = variables.index(variable)
+    table_result = {}
+    for values in table.keys():
+        key = values[:position] + values[position + 1:]
+        if key in table_result:
+            table_result[key] += table[values]
+        else:
+            table_result[key] = table[values]
+    return (variables[:position] + variables[position + 1:], table_result)
+
+
+def elimination_order(variable_sets, eliminate, heuristic=HEURISTIC_MIN_FILL):
+    """
+    変数の消去順序を貪欲法で決定
+    @param variable_sets 各因子の変数の集合のリスト
+    @param eliminate 消去する変数のリスト
+    @param heuristic "min_fill" (追加される辺の数が最小) または "min_degree" (隣接する変数の数が最小)
+    @return order 消去順序
+    """
+    neighbors = {}
+    for variables in variable_sets:
+        for variable in variables:
+            neighbors.setdefault(variable, set()).update(item for item in variables if item != variable)
+
+    order = []
+    remaining = list(eliminate)
+    while remaining:
+        def cost(variable):
+            adjacent = list(neighbors.get(variable, set()))
+            if heuristic == HEURISTIC_MIN_DEGREE:
+                return len(adjacent)
+            return sum(1 for item_x, item_y in itertools.combinations(adjacent, 2) if item_y not in neighbors[item_x])
+
+        variable = min(remaining, key=cost)
+        adjacent = neighbors.pop(variable, set())
+        for item in adjacent:
+            neighbors[item].discard(variable)
+            neighbors[item].update(other for other in adjacent if other != item)
+        remaining.remove(variable)
+        order.append(variable)
+
+    return order
+
+
+def relevant_nodes(network, query_variables, evidence):
+    """
+    問い合わせに関係するノードを選択
+    余域の変数が問い合わせにも証拠にも現れず、他のノードの域にも現れないノード (barren node) は
+    周辺化すると 1 になるので繰り返し取り除く。
+    @param network ネットワーク
+    @param query_variables 問い合わせ変数のリスト
+    @param evidence 証拠の辞書
+    """
+    observed = set(query_variables) | set(evidence.keys())
+    names = list(network["nodes"].keys())
+    removed = True
+    while removed:
+        removed = False
+        used = set()
+        for name in names:
+            used.update(network["nodes"][name]["domain"])
+        for name in list(names):
+            codomain = network["nodes"][name]["codomain"]
+            if not any(variable in observed or variable in used for variable in codomain):
+                names.remove(name)
+                removed = True
+    return names
+
+
+def cached(network, key, compute):
+    # 因子の導出手順を表すキーで中間の因子をキャッシュ
+    if key in network["cache"]:
+        network["cache_hits"] += 1
+        return network["cache"][key]
+    network["cache_misses"] += 1
+    factor = compute()
+    network["cache"][key] = factor
+    return factor
+
+
+def query(network, query_variables, evidence=None, heuristic=HEURISTIC_MIN_FILL):
+    """
+    証拠が与えられたときの問い合わせ変数の事後分布を算出
+    @param network ネットワーク
+    @param query_variables 問い合わせ変数のリスト
+    @param evidence 変数名をキー、観測値 (ラベル、または自然数) を値とする辞書
+    @param heuristic 消去順序の決め方 "min_fill" または "min_degree"
+    @return tensor_result テンソル [] -> 問い合わせ変数 (証拠にもある変数は観測値に集中した分布)
+    """
+    evidence = {} if evidence is None else {
+        variable: markov_tensor.get_component_value(evidence[variable]) for variable in evidence.keys()}
+
+    # 証拠で絞り込んだ因子
+    factors = []
+    for name in relevant_nodes(network, query_variables, evidence):
+        factor = network["nodes"][name]["factor"]
+        local_evidence = tuple(sorted((variable, value) for variable, value in evidence.items() if variable in factor[0]))
+        key = ("reduce", name, local_evidence)
+        factors.append((key, cached(network, key, lambda factor=factor: reduce_factor(factor, evidence))))
+
+    eliminate = []
+    for key, factor in factors:
+        for variable in factor[0]:
+            if variable not in query_variables and variable not in eliminate:
+                eliminate.append(variable)
+
+    for variable in elimination_order([set(factor[0]) for _, factor in factors], eliminate, heuristic):
+        bucket = [(key, factor) for key, factor in factors if variable in factor[0]]
+        factors = [(key, factor) for key, factor in factors if variable not in factor[0]]
+        bucket_key = ("eliminate", variable, frozenset(key for key, _ in bucket))
+
+        def compute(bucket=bucket, variable=variable):
+            product = bucket[0][1]
+            for _, factor in bucket[1:]:
+                product = multiply_factors(product, factor)
+            return sum_out(product, variable)
+
+        factors.append((bucket_key, cached(network, bucket_key, compute)))
+
+    product = ((), {(): 1})
+    for _, factor in factors:
+        product = multiply_factors(product, factor)
+
+    return create_posterior(network, product, query_variables, evidence)
+
+
+def create_posterior(network, factor, query_variables, evidence=None):
+    """
+    因子を正規化して [] -> 問い合わせ変数 のテンソルを作成
+    証拠の確率が 0 の場合は ValueError を送出する。
+    @param network ネットワーク
+    @param factor 証拠にない問い合わせ変数のみをもつ因子
+    @param query_variables 問い合わせ変数のリスト
+    @param evidence 証拠の辞書 (証拠にもある問い合わせ変数は観測値のみに重み 1 を与える)
+    """
+    evidence = evidence or {}
+    variables, table = factor
+    positions = [None if variable in evidence else variables.index(variable) for variable in query_variables]
+    profile = [network["variables"][variable] for variable in query_variables]
+
+    total = 0
+    for values in table.keys():
+        total += table[values]
+    if not total > 0:
+        if markov_tensor.DEBUG:
+            print("evidence has zero probability")
+        raise ValueError("evidence {0} has zero probability".format(evidence))
+
+    tensor_result = {}
+    strands_result = {}
+    tensor_result["profile"] = [[], profile]
+    lookup = {
+        tuple(values[position] for position in positions if position is not None): table[values] for values in table.keys()}
+    for values in itertools.product(*[markov_tensor.get_factor_values(item) for item in profile]):
+        weight = 0
+        if all(position is not None or value == evidence[variable]
+               for variable, position, value in zip(query_variables, positions, values)):
+            weight = lookup.get(tuple(value for position, value in zip(positions, values) if position is not None), 0)
+        codomain_lattice_point = [
+            markov_tensor.create_lattice_component(profile_item, value) for profile_item, value in zip(profile, values)]
+        strands_result[str([[], codomain_lattice_point])] = weight / total
+    tensor_result["strands"] = strands_result
+
+    return tensor_result
+
+
+def clear_cache(network):
+    """
+    ネットワークにキャッシュした中間の因子を破棄
+    @param network ネットワーク
+    """
+    network["cache"] = {}
+    network["cache_hits"] = 0
+    network["cache_misses"] = 0
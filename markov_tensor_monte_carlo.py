@@ -0,0 +1,285 @@
+"""
+粒子によるモンテカルロ近似の計算
+
+格子点を列挙できないほど因子の多い分布 [] -> a を、重み付きの粒子の集まりとして次の辞書で表す。
+  {"profile": [[], a], "positions": 形が (N, 因子数) の因子の値の位置の配列, "weights": 形が (N,) の重み}
+テンソル a -> b との結合は、粒子ごとに域の格子点の列から余域の格子点を抽出して行う。
+テンソル積を展開せずに保持したテンソル (tensor_product(..., factored=True)) は因子ごとに抽出するので、
+[10, 10, 10, 10] のようなプロファイルでもストランドを展開しない。
+  particles = sample_tensor(tensor_product(prior_1, prior_2, factored=True), 10000, seed=0)
+  particles = composition(particles, tensor_product(kernel_1, kernel_2, factored=True))
+  marginal(particles, [0])
+
+周辺分布と条件付き分布の推定値には、有効サンプル・サイズによる正規近似の信頼区間を付ける。
+粒子の数 (サンプル数) は sample_tensor の size と composition などの size で指定し、
+required_size で信頼区間の半幅から必要な数を見積もる。
+"""
+import math
+import statistics
+import numpy as np
+import markov_tensor
+import markov_tensor_numpy
+
+
+def create_particles(profile_side, positions, weights=None):
+    """
+    粒子の集まりを作成
+    @param profile_side プロファイルの余域 a
+    @param positions 形が (N, 因子数) の因子の値の位置の配列
+    @param weights 形が (N,) の重み (省略時はすべて 1 / N)
+    """
+    positions = np.asarray(positions, dtype=np.int64).reshape(-1, len(profile_side))
+    if weights is None:
+        weights = np.full(len(positions), 1.0 / max(len(positions), 1))
+    return {"profile": [[], profile_side], "positions": positions, "weights": np.asarray(weights, dtype=np.float64)}
+
+
+def point_positions(profile_side, lattice_point, positions):
+    # 格子点を因子の値の位置のタプルにする
+    return tuple(position[markov_tensor.get_component_value(component)] for component, position in zip(lattice_point, positions))
+
+
+def positions_point(profile_side, row, values):
+    # 因子の値の位置のタプルを格子点にする
+    return [markov_tensor.create_lattice_component(item, factor_values[position])
+            for item, factor_values, position in zip(profile_side, values, row)]
+
+
+def create_column_table(factor):
+    """
+    テンソルの因子について、域の格子点ごとの余域の格子点と確率の表を必要になったときに作る関数を作成
+    @param factor 展開されたテンソル a -> b
+    @return column 域の値の位置のタプルから (余域の値の位置の配列, 確率の配列) を返す関数
+    """
+    domain_profile = factor["profile"][markov_tensor.DOMAIN_PROFILE]
+    codomain_profile = factor["profile"][markov_tensor.CODOMAIN_PROFILE]
+    domain_values = [markov_tensor.get_factor_values(item) for item in domain_profile]
+    codomain_positions = markov_tensor_numpy.factor_positions(codomain_profile)
+    mode = markov_tensor.get_mode(factor)
+    index = markov_tensor.get_index(factor)
+    table = {}
+
+    def column(row):
+        if row not in table:
+            strands = markov_tensor.select_strands(factor, domain_point=positions_point(domain_profile, row, domain_values))
+            targets = [point_positions(codomain_profile, index["points"][strand][markov_tensor.CODOMAIN_LATTICE_POINT], codomain_positions)
+                       for strand in strands.keys()]
+            probabilities = np.array([markov_tensor.to_probability(weight, mode) for weight in strands.values()], dtype=np.float64)
+            table[row] = (np.array(targets, dtype=np.int64).reshape(len(targets), len(codomain_profile)), probabilities)
+        return table[row]
+
+    return column
+
+
+def split_factors(kernel):
+    # テンソルを因子ごとの (域の因子数, 余域の因子数, 列の表) のリストにする
+    return [
+        (len(factor["profile"][markov_tensor.DOMAIN_PROFILE]), len(factor["profile"][markov_tensor.CODOMAIN_PROFILE]),
+         create_column_table(markov_tensor.materialize(factor)))
+        for factor in markov_tensor.get_factors(kernel)]
+
+
+def propagate(positions, kernel, generator):
+    """
+    粒子ごとに、域の格子点の列から余域の格子点を抽出
+    同じ域の格子点をもつ粒子はまとめて抽出する。
+    @param positions 形が (N, 域の因子数) の配列
+    @param kernel テンソル a -> b
+    @param generator 乱数生成器
+    @return 形が (N, 余域の因子数) の配列
+    """
+    results = []
+    start = 0
+    for domain_length, codomain_length, column in split_factors(kernel):
+        domain_positions = positions[:, start:start + domain_length]
+        start += domain_length
+        result = np.zeros((len(positions), codomain_length), dtype=np.int64)
+        rows, inverse = np.unique(domain_positions, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        for number, row in enumerate(rows):
+            members = np.flatnonzero(inverse == number)
+            targets, probabilities = column(tuple(row.tolist()))
+            total = probabilities.sum()
+            if not total > 0:
+                raise ValueError("column {0} has no probability mass".format(tuple(row.tolist())))
+            result[members] = targets[generator.choice(len(targets), size=len(members), p=probabilities / total)]
+        results.append(result)
+    return np.hstack(results) if results else np.zeros((len(positions), 0), dtype=np.int64)
+
+
+def sample_tensor(tensor, size, seed=None):
+    """
+    分布 [] -> a から粒子を抽出
+    @param tensor テンソル [] -> a (展開されていないテンソル積でもよい)
+    @param size 粒子の数
+    @param seed 乱数の種 (または numpy.random.Generator)
+    """
+    if tensor["profile"][markov_tensor.DOMAIN_PROFILE] != []:
+        raise ValueError("tensor must be [] -> a")
+    generator = np.random.default_rng(seed)
+    positions = propagate(np.zeros((size, 0), dtype=np.int64), tensor, generator)
+    return create_particles(tensor["profile"][markov_tensor.CODOMAIN_PROFILE], positions)
+
+
+def effective_size(particles):
+    """
+    重みの偏りを考慮した有効サンプル・サイズ (和の 2 乗 / 2 乗の和)
+    @param particles 粒子の集まり
+    """
+    weights = particles["weights"]
+    total_squares = float(np.sum(weights ** 2))
+    return float(np.sum(weights)) ** 2 / total_squares if total_squares > 0 else 0.0
+
+
+def resample(particles, size, seed=None):
+    """
+    重みに比例して系統的リサンプリングし、重みのそろった size 個の粒子にする
+    @param particles 粒子の集まり
+    @param size 粒子の数
+    @param seed 乱数の種 (または numpy.random.Generator)
+    """
+    generator = np.random.default_rng(seed)
+    cumulative = np.cumsum(particles["weights"])
+    if not cumulative[-1] > 0:
+        raise ValueError("particles have no weight")
+    points = (generator.random() + np.arange(size)) / size * cumulative[-1]
+    selected = np.minimum(np.searchsorted(cumulative, points, side="right"), len(cumulative) - 1)
+    return create_particles(particles["profile"][markov_tensor.CODOMAIN_PROFILE], particles["positions"][selected])
+
+
+def composition(particles, kernel, size=None, seed=None):
+    """
+    粒子の集まり [] -> a とテンソル a -> b の結合を抽出により近似
+    @param particles 粒子の集まり
+    @param kernel テンソル a -> b (展開されていないテンソル積でもよい)
+    @param size 指定すると、先にこの数にリサンプリングする
+    @param seed 乱数の種 (または numpy.random.Generator)
+    @return 粒子の集まり [] -> b
+    """
+    if particles["profile"][markov_tensor.CODOMAIN_PROFILE] != kernel["profile"][markov_tensor.DOMAIN_PROFILE]:
+        raise ValueError("cannot compose")
+    generator = np.random.default_rng(seed)
+    if size is not None:
+        particles = resample(particles, size, generator)
+    positions = propagate(particles["positions"], kernel, generator)
+    return create_particles(kernel["profile"][markov_tensor.CODOMAIN_PROFILE], positions, particles["weights"])
+
+
+def jointification(particles, kernel, size=None, seed=None):
+    """
+    粒子の集まり [] -> a とテンソル a -> b の同時化を抽出により近似
+    @param particles 粒子の集まり
+    @param kernel テンソル a -> b
+    @param size 指定すると、先にこの数にリサンプリングする
+    @param seed 乱数の種 (または numpy.random.Generator)
+    @return 粒子の集まり [] -> a#b
+    """
+    if particles["profile"][markov_tensor.CODOMAIN_PROFILE] != kernel["profile"][markov_tensor.DOMAIN_PROFILE]:
+        raise ValueError("cannot jointify")
+    generator = np.random.default_rng(seed)
+    if size is not None:
+        particles = resample(particles, size, generator)
+    positions = propagate(particles["positions"], kernel, generator)
+    return create_particles(
+        particles["profile"][markov_tensor.CODOMAIN_PROFILE] + kernel["profile"][markov_tensor.CODOMAIN_PROFILE],
+        np.hstack([particles["positions"], positions]), particles["weights"])
+
+
+def condition(particles, kernel, observation):
+    """
+    テンソル a -> b の余域で観測を得たときの事後分布を、尤度による重み付けで近似
+    conversion(分布, kernel) の観測に対する列を、粒子で表したものにあたる。
+    @param particles 粒子の集まり [] -> a
+    @param kernel テンソル a -> b (展開されていないテンソル積でもよい)
+    @param observation 余域 b の格子点
+    @return 粒子の集まり [] -> a
+    """
+    if particles["profile"][markov_tensor.CODOMAIN_PROFILE] != kernel["profile"][markov_tensor.DOMAIN_PROFILE]:
+        raise ValueError("cannot condition")
+    weights = particles["weights"].copy()
+    start = 0
+    observation_start = 0
+    for factor in markov_tensor.get_factors(kernel):
+        factor = markov_tensor.materialize(factor)
+        domain_length = len(factor["profile"][markov_tensor.DOMAIN_PROFILE])
+        codomain_profile = factor["profile"][markov_tensor.CODOMAIN_PROFILE]
+        target = point_positions(codomain_profile, observation[observation_start:observation_start + len(codomain_profile)],
+                                 markov_tensor_numpy.factor_positions(codomain_profile))
+        column = create_column_table(factor)
+        domain_positions = particles["positions"][:, start:start + domain_length]
+        rows, inverse = np.unique(domain_positions, axis=0, return_inverse=True)
+        likelihoods = np.zeros(len(rows))
+        for number, row in enumerate(rows):
+            targets, probabilities = column(tuple(row.tolist()))
+            matches = np.all(targets == np.array(target, dtype=np.int64), axis=1) if len(targets) else np.zeros(0, dtype=bool)
+            likelihoods[number] = probabilities[matches].sum()
+        weights *= likelihoods[inverse.reshape(-1)]
+        start += domain_length
+        observation_start += len(codomain_profile)
+    return create_particles(particles["profile"][markov_tensor.CODOMAIN_PROFILE], particles["positions"], weights)
+
+
+def normal_quantile(confidence):
+    # 両側の信頼係数に対する標準正規分布の分位点
+    return statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+
+
+def marginal(particles, positions, confidence=0.95):
+    """
+    指定した因子の周辺分布を、信頼区間とともに推定
+    @param particles 粒子の集まり [] -> a
+    @param positions 周辺分布を求める因子の位置 (0 始まり) のリスト
+    @param confidence 信頼係数
+    @return {"estimate": 推定値, "lower": 下限, "upper": 上限 (いずれも [] -> 指定した因子 のテンソル), "effective_size": 有効サンプル・サイズ}
+    """
+    codomain_profile = particles["profile"][markov_tensor.CODOMAIN_PROFILE]
+    profile = [codomain_profile[position] for position in positions]
+    values = [markov_tensor.get_factor_values(item) for item in profile]
+    weights = particles["weights"]
+    total = float(weights.sum())
+    if not total > 0:
+        raise ValueError("particles have no weight")
+    size = effective_size(particles)
+    half_width_factor = normal_quantile(confidence) / math.sqrt(size)
+
+    result = {}
+    for key in ("estimate", "lower", "upper"):
+        result[key] = {"profile": [[], profile], "strands": {}, "mode": markov_tensor.MODE_FLOAT64}
+    rows, inverse = np.unique(particles["positions"][:, positions], axis=0, return_inverse=True)
+    sums = np.bincount(inverse.reshape(-1), weights=weights, minlength=len(rows))
+    for row, weight in zip(rows, sums.tolist()):
+        strand = str([[], positions_point(profile, row.tolist(), values)])
+        estimate = weight / total
+        half_width = half_width_factor * math.sqrt(estimate * (1 - estimate))
+        result["estimate"]["strands"][strand] = estimate
+        result["lower"]["strands"][strand] = max(0.0, estimate - half_width)
+        result["upper"]["strands"][strand] = min(1.0, estimate + half_width)
+    result["effective_size"] = size
+    return result
+
+
+def conditional(particles, given, positions, confidence=0.95):
+    """
+    因子の値を固定したときの、指定した因子の条件付き分布を信頼区間とともに推定
+    @param particles 粒子の集まり [] -> a
+    @param given 因子の位置 (0 始まり) をキー、値 (ラベル、または自然数) を値とする辞書
+    @param positions 分布を求める因子の位置のリスト
+    @param confidence 信頼係数
+    @return marginal と同じ形式の辞書
+    """
+    codomain_profile = particles["profile"][markov_tensor.CODOMAIN_PROFILE]
+    selected = np.ones(len(particles["weights"]), dtype=bool)
+    for position, value in given.items():
+        factor_position = markov_tensor.get_factor_values(codomain_profile[position]).index(markov_tensor.get_component_value(value))
+        selected &= particles["positions"][:, position] == factor_position
+    return marginal(create_particles(codomain_profile, particles["positions"][selected], particles["weights"][selected]),
+                    positions, confidence)
+
+
+def required_size(half_width, confidence=0.95):
+    """
+    確率の推定値の信頼区間の半幅を half_width 以下にするのに必要な (重みのそろった) 粒子の数
+    @param half_width 信頼区間の半幅
+    @param confidence 信頼係数
+    """
+    return math.ceil((normal_quantile(confidence) / half_width) ** 2 / 4)
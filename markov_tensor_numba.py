@@ -0,0 +1,234 @@
+"""
+Numba でコンパイルした疎なマルコフ・テンソルの計算
+
+重みが 0 でないストランドを CSR 形式の配列 (indptr, indices, data) として保持し、
+結合の内側のループ、条件化の周辺の重みによる割り算、is_markov の域の格子点ごとの和を
+コンパイルして実行する。行 (域の格子点) のまとまりごとに numba.prange で複数のコアに分ける。
+markov_tensor の JIT バックエンド "jit" として OPERATIONS の演算を提供する。
+Numba は任意の依存 (requirements.txt には含めない) で、import できなければ markov_tensor は jit を選ばない。
+
+和はストランドのキーの順に足すので、辞書による実装 (python) と同じ結果になる。
+プロファイルの因子がすべて整数のテンソルは、キーを 1 個ずつ eval せずに、まとめて数値の配列として読む。
+"""
+import numba
+import numpy as np
+import markov_tensor
+import markov_tensor_numpy
+
+# キーの括弧とカンマを空白にする変換表
+KEY_TRANSLATION = str.maketrans("[],", "   ")
+
+
+def strand_arrays(tensor, dtype):
+    """
+    ストランドを、キーの順の行番号、列番号、重みの配列に変換 (重み 0 のストランドも含む)
+    @param tensor テンソル a -> b
+    @param dtype 重みの配列の要素の型
+    @return rows, columns, data, shape
+    """
+    tensor = markov_tensor.materialize(tensor)
+    mode = markov_tensor.get_mode(tensor)
+    domain_profile = tensor["profile"][markov_tensor.DOMAIN_PROFILE]
+    codomain_profile = tensor["profile"][markov_tensor.CODOMAIN_PROFILE]
+    domain_sizes = markov_tensor_numpy.profile_sizes(domain_profile)
+    codomain_sizes = markov_tensor_numpy.profile_sizes(codomain_profile)
+    shape = (int(np.prod(domain_sizes)), int(np.prod(codomain_sizes)))
+    keys = list(tensor["strands"].keys())
+    data = np.array([markov_tensor.to_probability(weight, mode) for weight in tensor["strands"].values()], dtype=dtype)
+
+    values = None
+    if all(type(item) == int for item in domain_profile + codomain_profile):
+        # 整数の因子の値 1..n のみが並ぶので、すべてのキーを 1 個の文字列として読む
+        values = np.array(" ".join(keys).translate(KEY_TRANSLATION).split(), dtype=np.int64)
+        if len(values) != len(keys) * (len(domain_sizes) + len(codomain_sizes)):
+            values = None
+    if values is None:
+        domain_positions = markov_tensor_numpy.factor_positions(domain_profile)
+        codomain_positions = markov_tensor_numpy.factor_positions(codomain_profile)
+        rows = np.zeros(len(keys), dtype=np.int64)
+        columns = np.zeros(len(keys), dtype=np.int64)
+        for number, strand in enumerate(keys):
+            strand_from, strand_to = markov_tensor.get_lattice_points(strand)
+            rows[number] = markov_tensor_numpy.lattice_point_index(domain_profile, strand_from, domain_positions)
+            columns[number] = markov_tensor_numpy.lattice_point_index(codomain_profile, strand_to, codomain_positions)
+        return rows, columns, data, shape
+
+    values = values.reshape(len(keys), len(domain_sizes) + len(codomain_sizes)) - 1
+    rows = np.zeros(len(keys), dtype=np.int64)
+    columns = np.zeros(len(keys), dtype=np.int64)
+    for position, size in enumerate(domain_sizes):
+        rows = rows * size + values[:, position]
+    for position, size in enumerate(codomain_sizes):
+        columns = columns * size + values[:, len(domain_sizes) + position]
+    return rows, columns, data, shape
+
+
+def group_positions(groups, number_of_groups):
+    """
+    グループ番号の配列から、グループごとに元の順を保って並べた位置と、その区切りを作成
+    @return indptr, order (order[indptr[g]:indptr[g + 1]] がグループ g の位置)
+    """
+    order = np.argsort(groups, kind="stable")
+    indptr = np.zeros(number_of_groups + 1, dtype=np.int64)
+    np.cumsum(np.bincount(groups, minlength=number_of_groups), out=indptr[1:])
+    return indptr, order
+
+
+def to_csr_arrays(tensor, dtype=None):
+    """
+    テンソルを CSR 形式の配列に変換
+    @param tensor テンソル a -> b
+    @param dtype 重みの配列の要素の型 (省略時は数値モードに対応する型)
+    @return indptr, indices, data, shape
+    """
+    if dtype is None:
+        dtype = markov_tensor_numpy.get_dtype(markov_tensor.get_mode(tensor))
+    rows, columns, data, shape = strand_arrays(tensor, dtype)
+    nonzero = data != 0
+    rows, columns, data = rows[nonzero], columns[nonzero], data[nonzero]
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+    return indptr, columns[order], data[order], shape
+
+
+def csr_to_coo_rows(indptr):
+    # CSR の indptr から各要素の行番号の配列を作成
+    return np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+
+
+def chunk_bounds(number_of_rows):
+    # 行をスレッドの数のまとまりに分ける区切り
+    number_of_chunks = max(1, min(numba.get_num_threads(), number_of_rows))
+    return np.arange(number_of_chunks + 1, dtype=np.int64) * number_of_rows // number_of_chunks
+
+
+@numba.njit(parallel=True, cache=True)
+def csr_matmul(indptr_x, indices_x, data_x, indptr_y, indices_y, data_y, number_of_columns, bounds):
+    """
+    CSR 形式の行列の積 (Gustavson のアルゴリズム)
+    1 回目の走査で各行の要素数を数え、2 回目の走査で値を埋める。
+    行のまとまり (bounds で区切る) ごとに作業用の配列をもち、まとまりを並列に計算する。
+    """
+    number_of_rows = len(indptr_x) - 1
+    counts = np.zeros(number_of_rows + 1, dtype=np.int64)
+    for chunk in numba.prange(len(bounds) - 1):
+        marker = np.full(number_of_columns, -1, dtype=np.int64)
+        for row in range(bounds[chunk], bounds[chunk + 1]):
+            count = 0
+            for position_x in range(indptr_x[row], indptr_x[row + 1]):
+                middle = indices_x[position_x]
+                for position_y in range(indptr_y[middle], indptr_y[middle + 1]):
+                    column = indices_y[position_y]
+                    if marker[column] != row:
+                        marker[column] = row
+                        count += 1
+            counts[row + 1] = count
+    indptr = np.cumsum(counts)
+
+    indices = np.empty(indptr[number_of_rows], dtype=np.int64)
+    data = np.zeros(indptr[number_of_rows], dtype=data_x.dtype)
+    for chunk in numba.prange(len(bounds) - 1):
+        slot = np.full(number_of_columns, -1, dtype=np.int64)
+        for row in range(bounds[chunk], bounds[chunk + 1]):
+            next_position = indptr[row]
+            for position_x in range(indptr_x[row], indptr_x[row + 1]):
+                middle = indices_x[position_x]
+                weight = data_x[position_x]
+                for position_y in range(indptr_y[middle], indptr_y[middle + 1]):
+                    column = indices_y[position_y]
+                    if slot[column] < indptr[row]:
+                        slot[column] = next_position
+                        indices[next_position] = column
+                        next_position += 1
+                    data[slot[column]] += weight * data_y[position_y]
+    return indptr, indices, data
+
+
+@numba.njit(parallel=True, cache=True)
+def grouped_sums(indptr, order, data):
+    """
+    グループごとの重みの和 (グループ内は元の順に足す)
+    @return totals グループごとの和 (重みの配列と同じ型)
+    """
+    totals = np.zeros(len(indptr) - 1, dtype=data.dtype)
+    for group in numba.prange(len(indptr) - 1):
+        for position in range(indptr[group], indptr[group + 1]):
+            totals[group] += data[order[position]]
+    return totals
+
+
+@numba.njit(parallel=True, cache=True)
+def divide_by_groups(groups, data, totals, fallback):
+    """
+    各重みを、そのグループの和で割る (和が正でなければ fallback で割る)
+    """
+    result = np.empty_like(data)
+    for position in numba.prange(len(data)):
+        total = totals[groups[position]]
+        result[position] = data[position] / (total if total > 0 else fallback)
+    return result
+
+
+def composition(tensor_x, tensor_y, mode):
+    """
+    結合をコンパイルした疎行列の積として算出
+    @param tensor_x テンソル a -> b
+    @param tensor_y テンソル b -> c
+    @param mode 数値モード
+    @return tensor_result テンソル a -> c
+    """
+    profile = [
+        tensor_x["profile"][markov_tensor.DOMAIN_PROFILE],
+        tensor_y["profile"][markov_tensor.CODOMAIN_PROFILE]
+    ]
+    indptr_x, indices_x, data_x, _ = to_csr_arrays(tensor_x)
+    indptr_y, indices_y, data_y, shape_y = to_csr_arrays(tensor_y)
+    indptr, indices, data = csr_matmul(
+        indptr_x, indices_x, data_x, indptr_y, indices_y, data_y, shape_y[1], chunk_bounds(len(indptr_x) - 1))
+    return markov_tensor_numpy.from_coo_arrays(csr_to_coo_rows(indptr), indices, data, profile, mode)
+
+
+def conditionalization(tensor_x, concat_start_index, mode):
+    """
+    条件化を、a の格子点ごとの周辺の重みによる割り算として算出
+    @param tensor_x テンソル [] -> a#b
+    @param concat_start_index 余域の a と b の区切りとして、b の開始に関する index
+    @param mode 数値モード
+    @return tensor_result テンソル a -> b (入力と同じストランドをもつ)
+    """
+    codomain_profile = tensor_x["profile"][markov_tensor.CODOMAIN_PROFILE]
+    profile = [codomain_profile[0:concat_start_index - 1], codomain_profile[concat_start_index - 1:]]
+    size_b = int(np.prod(markov_tensor_numpy.profile_sizes(profile[markov_tensor.CODOMAIN_PROFILE])))
+    _, columns, data, shape = strand_arrays(tensor_x, markov_tensor_numpy.get_dtype(mode))
+    groups, columns_b = np.divmod(columns, size_b)
+    indptr, order = group_positions(groups, shape[1] // size_b)
+    totals = grouped_sums(indptr, order, data)
+    result = divide_by_groups(groups, data, totals, data.dtype.type(99999))
+
+    # 同時分布の誤差 e は、周辺の重み P' で割ることで各列について高々 2e / P' に拡大する
+    error_bound = tensor_x.get("error_bound", 0)
+    if error_bound > 0:
+        positive_totals = totals[(np.diff(indptr) > 0) & (totals > 0)]
+        error_bound = 2 * error_bound / float(positive_totals.min()) if len(positive_totals) > 0 else float("inf")
+    tensor_result = markov_tensor_numpy.from_coo_arrays(groups, columns_b, result, profile, mode)
+    return markov_tensor.set_result_mode(tensor_result, mode, error_bound)
+
+
+def is_markov(tensor, mode):
+    """
+    ストランドをもつ域の格子点ごとの重みの和が 1 であるか
+    @param tensor テンソル a -> b
+    @param mode 数値モード
+    """
+    rows, _, data, shape = strand_arrays(tensor, markov_tensor_numpy.get_dtype(mode))
+    indptr, order = group_positions(rows, shape[0])
+    totals = grouped_sums(indptr, order, data)
+    return bool(np.all(totals[np.diff(indptr) > 0] == 1.0))
+
+
+OPERATIONS = {
+    "composition": composition,
+    "conditionalization": conditionalization,
+    "is_markov": is_markov
+}
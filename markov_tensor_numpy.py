@@ -0,0 +1,305 @@
+"""
+NumPy による密なマルコフ・テンソルの計算
+
+テンソル a -> b を、行が域 a の格子点、列が余域 b の格子点の行列 (|a| x |b|) として表現する。
+格子点の順序は markov_tensor.create_indexies (itertools.product) と同じ。
+markov_tensor の密なバックエンド "numpy" として OPERATIONS の演算を提供する。
+"""
+import importlib
+import itertools
+import numpy as np
+import markov_tensor
+
+
+def profile_sizes(profile_side):
+    """
+    プロファイルの域または余域から各因子の大きさのリストを作成
+    @param profile_side プロファイルの域または余域 (例: [3, 2], [['M', 'W']])
+    """
+    return [len(markov_tensor.get_factor_values(item)) for item in profile_side]
+
+
+def lattice_points(profile_side):
+    """
+    プロファイルの域または余域の格子点のリストを、行列の行 (列) の順に作成
+    @param profile_side プロファイルの域または余域
+    """
+    return [
+        [markov_tensor.create_lattice_component(item, value) for item, value in zip(profile_side, point)]
+        for point in itertools.product(*[markov_tensor.get_factor_values(item) for item in profile_side])]
+
+
+def lattice_point_index(profile_side, lattice_point, positions=None):
+    """
+    格子点の行列における行 (列) の番号を算出
+    @param profile_side プロファイルの域または余域
+    @param lattice_point 格子点
+    @param positions 因子ごとの値から位置への辞書のリスト (省略時は作成)
+    """
+    if positions is None:
+        positions = factor_positions(profile_side)
+    index = 0
+    for item, component, position in zip(profile_side, lattice_point, positions):
+        index = index * len(position) + position[markov_tensor.get_component_value(component)]
+    return index
+
+
+def index_lattice_point(profile_side, index, values=None):
+    """
+    行列における行 (列) の番号から格子点を作成
+    @param profile_side プロファイルの域または余域
+    @param index 行 (列) の番号
+    @param values 因子ごとの値のリスト (省略時は作成)
+    """
+    if values is None:
+        values = [markov_tensor.get_factor_values(item) for item in profile_side]
+    lattice_point = []
+    for item, factor_values in zip(reversed(profile_side), reversed(values)):
+        index, position = divmod(index, len(factor_values))
+        lattice_point.append(markov_tensor.create_lattice_component(item, factor_values[position]))
+    lattice_point.reverse()
+    return lattice_point
+
+
+def factor_positions(profile_side):
+    # 因子ごとに、値から位置への辞書を作成
+    return [
+        {value: position for position, value in enumerate(markov_tensor.get_factor_values(item))}
+        for item in profile_side]
+
+
+def to_matrix(tensor, dtype=np.float64):
+    """
+    テンソルを密な行列に変換
+    @param tensor テンソル a -> b
+    @param dtype 行列の要素の型
+    @return matrix |a| x |b| の行列
+    """
+    tensor = markov_tensor.materialize(tensor)
+    mode = markov_tensor.get_mode(tensor)
+    domain_profile = tensor["profile"][markov_tensor.DOMAIN_PROFILE]
+    codomain_profile = tensor["profile"][markov_tensor.CODOMAIN_PROFILE]
+    domain_positions = factor_positions(domain_profile)
+    codomain_positions = factor_positions(codomain_profile)
+
+    matrix = np.zeros((int(np.prod(profile_sizes(domain_profile))), int(np.prod(profile_sizes(codomain_profile)))), dtype=dtype)
+    for strand in tensor["strands"].keys():
+        strand_from, strand_to = markov_tensor.get_lattice_points(strand)
+        matrix[
+            lattice_point_index(domain_profile, strand_from, domain_positions),
+            lattice_point_index(codomain_profile, strand_to, codomain_positions)
+        ] = markov_tensor.to_probability(tensor["strands"][strand], mode)
+    return matrix
+
+
+def to_log_matrix(tensor):
+    """
+    テンソルを、重みの対数を要素とする密な行列に変換 (重み 0 は -inf)
+    @param tensor テンソル a -> b
+    @return matrix |a| x |b| の行列
+    """
+    tensor = markov_tensor.materialize(tensor)
+    if markov_tensor.get_mode(tensor) != markov_tensor.MODE_LOG:
+        tensor = markov_tensor.convert_mode(tensor, markov_tensor.MODE_LOG)
+    domain_profile = tensor["profile"][markov_tensor.DOMAIN_PROFILE]
+    codomain_profile = tensor["profile"][markov_tensor.CODOMAIN_PROFILE]
+    domain_positions = factor_positions(domain_profile)
+    codomain_positions = factor_positions(codomain_profile)
+
+    matrix = np.full((int(np.prod(profile_sizes(domain_profile))), int(np.prod(profile_sizes(codomain_profile)))), -np.inf)
+    for strand in tensor["strands"].keys():
+        strand_from, strand_to = markov_tensor.get_lattice_points(strand)
+        matrix[
+            lattice_point_index(domain_profile, strand_from, domain_positions),
+            lattice_point_index(codomain_profile, strand_to, codomain_positions)
+        ] = tensor["strands"][strand]
+    return matrix
+
+
+def to_coo_arrays(tensor, dtype=np.float64):
+    """
+    テンソルの重みが 0 でないストランドを、行番号、列番号、重みの配列に変換
+    @param tensor テンソル a -> b
+    @param dtype 重みの配列の要素の型
+    @return rows, columns, data, shape
+    """
+    tensor = markov_tensor.materialize(tensor)
+    mode = markov_tensor.get_mode(tensor)
+    domain_profile = tensor["profile"][markov_tensor.DOMAIN_PROFILE]
+    codomain_profile = tensor["profile"][markov_tensor.CODOMAIN_PROFILE]
+    domain_positions = factor_positions(domain_profile)
+    codomain_positions = factor_positions(codomain_profile)
+
+    rows = []
+    columns = []
+    data = []
+    for strand in tensor["strands"].keys():
+        weight = markov_tensor.to_probability(tensor["strands"][strand], mode)
+        if weight != 0:
+            strand_from, strand_to = markov_tensor.get_lattice_points(strand)
+            rows.append(lattice_point_index(domain_profile, strand_from, domain_positions))
+            columns.append(lattice_point_index(codomain_profile, strand_to, codomain_positions))
+            data.append(weight)
+    shape = (int(np.prod(profile_sizes(domain_profile))), int(np.prod(profile_sizes(codomain_profile))))
+    return np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64), np.array(data, dtype=dtype), shape
+
+
+def from_coo_arrays(rows, columns, data, profile, mode=markov_tensor.MODE_FLOAT64):
+    """
+    行番号、列番号、重みの配列からテンソルを作成 (与えられたストランドのみをもつ)
+    @param rows 行番号の配列
+    @param columns 列番号の配列
+    @param data 重みの配列
+    @param profile プロファイル [a, b]
+    @param mode 数値モード
+    @return tensor_result テンソル a -> b
+    """
+    domain_profile = profile[markov_tensor.DOMAIN_PROFILE]
+    codomain_profile = profile[markov_tensor.CODOMAIN_PROFILE]
+    domain_values = [markov_tensor.get_factor_values(item) for item in domain_profile]
+    codomain_values = [markov_tensor.get_factor_values(item) for item in codomain_profile]
+
+    tensor_result = {}
+    strands_result = {}
+    tensor_result["profile"] = profile
+    for row, column, weight in zip(rows.tolist(), columns.tolist(), data.tolist()):
+        strands_result[str([
+            index_lattice_point(domain_profile, row, domain_values),
+            index_lattice_point(codomain_profile, column, codomain_values)
+        ])] = markov_tensor.convert_value(weight, markov_tensor.MODE_FLOAT64, mode)
+    tensor_result["strands"] = strands_result
+    tensor_result["mode"] = mode
+    return tensor_result
+
+
+def from_matrix(matrix, profile, mode=markov_tensor.MODE_FLOAT64, log_values=False):
+    """
+    密な行列からテンソルを作成
+    @param matrix |a| x |b| の行列
+    @param profile プロファイル [a, b]
+    @param mode 数値モード
+    @param log_values True なら行列の要素を重みの対数とみなす
+    @return tensor_result テンソル a -> b
+    """
+    mode_from = markov_tensor.MODE_LOG if log_values else markov_tensor.MODE_FLOAT64
+    tensor_result = {}
+    strands_result = {}
+    tensor_result["profile"] = profile
+    codomain_points = lattice_points(profile[markov_tensor.CODOMAIN_PROFILE])
+    for row, domain_point in zip(matrix, lattice_points(profile[markov_tensor.DOMAIN_PROFILE])):
+        for weight, codomain_point in zip(row.tolist(), codomain_points):
+            strands_result[str([domain_point, codomain_point])] = markov_tensor.convert_value(
+                weight, mode_from, mode)
+    tensor_result["strands"] = strands_result
+    tensor_result["mode"] = mode
+    return tensor_result
+
+
+def to_array(tensor, dtype=np.float64):
+    """
+    テンソルを、域と余域の各因子を軸とする配列に変換
+    @param tensor テンソル a -> b
+    @param dtype 配列の要素の型
+    """
+    return to_matrix(tensor, dtype).reshape(
+        profile_sizes(tensor["profile"][markov_tensor.DOMAIN_PROFILE]) +
+        profile_sizes(tensor["profile"][markov_tensor.CODOMAIN_PROFILE]))
+
+
+def trajectory(tensor_distribution, tensor_kernel, steps, dtype=np.float64):
+    """
+    分布 [] -> a にテンソル a -> a を繰り返し結合した各ステップの分布を 1 個の配列として算出
+    辞書を介さず、行列を一度だけ作ってからベクトルと行列の積を繰り返す。
+    重みが 0 でないストランドの割合が markov_tensor.SPARSE_MAX_DENSITY 以下のカーネル (格子の拡散など) は
+    SciPy の疎行列とし、各ステップの手間をストランドの数に比例させる。それ以外は密な行列とする。
+    @param tensor_distribution テンソル [] -> a
+    @param tensor_kernel テンソル a -> a
+    @param steps ステップ数 T (0 ステップ目は tensor_distribution)
+    @param dtype 配列の要素の型
+    @return result 形が (T, a の各因子の大きさ...) の配列 (例: a = [n, m] なら (T, n, m))
+    """
+    codomain_profile = tensor_distribution["profile"][markov_tensor.CODOMAIN_PROFILE]
+    if not markov_tensor.check_composable(tensor_distribution, tensor_kernel) or \
+            tensor_kernel["profile"][markov_tensor.CODOMAIN_PROFILE] != codomain_profile:
+        raise ValueError("kernel must be a -> a for a distribution [] -> a")
+
+    tensor_kernel = markov_tensor.materialize(tensor_kernel)
+    size = int(np.prod(profile_sizes(codomain_profile)))
+    result = np.empty((steps, size), dtype=dtype)
+    if steps > 0:
+        result[0] = to_matrix(tensor_distribution, dtype)[0]
+    if markov_tensor.count_nonzero(tensor_kernel) <= markov_tensor.SPARSE_MAX_DENSITY * size * size:
+        # 行ベクトルと行列の積 p P を、転置した CSR 形式の行列とベクトルの積 P^T p として計算
+        kernel = importlib.import_module("markov_tensor_sparse").to_csr(tensor_kernel, dtype).T.tocsr()
+        for step in range(1, steps):
+            result[step] = kernel @ result[step - 1]
+    else:
+        kernel = to_matrix(tensor_kernel, dtype)
+        for step in range(1, steps):
+            np.matmul(result[step - 1], kernel, out=result[step])
+    return result.reshape([steps] + profile_sizes(codomain_profile))
+
+
+def get_dtype(mode):
+    # 数値モードに対応する要素の型
+    return np.float32 if mode == markov_tensor.MODE_FLOAT32 else np.float64
+
+
+def log_matmul(matrix_x, matrix_y):
+    """
+    対数空間での行列の積 log(exp(X) exp(Y)) を、行と列の最大値を引いてアンダーフローを避けて算出
+    @param matrix_x 重みの対数の行列
+    @param matrix_y 重みの対数の行列
+    """
+    shift_x = np.max(matrix_x, axis=1, keepdims=True)
+    shift_y = np.max(matrix_y, axis=0, keepdims=True)
+    shift_x = np.where(np.isfinite(shift_x), shift_x, 0.0)
+    shift_y = np.where(np.isfinite(shift_y), shift_y, 0.0)
+    with np.errstate(divide="ignore"):
+        return np.log(np.exp(matrix_x - shift_x) @ np.exp(matrix_y - shift_y)) + shift_x + shift_y
+
+
+def composition(tensor_x, tensor_y, mode):
+    """
+    結合を密な行列の積として算出
+    @param tensor_x テンソル a -> b
+    @param tensor_y テンソル b -> c
+    @param mode 数値モード
+    @return tensor_result テンソル a -> c
+    """
+    profile = [
+        tensor_x["profile"][markov_tensor.DOMAIN_PROFILE],
+        tensor_y["profile"][markov_tensor.CODOMAIN_PROFILE]
+    ]
+    if mode == markov_tensor.MODE_LOG:
+        return from_matrix(log_matmul(to_log_matrix(tensor_x), to_log_matrix(tensor_y)), profile, mode, log_values=True)
+    dtype = get_dtype(mode)
+    return from_matrix(to_matrix(tensor_x, dtype) @ to_matrix(tensor_y, dtype), profile, mode)
+
+
+def tensor_product(tensor_x, tensor_y, mode):
+    """
+    テンソル積を密な行列のクロネッカー積として算出
+    @param tensor_x テンソル a -> b
+    @param tensor_y テンソル c -> d
+    @param mode 数値モード
+    @return tensor_result テンソル a#c -> b#d
+    """
+    profile = [
+        tensor_x["profile"][markov_tensor.DOMAIN_PROFILE] + tensor_y["profile"][markov_tensor.DOMAIN_PROFILE],
+        tensor_x["profile"][markov_tensor.CODOMAIN_PROFILE] + tensor_y["profile"][markov_tensor.CODOMAIN_PROFILE]
+    ]
+    if mode == markov_tensor.MODE_LOG:
+        matrix_x = to_log_matrix(tensor_x)
+        matrix_y = to_log_matrix(tensor_y)
+        matrix = (matrix_x[:, None, :, None] + matrix_y[None, :, None, :]).reshape(
+            matrix_x.shape[0] * matrix_y.shape[0], matrix_x.shape[1] * matrix_y.shape[1])
+        return from_matrix(matrix, profile, mode, log_values=True)
+    dtype = get_dtype(mode)
+    return from_matrix(np.kron(to_matrix(tensor_x, dtype), to_matrix(tensor_y, dtype)), profile, mode)
+
+
+OPERATIONS = {
+    "composition": composition,
+    "tensor_product": tensor_product
+}
@@ -0,0 +1,426 @@
+"""
+メモリに載らないテンソルのブロック単位の計算
+
+テンソル a -> b を、行が域 a の格子点、列が余域 b の格子点の行列として、
+block_size x block_size のブロックに分けてディレクトリに保存する。
+行列が 1 行 (分布 [] -> b) の場合は 1 x block_size^2、1 列の場合は block_size^2 x 1 の長方形のブロックとする。
+  path/meta.json         プロファイル、行列の形、ブロックの形、内容の指紋
+  path/block_{i}_{j}.npy i 行 j 列目のブロック (np.load の mmap_mode でメモリマップして読む)
+
+結合、周辺化、条件化は、入力のブロックを順に読み、結果をブロックごとに書き出す。
+同時にメモリに置くのは数個のブロックのみ。結果のブロックは書き終えてから名前を付けるので、
+中断した計算を同じ引数で呼び直すと、書き終えたブロックを飛ばして再開する。
+meta.json の指紋は、to_blocked ではテンソルの内容のハッシュ値、演算の結果では演算名、入力の指紋、引数から作り、
+再開の際に一致しなければ (入力が変わっていれば) ValueError を送出する。
+"""
+import hashlib
+import json
+import math
+import os
+import numpy as np
+import markov_tensor
+import markov_tensor_numpy
+
+META_FILE = "meta.json"
+DEFAULT_BLOCK_SIZE = 1024
+
+
+def create_blocked(path, profile, block_size=DEFAULT_BLOCK_SIZE, fingerprint=None):
+    """
+    ブロックに分けたテンソルを保存するディレクトリを作成
+    既に同じプロファイル、ブロックの大きさ、指紋のディレクトリがあれば、そのまま使う (再開のため)。
+    @param path ディレクトリのパス
+    @param profile プロファイル
+    @param block_size ブロックの行数と列数
+    @param fingerprint 内容の指紋 (to_blocked ではテンソルのハッシュ値、演算では derive_fingerprint の値)
+    @return meta テンソルの情報
+    """
+    shape = [
+        int(np.prod(markov_tensor_numpy.profile_sizes(profile[markov_tensor.DOMAIN_PROFILE]))),
+        int(np.prod(markov_tensor_numpy.profile_sizes(profile[markov_tensor.CODOMAIN_PROFILE])))
+    ]
+    # 1 行または 1 列の行列は、ブロックの要素数を変えずに長方形のブロックに分ける
+    if shape[0] == 1:
+        block_shape_meta = [1, block_size * block_size]
+    elif shape[1] == 1:
+        block_shape_meta = [block_size * block_size, 1]
+    else:
+        block_shape_meta = [block_size, block_size]
+    meta = {
+        "profile": profile,
+        "shape": shape,
+        "block_size": block_size,
+        "block_shape": block_shape_meta,
+        "mode": markov_tensor.MODE_FLOAT64,
+        "fingerprint": fingerprint
+    }
+    meta_path = os.path.join(path, META_FILE)
+    if os.path.exists(meta_path):
+        existing = load_meta(path)
+        if existing["profile"] != profile or existing["block_size"] != block_size or \
+                existing.get("fingerprint") != fingerprint:
+            raise ValueError("{0} already holds a different tensor".format(path))
+        return existing
+    os.makedirs(path, exist_ok=True)
+    with open(meta_path, "w", encoding="utf-8") as file:
+        json.dump(meta, file, ensure_ascii=False)
+    return meta
+
+
+def derive_fingerprint(operation, *parts):
+    """
+    演算の結果の指紋を、演算名、入力の指紋、引数から作成
+    @param operation 演算名
+    @param parts 入力の指紋や引数
+    """
+    digest = hashlib.sha256()
+    for part in (operation,) + parts:
+        digest.update(repr(part).encode())
+    return digest.hexdigest()
+
+
+def load_meta(path):
+    """
+    ブロックに分けたテンソルの情報を読み込む
+    @param path ディレクトリのパス
+    """
+    with open(os.path.join(path, META_FILE), encoding="utf-8") as file:
+        return json.load(file)
+
+
+def get_block_shape(meta):
+    # ブロックの行数と列数 (block_shape のない古い meta.json は正方形のブロック)
+    return meta.get("block_shape", [meta["block_size"], meta["block_size"]])
+
+
+def count_blocks(meta):
+    # 行方向と列方向のブロックの数
+    rows, columns = get_block_shape(meta)
+    return (
+        max(1, math.ceil(meta["shape"][0] / rows)),
+        max(1, math.ceil(meta["shape"][1] / columns)))
+
+
+def block_shape(meta, block_row, block_column):
+    # ブロックの行数と列数 (端のブロックは小さい)
+    rows, columns = get_block_shape(meta)
+    return (
+        min(rows, meta["shape"][0] - block_row * rows),
+        min(columns, meta["shape"][1] - block_column * columns))
+
+
+def block_path(path, block_row, block_column):
+    return os.path.join(path, "block_{0}_{1}.npy".format(block_row, block_column))
+
+
+def has_block(path, block_row, block_column):
+    """
+    ブロックが書き終わっているかチェック
+    @param path ディレクトリのパス
+    @param block_row ブロックの行番号
+    @param block_column ブロックの列番号
+    """
+    return os.path.exists(block_path(path, block_row, block_column))
+
+
+def read_block(path, meta, block_row, block_column, opened=None):
+    """
+    ブロックをメモリマップして読む (書かれていないブロックは 0 とする)
+    @param path ディレクトリのパス
+    @param meta テンソルの情報
+    @param block_row ブロックの行番号
+    @param block_column ブロックの列番号
+    @param opened 読んだブロックを保持する辞書 (同じブロックを何度も読む場合に np.load を 1 回にする)
+    """
+    if opened is not None and (path, block_row, block_column) in opened:
+        return opened[(path, block_row, block_column)]
+    if not has_block(path, block_row, block_column):
+        block = np.zeros(block_shape(meta, block_row, block_column))
+    else:
+        block = np.load(block_path(path, block_row, block_column), mmap_mode="r")
+    if opened is not None:
+        opened[(path, block_row, block_column)] = block
+    return block
+
+
+def write_block(path, block_row, block_column, block):
+    """
+    ブロックを一時ファイルに書いてから名前を付け替えて保存
+    @param path ディレクトリのパス
+    @param block_row ブロックの行番号
+    @param block_column ブロックの列番号
+    @param block ブロックの配列
+    """
+    temporary_path = block_path(path, block_row, block_column) + ".tmp"
+    with open(temporary_path, "wb") as file:
+        np.save(file, np.ascontiguousarray(block, dtype=np.float64))
+    os.replace(temporary_path, block_path(path, block_row, block_column))
+
+
+def read_region(path, meta, row_start, row_stop, column_start, column_stop, opened=None):
+    """
+    行 row_start から row_stop の手前まで、列 column_start から column_stop の手前までを、またがるブロックから読む
+    @param path ディレクトリのパス
+    @param meta テンソルの情報
+    @param row_start 行の開始
+    @param row_stop 行の終了
+    @param column_start 列の開始
+    @param column_stop 列の終了
+    @param opened 読んだブロックを保持する辞書
+    """
+    rows, columns = get_block_shape(meta)
+    region = np.zeros((row_stop - row_start, column_stop - column_start))
+    for block_row in range(row_start // rows, math.ceil(row_stop / rows)):
+        top = max(row_start, block_row * rows)
+        bottom = min(row_stop, (block_row + 1) * rows)
+        for block_column in range(column_start // columns, math.ceil(column_stop / columns)):
+            left = max(column_start, block_column * columns)
+            right = min(column_stop, (block_column + 1) * columns)
+            block = read_block(path, meta, block_row, block_column, opened)
+            region[top - row_start:bottom - row_start, left - column_start:right - column_start] = \
+                block[top - block_row * rows:bottom - block_row * rows, left - block_column * columns:right - block_column * columns]
+    return region
+
+
+def read_segment(path, meta, row, start, stop, opened=None):
+    """
+    行 row の列 start から stop の手前までを、またがるブロックから読む
+    @param path ディレクトリのパス
+    @param meta テンソルの情報
+    @param row 行番号
+    @param start 列の開始
+    @param stop 列の終了
+    @param opened 読んだブロックを保持する辞書
+    """
+    return read_region(path, meta, row, row + 1, start, stop, opened)[0]
+
+
+def to_blocked(tensor, path, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    テンソルをブロックに分けて保存
+    @param tensor テンソル
+    @param path ディレクトリのパス
+    @param block_size ブロックの行数と列数 (1 行または 1 列の行列では block_size^2 個の要素を 1 個のブロックとする)
+    @return meta テンソルの情報
+    """
+    tensor = markov_tensor.materialize(tensor)
+    meta = create_blocked(path, tensor["profile"], block_size, markov_tensor.tensor_hash(tensor))
+    rows, columns, data, _ = markov_tensor_numpy.to_coo_arrays(tensor)
+    number_of_block_rows, number_of_block_columns = count_blocks(meta)
+    block_height, block_width = get_block_shape(meta)
+    block_rows = rows // block_height
+    block_columns = columns // block_width
+    for block_row in range(number_of_block_rows):
+        for block_column in range(number_of_block_columns):
+            block = np.zeros(block_shape(meta, block_row, block_column))
+            selected = (block_rows == block_row) & (block_columns == block_column)
+            block[rows[selected] % block_height, columns[selected] % block_width] = data[selected]
+            write_block(path, block_row, block_column, block)
+    return meta
+
+
+def from_blocked(path):
+    """
+    ブロックに分けたテンソルを辞書のテンソルとして読み込む (全体がメモリに載る場合に使う)
+    @param path ディレクトリのパス
+    @return tensor_result テンソル
+    """
+    meta = load_meta(path)
+    number_of_block_rows, number_of_block_columns = count_blocks(meta)
+    matrix = np.block([
+        [np.asarray(read_block(path, meta, block_row, block_column)) for block_column in range(number_of_block_columns)]
+        for block_row in range(number_of_block_rows)])
+    return markov_tensor_numpy.from_matrix(matrix, meta["profile"], meta["mode"])
+
+
+def run_blocks(path_result, meta_result, compute_block, progress=None):
+    """
+    結果のブロックを順に計算して書き出す (書き終わっているブロックは飛ばす)
+    @param path_result 結果のディレクトリのパス
+    @param meta_result 結果のテンソルの情報
+    @param compute_block ブロックの行番号と列番号から配列を計算する関数
+    @param progress 書き終えたブロックの数と全体の数を受け取る関数
+    """
+    number_of_block_rows, number_of_block_columns = count_blocks(meta_result)
+    total = number_of_block_rows * number_of_block_columns
+    done = 0
+    for block_row in range(number_of_block_rows):
+        for block_column in range(number_of_block_columns):
+            if not has_block(path_result, block_row, block_column):
+                write_block(path_result, block_row, block_column, compute_block(block_row, block_column))
+            done += 1
+            if progress is not None:
+                progress(done, total)
+    return meta_result
+
+
+def composition(path_x, path_y, path_result, progress=None):
+    """
+    結合をブロック単位の行列の積として算出
+    結果の各ブロックについて、tensor_x の行の範囲と tensor_y の列の範囲を、ブロックの大きさを超えない範囲ずつ読んで積を足し込む。
+    @param path_x テンソル a -> b のディレクトリのパス
+    @param path_y テンソル b -> c のディレクトリのパス
+    @param path_result 結果のテンソル a -> c を書き出すディレクトリのパス
+    @param progress 書き終えたブロックの数と全体の数を受け取る関数
+    @return meta 結果のテンソルの情報
+    """
+    meta_x = load_meta(path_x)
+    meta_y = load_meta(path_y)
+    if meta_x["profile"][markov_tensor.CODOMAIN_PROFILE] != meta_y["profile"][markov_tensor.DOMAIN_PROFILE]:
+        raise ValueError("cannot compose")
+    meta_result = create_blocked(path_result, [
+        meta_x["profile"][markov_tensor.DOMAIN_PROFILE],
+        meta_y["profile"][markov_tensor.CODOMAIN_PROFILE]
+    ], meta_x["block_size"], derive_fingerprint("composition", meta_x.get("fingerprint"), meta_y.get("fingerprint")))
+    rows, columns = get_block_shape(meta_result)
+    rows_x, columns_x = get_block_shape(meta_x)
+    rows_y, columns_y = get_block_shape(meta_y)
+    # 読む範囲が tensor_x と tensor_y のブロックの大きさを超えないよう、結果のブロックの行を tensor_x の行ブロックの高さ、
+    # 列を tensor_y の列ブロックの幅、中間の次元を両者のブロックの短い方ずつに区切る
+    step = min(rows_y, columns_x)
+    size_middle = meta_y["shape"][0]
+
+    def compute_block(block_row, block_column):
+        height, width = block_shape(meta_result, block_row, block_column)
+        top = block_row * rows
+        left = block_column * columns
+        block = np.zeros((height, width))
+        for row_start in range(0, height, rows_x):
+            row_stop = min(height, row_start + rows_x)
+            # tensor_x のブロックが中間の区切りより広い場合に、同じブロックを読み直さない (保持するのは 1 ブロックのみ)
+            opened = {}
+            for middle in range(0, size_middle, step):
+                if middle % columns_x == 0:
+                    opened = {}
+                stop = min(size_middle, middle + step)
+                region_x = read_region(path_x, meta_x, top + row_start, top + row_stop, middle, stop, opened)
+                for column_start in range(0, width, columns_y):
+                    column_stop = min(width, column_start + columns_y)
+                    block[row_start:row_stop, column_start:column_stop] += region_x @ read_region(
+                        path_y, meta_y, middle, stop, left + column_start, left + column_stop)
+        return block
+
+    return run_blocks(path_result, meta_result, compute_block, progress)
+
+
+def split_codomain(meta, concat_start_index):
+    # 余域 a#b の a と b の格子点の数
+    codomain_profile = meta["profile"][markov_tensor.CODOMAIN_PROFILE]
+    if meta["profile"][markov_tensor.DOMAIN_PROFILE] != []:
+        raise ValueError("tensor must be [] -> a#b")
+    return (
+        int(np.prod(markov_tensor_numpy.profile_sizes(codomain_profile[0:concat_start_index - 1]))),
+        int(np.prod(markov_tensor_numpy.profile_sizes(codomain_profile[concat_start_index - 1:]))))
+
+
+def source_chunks(meta, start, stop):
+    # 1 行のテンソルの列 start から stop の手前までを、ブロックの境界で区切った (開始, 終了) の列
+    width = get_block_shape(meta)[1]
+    column = start
+    while column < stop:
+        end = min(stop, (column // width + 1) * width)
+        yield column, end
+        column = end
+
+
+def first_marginalization(path, concat_start_index, path_result, progress=None):
+    """
+    第一周辺化をブロック単位で算出
+    入力のブロックを 1 個ずつ読み、列の番号を a の格子点に写して足し込む。
+    @param path テンソル [] -> a#b のディレクトリのパス
+    @param concat_start_index 余域の a と b の区切りとして、b の開始に関する index
+    @param path_result 結果のテンソル [] -> a を書き出すディレクトリのパス
+    @param progress 書き終えたブロックの数と全体の数を受け取る関数
+    @return meta 結果のテンソルの情報
+    """
+    meta = load_meta(path)
+    _, size_b = split_codomain(meta, concat_start_index)
+    codomain_profile = meta["profile"][markov_tensor.CODOMAIN_PROFILE]
+    meta_result = create_blocked(path_result, [[], codomain_profile[0:concat_start_index - 1]], meta["block_size"],
+                                 derive_fingerprint("first_marginalization", meta.get("fingerprint"), concat_start_index))
+    columns = get_block_shape(meta_result)[1]
+
+    def compute_block(block_row, block_column):
+        block = np.zeros(block_shape(meta_result, block_row, block_column))
+        first = block_column * columns
+        for start, stop in source_chunks(meta, first * size_b, (first + block.shape[1]) * size_b):
+            segment = read_segment(path, meta, 0, start, stop)
+            block[0] += np.bincount(np.arange(start, stop) // size_b - first, weights=segment, minlength=block.shape[1])
+        return block
+
+    return run_blocks(path_result, meta_result, compute_block, progress)
+
+
+def second_marginalization(path, concat_start_index, path_result, progress=None):
+    """
+    第二周辺化をブロック単位で算出
+    入力のブロックを 1 個ずつ読み、列の番号を b の格子点に写して、結果のブロックの範囲のみを足し込む。
+    @param path テンソル [] -> a#b のディレクトリのパス
+    @param concat_start_index 余域の a と b の区切りとして、b の開始に関する index
+    @param path_result 結果のテンソル [] -> b を書き出すディレクトリのパス
+    @param progress 書き終えたブロックの数と全体の数を受け取る関数
+    @return meta 結果のテンソルの情報
+    """
+    meta = load_meta(path)
+    size_a, size_b = split_codomain(meta, concat_start_index)
+    codomain_profile = meta["profile"][markov_tensor.CODOMAIN_PROFILE]
+    meta_result = create_blocked(path_result, [[], codomain_profile[concat_start_index - 1:]], meta["block_size"],
+                                 derive_fingerprint("second_marginalization", meta.get("fingerprint"), concat_start_index))
+    columns = get_block_shape(meta_result)[1]
+
+    def compute_block(block_row, block_column):
+        block = np.zeros(block_shape(meta_result, block_row, block_column))
+        first = block_column * columns
+        last = first + block.shape[1]
+        if size_b >= get_block_shape(meta)[1]:
+            # b が入力のブロックより長ければ、a の格子点ごとに結果のブロックの範囲のみを読む
+            for index_a in range(size_a):
+                block[0] += read_segment(path, meta, 0, index_a * size_b + first, index_a * size_b + last)
+            return block
+        for start, stop in source_chunks(meta, 0, size_a * size_b):
+            positions = np.arange(start, stop) % size_b
+            selected = (positions >= first) & (positions < last)
+            if selected.any():
+                block[0] += np.bincount(positions[selected] - first, weights=read_segment(path, meta, 0, start, stop)[selected],
+                                        minlength=block.shape[1])
+        return block
+
+    return run_blocks(path_result, meta_result, compute_block, progress)
+
+
+def conditionalization(path, concat_start_index, path_result, progress=None):
+    """
+    条件化をブロック単位で算出
+    先に第一周辺化を path_result の隣のディレクトリ (path_result + "_marginal") に書き出し、
+    結果の各ブロックでは対応する行の同時分布の重みを周辺の重みで割る。
+    @param path テンソル [] -> a#b のディレクトリのパス
+    @param concat_start_index 余域の a と b の区切りとして、b の開始に関する index
+    @param path_result 結果のテンソル a -> b を書き出すディレクトリのパス
+    @param progress 書き終えたブロックの数と全体の数を受け取る関数
+    @return meta 結果のテンソルの情報
+    """
+    meta = load_meta(path)
+    _, size_b = split_codomain(meta, concat_start_index)
+    codomain_profile = meta["profile"][markov_tensor.CODOMAIN_PROFILE]
+    path_marginal = path_result.rstrip(os.sep) + "_marginal"
+    meta_marginal = first_marginalization(path, concat_start_index, path_marginal)
+    meta_result = create_blocked(path_result, [
+        codomain_profile[0:concat_start_index - 1],
+        codomain_profile[concat_start_index - 1:]
+    ], meta["block_size"], derive_fingerprint("conditionalization", meta.get("fingerprint"), concat_start_index))
+    rows, columns = get_block_shape(meta_result)
+
+    def compute_block(block_row, block_column):
+        block = np.zeros(block_shape(meta_result, block_row, block_column))
+        first_a = block_row * rows
+        first_b = block_column * columns
+        marginal = read_segment(path_marginal, meta_marginal, 0, first_a, first_a + block.shape[0])
+        # 行ごとの範囲が同じブロックにまたがるので、読んだブロックを保持して np.load を 1 回にする
+        opened = {}
+        for offset in range(block.shape[0]):
+            if marginal[offset] > 0:
+                start = (first_a + offset) * size_b + first_b
+                block[offset] = read_segment(path, meta, 0, start, start + block.shape[1], opened) / marginal[offset]
+        return block
+
+    return run_blocks(path_result, meta_result, compute_block, progress)
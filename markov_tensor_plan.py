@@ -0,0 +1,302 @@
+"""
+固定した計算手順のコンパイルと、重みを替えた繰り返し実行
+
+同じプロファイルで重みだけが異なる計算を何度も行う場合に、式を一度だけ解析して計画 (plan) を作る。
+  plan = compile_plan("conversion(first_marginalization(p, 2), h)", {"p": tensor_p["profile"], "h": tensor_h["profile"]})
+  matrix = run_plan(plan, {"p": matrix_p, "h": matrix_h})
+  tensor = run_plan_tensors(plan, {"p": tensor_p, "h": tensor_h})
+
+計画には次のものを前もって求めて保持する。
+- 各ステップの結果のプロファイルと、結果を書き込む配列 (実行ごとに確保しない)
+- unit_tensor、delta、exclamation、swap のように重みによらないテンソルの行列
+- composition の連鎖の行列の積の順序 (行列の大きさから動的計画法で決める)
+- 入力と結果のストランドのキーと行列の位置の対応
+
+重みは markov_tensor_numpy と同じ順序の float64 の行列 (|a| x |b|) として与える。
+run_plan が返す行列は計画の配列そのものなので、次の実行で上書きされる。
+"""
+import ast
+import numpy as np
+import markov_tensor
+import markov_tensor_numpy
+
+# 式の中で使える演算
+OPERATIONS = [
+    "composition", "identity", "jointification", "conditionalization", "tensor_product",
+    "first_marginalization", "second_marginalization", "conversion",
+    "unit_tensor", "delta", "exclamation", "swap"
+]
+# 重みによらないテンソルを作る演算
+CONSTANT_OPERATIONS = ["unit_tensor", "delta", "exclamation", "swap"]
+
+
+def compile_plan(expression, profiles):
+    """
+    式を計画にコンパイル
+    @param expression markov_tensor の演算とテンソルの名前による式
+    @param profiles テンソルの名前をキー、プロファイルを値とする辞書
+    @return plan 計画
+    """
+    plan = {}
+    plan["expression"] = expression
+    plan["inputs"] = {}
+    plan["steps"] = []
+    for name in profiles.keys():
+        profile = profiles[name]
+        plan["inputs"][name] = {
+            "profile": profile,
+            "shape": matrix_shape(profile),
+            "keys": strand_keys(profile)
+        }
+
+    node = compile_node(plan, ast.parse(expression, mode="eval").body)
+    plan["output"] = node
+    plan["output"]["keys"] = strand_keys(node["profile"])
+    return plan
+
+
+def matrix_shape(profile):
+    # テンソルの行列の形
+    return (
+        int(np.prod(markov_tensor_numpy.profile_sizes(profile[markov_tensor.DOMAIN_PROFILE]))),
+        int(np.prod(markov_tensor_numpy.profile_sizes(profile[markov_tensor.CODOMAIN_PROFILE]))))
+
+
+def strand_keys(profile):
+    # 行列の要素の順 (行優先) のストランドのキー
+    return [
+        str([domain_lattice_point, codomain_lattice_point])
+        for domain_lattice_point in markov_tensor_numpy.lattice_points(profile[markov_tensor.DOMAIN_PROFILE])
+        for codomain_lattice_point in markov_tensor_numpy.lattice_points(profile[markov_tensor.CODOMAIN_PROFILE])]
+
+
+def input_node(name, profile):
+    return {"kind": "input", "name": name, "profile": profile}
+
+
+def buffer_node(profile):
+    return {"kind": "buffer", "profile": profile, "buffer": np.zeros(matrix_shape(profile))}
+
+
+def constant_node(tensor):
+    return {"kind": "constant", "profile": tensor["profile"], "buffer": markov_tensor_numpy.to_matrix(tensor)}
+
+
+def compile_node(plan, syntax):
+    """
+    構文木の節をコンパイルし、結果の節 (プロファイルと配列の在処) を返す
+    @param plan 計画
+    @param syntax 構文木の節
+    """
+    if isinstance(syntax, ast.Name):
+        if syntax.id not in plan["inputs"]:
+            raise ValueError("unknown tensor {0}".format(syntax.id))
+        return input_node(syntax.id, plan["inputs"][syntax.id]["profile"])
+
+    if not isinstance(syntax, ast.Call) or not isinstance(syntax.func, ast.Name) or syntax.func.id not in OPERATIONS:
+        raise ValueError("unsupported expression {0}".format(ast.dump(syntax)))
+    operation = syntax.func.id
+
+    if operation in CONSTANT_OPERATIONS:
+        arguments = [ast.literal_eval(argument) for argument in syntax.args]
+        return constant_node(getattr(markov_tensor, operation)(*arguments))
+    if operation == "identity":
+        return compile_node(plan, syntax.args[0])
+    if operation == "composition":
+        return compile_chain(plan, [compile_node(plan, argument) for argument in flatten_composition(syntax)])
+
+    node_x = compile_node(plan, syntax.args[0])
+    if operation in ["first_marginalization", "second_marginalization", "conditionalization"]:
+        return compile_split(plan, operation, node_x, ast.literal_eval(syntax.args[1]))
+    node_y = compile_node(plan, syntax.args[1])
+    if operation == "tensor_product":
+        return compile_tensor_product(plan, node_x, node_y)
+    if operation == "jointification":
+        return compile_jointification(plan, node_x, node_y)
+    return compile_conversion(plan, node_x, node_y)
+
+
+def flatten_composition(syntax):
+    # composition(composition(x, y), z) を [x, y, z] に展開
+    operands = []
+    for argument in syntax.args:
+        if isinstance(argument, ast.Call) and isinstance(argument.func, ast.Name) and argument.func.id == "composition":
+            operands.extend(flatten_composition(argument))
+        else:
+            operands.append(argument)
+    return operands
+
+
+def chain_order(shapes):
+    """
+    行列の連鎖の積のスカラー乗算の回数が最小となる括弧付けを動的計画法で決定
+    @param shapes 行列の形のリスト
+    @return split split[i][j] は i 番目から j 番目までの積を分ける位置
+    """
+    count = len(shapes)
+    dimensions = [shapes[0][0]] + [shape[1] for shape in shapes]
+    cost = [[0] * count for _ in range(count)]
+    split = [[0] * count for _ in range(count)]
+    for length in range(2, count + 1):
+        for start in range(count - length + 1):
+            end = start + length - 1
+            cost[start][end] = None
+            for middle in range(start, end):
+                candidate = cost[start][middle] + cost[middle + 1][end] + \
+                    dimensions[start] * dimensions[middle + 1] * dimensions[end + 1]
+                if cost[start][end] is None or candidate < cost[start][end]:
+                    cost[start][end] = candidate
+                    split[start][end] = middle
+    return split
+
+
+def compile_chain(plan, nodes):
+    """
+    composition の連鎖をコンパイル
+    @param plan 計画
+    @param nodes 連鎖の節のリスト
+    """
+    for node_x, node_y in zip(nodes, nodes[1:]):
+        if node_x["profile"][markov_tensor.CODOMAIN_PROFILE] != node_y["profile"][markov_tensor.DOMAIN_PROFILE]:
+            raise ValueError("cannot compose")
+    split = chain_order([matrix_shape(node["profile"]) for node in nodes])
+
+    def emit(start, end):
+        if start == end:
+            return nodes[start]
+        node_x = emit(start, split[start][end])
+        node_y = emit(split[start][end] + 1, end)
+        node_result = buffer_node([
+            node_x["profile"][markov_tensor.DOMAIN_PROFILE],
+            node_y["profile"][markov_tensor.CODOMAIN_PROFILE]
+        ])
+        out = node_result["buffer"]
+        plan["steps"].append((lambda x, y, out=out: np.matmul(x, y, out=out), [node_x, node_y]))
+        return node_result
+
+    return emit(0, len(nodes) - 1)
+
+
+def compile_tensor_product(plan, node_x, node_y):
+    # 行列のクロネッカー積 (a#c) x (b#d) を、4 次元に見た結果の配列に書き込む
+    node_result = buffer_node([
+        node_x["profile"][markov_tensor.DOMAIN_PROFILE] + node_y["profile"][markov_tensor.DOMAIN_PROFILE],
+        node_x["profile"][markov_tensor.CODOMAIN_PROFILE] + node_y["profile"][markov_tensor.CODOMAIN_PROFILE]
+    ])
+    rows_x, columns_x = matrix_shape(node_x["profile"])
+    rows_y, columns_y = matrix_shape(node_y["profile"])
+    out = node_result["buffer"].reshape(rows_x, rows_y, columns_x, columns_y)
+    plan["steps"].append((
+        lambda x, y, out=out: np.multiply(x[:, None, :, None], y[None, :, None, :], out=out),
+        [node_x, node_y]))
+    return node_result
+
+
+def compile_jointification(plan, node_x, node_y):
+    # [] -> a と a -> b から、同時分布 [] -> a#b を |a| x |b| に見た配列に書き込む
+    if node_x["profile"][markov_tensor.CODOMAIN_PROFILE] != node_y["profile"][markov_tensor.DOMAIN_PROFILE]:
+        raise ValueError("cannot jointify")
+    node_result = buffer_node([[], node_y["profile"][markov_tensor.DOMAIN_PROFILE] + node_y["profile"][markov_tensor.CODOMAIN_PROFILE]])
+    out = node_result["buffer"].reshape(matrix_shape(node_y["profile"]))
+    plan["steps"].append((lambda x, y, out=out: np.multiply(x.reshape(-1, 1), y, out=out), [node_x, node_y]))
+    return node_result
+
+
+def compile_split(plan, operation, node_x, concat_start_index):
+    # [] -> a#b を |a| x |b| に見て、行の和 (第一周辺化)、列の和 (第二周辺化)、行の和による割り算 (条件化) を算出
+    codomain_profile = node_x["profile"][markov_tensor.CODOMAIN_PROFILE]
+    if node_x["profile"][markov_tensor.DOMAIN_PROFILE] != []:
+        raise ValueError("cannot compute {0}".format(operation))
+    profile_a = codomain_profile[0:concat_start_index - 1]
+    profile_b = codomain_profile[concat_start_index - 1:]
+    shape = (matrix_shape([[], profile_a])[1], matrix_shape([[], profile_b])[1])
+
+    if operation == "first_marginalization":
+        node_result = buffer_node([[], profile_a])
+        out = node_result["buffer"].reshape(shape[0])
+        step = lambda x, out=out: np.sum(x.reshape(shape), axis=1, out=out)
+    elif operation == "second_marginalization":
+        node_result = buffer_node([[], profile_b])
+        out = node_result["buffer"].reshape(shape[1])
+        step = lambda x, out=out: np.sum(x.reshape(shape), axis=0, out=out)
+    else:
+        node_result = buffer_node([profile_a, profile_b])
+        out = node_result["buffer"]
+        total = np.zeros((shape[0], 1))
+
+        def step(x, out=out, total=total):
+            np.sum(x.reshape(shape), axis=1, keepdims=True, out=total)
+            out.fill(0)
+            np.divide(x.reshape(shape), total, out=out, where=total > 0)
+
+    plan["steps"].append((step, [node_x]))
+    return node_result
+
+
+def compile_conversion(plan, node_x, node_y):
+    # [] -> a と a -> b の同時分布 |a| x |b| を転置し、b の周辺の重みで割る
+    if node_x["profile"][markov_tensor.CODOMAIN_PROFILE] != node_y["profile"][markov_tensor.DOMAIN_PROFILE]:
+        raise ValueError("cannot convert")
+    node_result = buffer_node([node_y["profile"][markov_tensor.CODOMAIN_PROFILE], node_y["profile"][markov_tensor.DOMAIN_PROFILE]])
+    out = node_result["buffer"]
+    joint = np.zeros(matrix_shape(node_y["profile"]))
+    total = np.zeros((joint.shape[1], 1))
+
+    def step(x, y, out=out, joint=joint, total=total):
+        np.multiply(x.reshape(-1, 1), y, out=joint)
+        np.sum(joint, axis=0, out=total.reshape(-1))
+        out.fill(0)
+        np.divide(joint.T, total, out=out, where=total > 0)
+
+    plan["steps"].append((step, [node_x, node_y]))
+    return node_result
+
+
+def run_plan(plan, weights):
+    """
+    計画を実行
+    @param plan 計画
+    @param weights テンソルの名前をキー、重みの行列を値とする辞書
+    @return matrix 結果の行列 (次の実行で上書きされる)
+    """
+    for name in plan["inputs"].keys():
+        if np.shape(weights[name]) != plan["inputs"][name]["shape"]:
+            raise ValueError("weights of {0} must have shape {1}".format(name, plan["inputs"][name]["shape"]))
+
+    def value(node):
+        return weights[node["name"]] if node["kind"] == "input" else node["buffer"]
+
+    for step, nodes in plan["steps"]:
+        step(*[value(node) for node in nodes])
+    return value(plan["output"])
+
+
+def pack_weights(plan, name, tensor):
+    """
+    テンソルの重みを、計画の入力の行列に変換 (キーの順序は計画に保持したものを使う)
+    @param plan 計画
+    @param name テンソルの名前
+    @param tensor テンソル
+    """
+    tensor = markov_tensor.materialize(tensor)
+    mode = markov_tensor.get_mode(tensor)
+    strands = tensor["strands"]
+    specification = plan["inputs"][name]
+    return np.fromiter(
+        (markov_tensor.to_probability(strands.get(key, 0), mode) for key in specification["keys"]),
+        dtype=np.float64, count=len(specification["keys"])).reshape(specification["shape"])
+
+
+def run_plan_tensors(plan, tensors):
+    """
+    テンソルを入力として計画を実行し、結果をテンソルとして返す
+    @param plan 計画
+    @param tensors テンソルの名前をキー、テンソルを値とする辞書
+    @return tensor_result テンソル (モード float64)
+    """
+    matrix = run_plan(plan, {name: pack_weights(plan, name, tensors[name]) for name in plan["inputs"].keys()})
+    tensor_result = {}
+    tensor_result["profile"] = plan["output"]["profile"]
+    tensor_result["strands"] = dict(zip(plan["output"]["keys"], matrix.ravel().tolist()))
+    tensor_result["mode"] = markov_tensor.MODE_FLOAT64
+    return tensor_result
@@ -0,0 +1,204 @@
+"""
+テンソル計算のバッチ実行
+
+python -m markov_tensor として、JSON ファイルからテンソルを読み込み、式またはジョブの一覧を評価する。
+  python -m markov_tensor -t p=tensor_p.json -t h=tensor_h.json \
+      -e "conversion(first_marginalization(p, 2), h)" -o result.jsonl
+  python -m markov_tensor -t tensor_p.json -j jobs.jsonl -w 4 -f table -o result.txt
+
+ジョブの一覧は 1 行に 1 個の {"name": ジョブ名, "expression": 式} をもつ JSON Lines ファイルとする。
+式では markov_tensor の演算と、読み込んだテンソルの名前 (省略時はファイル名から拡張子を除いたもの) を使える。
+結果は終わったジョブから順に出力ファイル (省略時は標準出力) に書き、ジョブごとの所要時間を標準エラー出力に表示する。
+
+終了コード
+- 0: すべてのジョブが成功
+- 1: 失敗したジョブがある
+- 2: 引数やテンソル、ジョブの一覧の読み込みの誤り
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+import markov_tensor
+
+EXIT_SUCCESS = 0
+EXIT_JOB_FAILED = 1
+EXIT_USAGE = 2
+
+FORMAT_JSONL = "jsonl"
+FORMAT_TEXT = "text"
+FORMAT_TABLE = "table"
+
+# 式の中で使える演算
+OPERATIONS = [
+    "composition", "identity", "partial_composition", "jointification", "conditionalization",
+    "tensor_product", "first_marginalization", "second_marginalization", "conversion",
+    "unit_tensor", "delta", "exclamation", "swap", "convert_mode", "materialize",
+    "get_column", "slice_tensor"
+]
+
+
+def parse_arguments(argv):
+    """
+    コマンドライン引数を解析
+    @param argv 引数のリスト
+    """
+    parser = argparse.ArgumentParser(prog="python -m markov_tensor", description="evaluate Markov tensor expressions in batch")
+    parser.add_argument("-t", "--tensor", action="append", default=[], metavar="[NAME=]PATH",
+                        help="load a tensor from a JSON file (NAME defaults to the file name without extension)")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("-e", "--expression", help="expression to evaluate")
+    group.add_argument("-j", "--jobs", help="JSON Lines file of {\"name\": ..., \"expression\": ...}")
+    parser.add_argument("-o", "--output", help="output file (default: standard output)")
+    parser.add_argument("-f", "--format", choices=[FORMAT_JSONL, FORMAT_TEXT, FORMAT_TABLE], default=FORMAT_JSONL,
+                        help="output format")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of worker processes")
+    return parser.parse_args(argv)
+
+
+def load_tensors(specifications):
+    """
+    [NAME=]PATH の指定のリストからテンソルを読み込む
+    @param specifications 指定のリスト
+    @return 名前をキー、テンソルを値とする辞書
+    """
+    tensors = {}
+    for specification in specifications:
+        if "=" in specification:
+            name, path = specification.split("=", 1)
+        else:
+            path = specification
+            name = os.path.splitext(os.path.basename(path))[0]
+        tensors[name] = markov_tensor.load_tensor(path)
+    return tensors
+
+
+def load_jobs(path):
+    """
+    ジョブの一覧を読み込む
+    @param path JSON Lines ファイルのパス
+    @return ジョブのリスト
+    """
+    jobs = []
+    with open(path, encoding="utf-8") as file:
+        for number, line in enumerate(file):
+            if line.strip():
+                job = json.loads(line)
+                job.setdefault("name", "job{0}".format(number + 1))
+                jobs.append(job)
+    return jobs
+
+
+def evaluate(expression, tensors):
+    """
+    式を評価
+    @param expression 式
+    @param tensors 名前をキー、テンソルを値とする辞書
+    """
+    namespace = {name: getattr(markov_tensor, name) for name in OPERATIONS}
+    namespace.update(tensors)
+    return eval(expression, {"__builtins__": {}}, namespace)
+
+
+def run_job(job, tensors):
+    """
+    ジョブを実行し、結果と所要時間の記録を返す
+    @param job ジョブ
+    @param tensors 名前をキー、テンソルを値とする辞書
+    """
+    markov_tensor.DEBUG = False
+    record = {"name": job["name"], "expression": job["expression"]}
+    start = time.perf_counter()
+    try:
+        record["result"] = markov_tensor.tensor_to_json(evaluate(job["expression"], tensors))
+        record["status"] = "ok"
+    except Exception as error:
+        record["status"] = "failed"
+        record["error"] = "{0}: {1}".format(type(error).__name__, error)
+    record["seconds"] = time.perf_counter() - start
+    return record
+
+
+def format_record(record, output_format):
+    """
+    結果の記録を出力形式の文字列にする
+    @param record 結果の記録
+    @param output_format 出力形式
+    """
+    if output_format == FORMAT_JSONL:
+        return json.dumps(record, ensure_ascii=False) + "\n"
+    lines = ["--- {0} ({1}, {2:.6f}s)".format(record["name"], record["status"], record["seconds"])]
+    if record["status"] != "ok":
+        lines.append(record["error"])
+    else:
+        tensor = markov_tensor.tensor_from_json(record["result"])
+        if output_format == FORMAT_TABLE:
+            lines.append(markov_tensor.format_tensor(tensor))
+        else:
+            lines.append("profile: {0}".format(tensor["profile"]))
+            lines.extend("{0} {1}".format(strand, weight) for strand, weight in tensor["strands"].items())
+    return "\n".join(lines) + "\n"
+
+
+def run_jobs(jobs, tensors, workers, write):
+    """
+    ジョブを実行し、終わったものから結果を書き出す
+    @param jobs ジョブのリスト
+    @param tensors 名前をキー、テンソルを値とする辞書
+    @param workers ワーカープロセス数 (1 以下なら同じプロセスで順に実行)
+    @param write 結果の記録を受け取る関数
+    @return 失敗したジョブの数
+    """
+    failed = 0
+    if workers <= 1:
+        records = (run_job(job, tensors) for job in jobs)
+        for record in records:
+            failed += record["status"] != "ok"
+            write(record)
+        return failed
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_job, job, tensors) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            record = future.result()
+            failed += record["status"] != "ok"
+            write(record)
+    return failed
+
+
+def main(argv):
+    """
+    バッチ実行
+    @param argv コマンドライン引数のリスト
+    @return 終了コード
+    """
+    markov_tensor.DEBUG = False
+    arguments = parse_arguments(argv)
+    try:
+        tensors = load_tensors(arguments.tensor)
+        if arguments.jobs is not None:
+            jobs = load_jobs(arguments.jobs)
+        else:
+            jobs = [{"name": "expression", "expression": arguments.expression}]
+    except (OSError, ValueError, KeyError) as error:
+        print("cannot load input: {0}".format(error), file=sys.stderr)
+        return EXIT_USAGE
+
+    output = open(arguments.output, "w", encoding="utf-8") if arguments.output else sys.stdout
+
+    def write(record):
+        output.write(format_record(record, arguments.format))
+        output.flush()
+        print("{0} {1} {2:.6f}s".format(record["name"], record["status"], record["seconds"]), file=sys.stderr)
+
+    start = time.perf_counter()
+    try:
+        failed = run_jobs(jobs, tensors, arguments.workers, write)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print("{0} jobs, {1} failed, {2:.6f}s".format(len(jobs), failed, time.perf_counter() - start), file=sys.stderr)
+
+    return EXIT_JOB_FAILED if failed > 0 else EXIT_SUCCESS
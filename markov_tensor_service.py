@@ -0,0 +1,440 @@
+"""
+テンソル計算のローカル HTTP/JSON サービス
+
+名前を付けたカーネル (テンソル) をメモリに常駐させ、結合、周辺化、反転、時間発展の要求を受け付ける。
+  python markov_tensor_service.py -k d=tensor_d.json -k h=tensor_h.json -p 8765 -w 4
+
+エンドポイント (要求と応答の本体は JSON、テンソルは tensor_to_json の形式)
+- GET    /kernels                 登録されたカーネルの名前とプロファイル
+- PUT    /kernels/{name}          本体のテンソルをカーネルとして登録
+- DELETE /kernels/{name}          カーネルを削除
+- POST   /compute/{operation}     {"kernel": 名前, "tensor": テンソル, "concat_start_index": ..., "time": ...}
+- GET    /metrics                 演算ごとの要求数、失敗数、バッチの大きさ、待ち時間の分位点
+
+演算
+- composition: テンソル x -> a とカーネル a -> b の結合 x -> b
+- first_marginalization, second_marginalization: テンソル (省略時はカーネル) [] -> a#b の周辺化
+- conversion: 分布 [] -> a とカーネル a -> b の反転 b -> a
+- evolve: テンソル x -> a にカーネル a -> a を time 回結合 (markov_tensor_spectral)
+
+同じ演算、カーネル、入力のプロファイル、引数の要求は、最初の要求から BATCH_WINDOW 秒の間 (または MAX_BATCH_SIZE 個まで)
+まとめ、markov_tensor_sweep のバッチ・テンソルとして一度に計算してからそれぞれに結果を返す。
+バッチはワーカーのスレッド・プールで実行する (NumPy の計算中は GIL を解放する)。
+バッチ・テンソルの重みは float64 なので、カーネルまたは入力が厳密 (rational モードや Fraction の重み) な要求は
+まとめたうえで辞書による実装 (markov_tensor) で 1 個ずつ計算し、結果も厳密なまま返す。
+
+外部から接続できないよう、ループバック・アドレス以外には bind しない。
+"""
+import argparse
+import collections
+import concurrent.futures
+import http.server
+import ipaddress
+import json
+import socket
+import sys
+import threading
+import time
+import numpy as np
+import markov_tensor
+import markov_tensor_cost
+import markov_tensor_runner
+import markov_tensor_spectral
+import markov_tensor_sweep
+
+HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 4
+# 要求をまとめる時間 (秒) とバッチの大きさの上限
+BATCH_WINDOW = 0.005
+MAX_BATCH_SIZE = 256
+# 要求ごとの結果を待つ時間の上限 (秒)
+REQUEST_TIMEOUT = 60
+# 待ち時間の統計に使う直近の要求の数
+LATENCY_SAMPLES = 1000
+
+OPERATIONS = ["composition", "first_marginalization", "second_marginalization", "conversion", "evolve"]
+# カーネルを省略できる演算 (テンソルを周辺化する)
+KERNEL_OPTIONAL_OPERATIONS = ["first_marginalization", "second_marginalization"]
+
+
+def create_service(workers=DEFAULT_WORKERS, batch_window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE):
+    """
+    サービスの状態を作成
+    @param workers バッチを実行するスレッドの数
+    @param batch_window 要求をまとめる時間 (秒)
+    @param max_batch_size バッチの大きさの上限
+    @return service サービスの状態
+    """
+    service = {}
+    service["kernels"] = {}
+    service["pending"] = {}
+    service["lock"] = threading.Lock()
+    service["executor"] = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    service["batch_window"] = batch_window
+    service["max_batch_size"] = max_batch_size
+    service["metrics"] = {operation: create_metrics() for operation in OPERATIONS}
+    return service
+
+
+def close_service(service):
+    """
+    ワーカーを停止する (待っている要求のバッチは実行してから停止する)
+    @param service サービスの状態
+    """
+    with service["lock"]:
+        keys = list(service["pending"].keys())
+    for key in keys:
+        flush(service, key)
+    service["executor"].shutdown(wait=True)
+
+
+def register_kernel(service, name, tensor):
+    """
+    カーネルを登録 (行列に変換したバッチ・テンソルを保持し、要求ごとに変換しない)
+    @param service サービスの状態
+    @param name カーネルの名前
+    @param tensor テンソル
+    """
+    tensor = markov_tensor.materialize(tensor)
+    kernel = {"tensor": tensor, "batch": markov_tensor_sweep.to_batch(tensor)}
+    with service["lock"]:
+        service["kernels"][name] = kernel
+    return kernel
+
+
+def remove_kernel(service, name):
+    """
+    カーネルを削除
+    @param service サービスの状態
+    @param name カーネルの名前
+    """
+    with service["lock"]:
+        if name not in service["kernels"]:
+            raise KeyError("unknown kernel {0}".format(name))
+        del service["kernels"][name]
+
+
+def get_kernel(service, name):
+    with service["lock"]:
+        if name not in service["kernels"]:
+            raise KeyError("unknown kernel {0}".format(name))
+        return service["kernels"][name]
+
+
+def create_metrics():
+    return {
+        "requests": 0,
+        "errors": 0,
+        "batches": 0,
+        "latencies": collections.deque(maxlen=LATENCY_SAMPLES)
+    }
+
+
+def get_metrics(service):
+    """
+    演算ごとの統計を取得
+    @param service サービスの状態
+    @return 演算名をキー、requests, errors, batches, mean_batch_size, latency (秒の mean, p50, p95, p99, max) を値とする辞書
+    """
+    result = {}
+    with service["lock"]:
+        for operation, metrics in service["metrics"].items():
+            latencies = np.array(metrics["latencies"])
+            result[operation] = {
+                "requests": metrics["requests"],
+                "errors": metrics["errors"],
+                "batches": metrics["batches"],
+                "mean_batch_size": metrics["requests"] / metrics["batches"] if metrics["batches"] > 0 else 0.0,
+                "latency": {
+                    "mean": float(latencies.mean()) if len(latencies) > 0 else 0.0,
+                    "p50": float(np.percentile(latencies, 50)) if len(latencies) > 0 else 0.0,
+                    "p95": float(np.percentile(latencies, 95)) if len(latencies) > 0 else 0.0,
+                    "p99": float(np.percentile(latencies, 99)) if len(latencies) > 0 else 0.0,
+                    "max": float(latencies.max()) if len(latencies) > 0 else 0.0
+                }
+            }
+    return result
+
+
+def submit(service, operation, request):
+    """
+    要求を受け付け、同じ演算、カーネル、プロファイル、引数の待っている要求とまとめる
+    @param service サービスの状態
+    @param operation 演算名
+    @param request 要求の辞書 {"kernel": 名前, "tensor": tensor_to_json の形式, "concat_start_index": ..., "time": ...}
+    @return future 結果のテンソルを返す concurrent.futures.Future
+    """
+    if operation not in OPERATIONS:
+        raise ValueError("unknown operation {0}".format(operation))
+    if "kernel" in request or operation not in KERNEL_OPTIONAL_OPERATIONS:
+        get_kernel(service, request.get("kernel"))
+    tensor = None
+    if "tensor" in request:
+        tensor = markov_tensor.tensor_from_json(request["tensor"])
+    elif "kernel" not in request or operation not in KERNEL_OPTIONAL_OPERATIONS:
+        raise ValueError("{0} requires a tensor".format(operation))
+    arguments = (request.get("concat_start_index"), request.get("time"))
+    key = (operation, request.get("kernel"), repr(tensor["profile"]) if tensor is not None else None, arguments)
+
+    item = {"tensor": tensor, "future": concurrent.futures.Future(), "start": time.perf_counter()}
+    with service["lock"]:
+        items = service["pending"].get(key)
+        if items is None:
+            items = service["pending"][key] = []
+            timer = threading.Timer(service["batch_window"], flush, (service, key))
+            timer.daemon = True
+            timer.start()
+        items.append(item)
+        full = len(items) >= service["max_batch_size"]
+    if full:
+        flush(service, key)
+    return item["future"]
+
+
+def flush(service, key):
+    # 待っている要求をバッチとしてワーカーに渡す (既に渡していれば何もしない)
+    with service["lock"]:
+        items = service["pending"].pop(key, None)
+    if items:
+        service["executor"].submit(run_batch, service, key, items)
+
+
+def run_batch(service, key, items):
+    """
+    まとめた要求を一度に計算し、それぞれの Future に結果を設定する
+    @param service サービスの状態
+    @param key (演算名, カーネルの名前, 入力のプロファイル, 引数)
+    @param items 要求のリスト
+    """
+    operation, name, _, arguments = key
+    try:
+        kernel = get_kernel(service, name) if name is not None else None
+        results = compute_batch(operation, kernel, [item["tensor"] for item in items], *arguments)
+        failure = None
+    except Exception as error:
+        results = None
+        failure = error
+    end = time.perf_counter()
+
+    with service["lock"]:
+        metrics = service["metrics"][operation]
+        metrics["requests"] += len(items)
+        metrics["errors"] += len(items) if failure is not None else 0
+        metrics["batches"] += 1
+        metrics["latencies"].extend(end - item["start"] for item in items)
+    for number, item in enumerate(items):
+        if results is None:
+            item["future"].set_exception(failure)
+        else:
+            item["future"].set_result(results[number])
+
+
+def compute_batch(operation, kernel, tensors, concat_start_index=None, time=None):
+    """
+    同じプロファイルの入力テンソルのリストについて演算を一度に計算
+    @param operation 演算名
+    @param kernel 登録されたカーネル (カーネルを使わない周辺化では None)
+    @param tensors 入力テンソルのリスト (カーネルを周辺化する場合は None のリスト)
+    @param concat_start_index 周辺化の区切りの index
+    @param time 時間発展のステップ数
+    @return 結果のテンソルのリスト
+    """
+    if (kernel is not None and markov_tensor_cost.is_exact(kernel["tensor"])) or any(
+            tensor is not None and markov_tensor_cost.is_exact(tensor) for tensor in tensors):
+        return compute_exact(operation, kernel, tensors, concat_start_index, time)
+    if operation in KERNEL_OPTIONAL_OPERATIONS and tensors[0] is None:
+        # カーネル自体の周辺化はすべての要求で同じ結果になる
+        marginalize = getattr(markov_tensor_sweep, operation)
+        result = markov_tensor_sweep.get_tensor(marginalize(kernel["batch"], concat_start_index), 0)
+        return [result] * len(tensors)
+
+    batch = markov_tensor_sweep.stack(tensors)
+    if operation == "composition":
+        result = markov_tensor_sweep.composition(batch, kernel["batch"])
+    elif operation == "conversion":
+        result = markov_tensor_sweep.conversion(batch, kernel["batch"])
+    elif operation in KERNEL_OPTIONAL_OPERATIONS:
+        result = getattr(markov_tensor_sweep, operation)(batch, concat_start_index)
+    else:
+        if time is None:
+            raise ValueError("evolve requires time")
+        if batch["profile"][markov_tensor.CODOMAIN_PROFILE] != kernel["tensor"]["profile"][markov_tensor.DOMAIN_PROFILE]:
+            raise ValueError("cannot compose")
+        weights = batch["weights"]
+        # すべての要求の行を 1 個の行列に並べて時間発展する
+        rows = markov_tensor_spectral.evolve_matrix(weights.reshape(-1, weights.shape[2]), kernel["tensor"], time)
+        result = markov_tensor_sweep.create_batch(rows.reshape(weights.shape), batch["profile"])
+    return [markov_tensor_sweep.get_tensor(result, number) for number in range(len(tensors))]
+
+
+def exact_power(kernel, time):
+    # 繰り返し二乗法によるカーネルの time 回の結合 (辞書による実装のため重みは厳密なまま)
+    if time is None:
+        raise ValueError("evolve requires time")
+    if time < 0 or int(time) != time:
+        raise ValueError("time must be a non-negative integer for exact kernels")
+    time = int(time)
+    result = None
+    power = kernel
+    while time > 0:
+        if time % 2 == 1:
+            result = power if result is None else markov_tensor.composition(result, power)
+        time //= 2
+        if time > 0:
+            power = markov_tensor.composition(power, power)
+    return result
+
+
+def compute_exact(operation, kernel, tensors, concat_start_index=None, time=None):
+    """
+    厳密なカーネルまたは入力の要求を、辞書による実装で 1 個ずつ計算 (重みを float64 に変換しない)
+    引数と戻り値は compute_batch と同じ。
+    """
+    if operation in KERNEL_OPTIONAL_OPERATIONS:
+        marginalize = getattr(markov_tensor, operation)
+        if tensors[0] is None:
+            return [marginalize(kernel["tensor"], concat_start_index)] * len(tensors)
+        return [marginalize(tensor, concat_start_index) for tensor in tensors]
+    if operation == "conversion":
+        return [markov_tensor.conversion(tensor, kernel["tensor"]) for tensor in tensors]
+    if operation == "evolve":
+        if tensors[0]["profile"][markov_tensor.CODOMAIN_PROFILE] != kernel["tensor"]["profile"][markov_tensor.DOMAIN_PROFILE]:
+            raise ValueError("cannot compose")
+        power = exact_power(kernel["tensor"], time)
+        if power is None:
+            return list(tensors)
+        return [markov_tensor.composition(tensor, power) for tensor in tensors]
+    if tensors[0]["profile"][markov_tensor.CODOMAIN_PROFILE] != kernel["tensor"]["profile"][markov_tensor.DOMAIN_PROFILE]:
+        raise ValueError("cannot compose")
+    return [markov_tensor.composition(tensor, kernel["tensor"]) for tensor in tensors]
+
+
+def check_local(host):
+    """
+    ホストがループバック・アドレスであることを確認
+    @param host ホスト名またはアドレス
+    """
+    address = ipaddress.ip_address(socket.gethostbyname(host))
+    if not address.is_loopback:
+        raise ValueError("{0} is not a loopback address; the service runs on localhost only".format(host))
+
+
+def create_server(service, host=HOST, port=DEFAULT_PORT):
+    """
+    HTTP サーバーを作成 (要求ごとにスレッドで処理する)
+    @param service サービスの状態
+    @param host ループバック・アドレスのホスト
+    @param port ポート番号 (0 なら空いているポート)
+    @return server http.server.ThreadingHTTPServer
+    """
+    check_local(host)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.handle_request("GET")
+
+        def do_PUT(self):
+            self.handle_request("PUT")
+
+        def do_POST(self):
+            self.handle_request("POST")
+
+        def do_DELETE(self):
+            self.handle_request("DELETE")
+
+        def handle_request(self, method):
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length)) if length > 0 else {}
+                status, response = route(service, method, self.path.rstrip("/").split("/")[1:], body)
+            except KeyError as error:
+                status, response = 404, {"error": str(error.args[0]) if error.args else "not found"}
+            except (ValueError, TypeError) as error:
+                status, response = 400, {"error": "{0}: {1}".format(type(error).__name__, error)}
+            except Exception as error:
+                status, response = 500, {"error": "{0}: {1}".format(type(error).__name__, error)}
+            data = json.dumps(response, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            if markov_tensor.DEBUG:
+                super().log_message(format, *args)
+
+    return http.server.ThreadingHTTPServer((host, port), Handler)
+
+
+def route(service, method, path, body):
+    """
+    要求を処理
+    @param service サービスの状態
+    @param method HTTP のメソッド
+    @param path URL のパスを / で分けたリスト
+    @param body 要求の本体
+    @return (ステータス・コード, 応答の本体)
+    """
+    if method == "GET" and path == ["kernels"]:
+        with service["lock"]:
+            return 200, {"kernels": {name: kernel["tensor"]["profile"] for name, kernel in service["kernels"].items()}}
+    if path[:1] == ["kernels"] and len(path) == 2:
+        if method == "PUT":
+            kernel = register_kernel(service, path[1], markov_tensor.tensor_from_json(body))
+            return 201, {"name": path[1], "profile": kernel["tensor"]["profile"]}
+        if method == "DELETE":
+            remove_kernel(service, path[1])
+            return 200, {"name": path[1]}
+    if method == "POST" and path[:1] == ["compute"] and len(path) == 2:
+        future = submit(service, path[1], body)
+        return 200, {"result": markov_tensor.tensor_to_json(future.result(timeout=REQUEST_TIMEOUT))}
+    if method == "GET" and path == ["metrics"]:
+        return 200, get_metrics(service)
+    raise KeyError("no route for {0} /{1}".format(method, "/".join(path)))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(prog="markov_tensor_service", description="serve Markov tensor computations on localhost")
+    parser.add_argument("-k", "--kernel", action="append", default=[], metavar="[NAME=]PATH",
+                        help="load a kernel from a JSON file (NAME defaults to the file name without extension)")
+    parser.add_argument("-H", "--host", default=HOST, help="loopback host to bind")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT, help="port")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS, help="number of worker threads")
+    parser.add_argument("-b", "--batch-window", type=float, default=BATCH_WINDOW, help="seconds to coalesce requests")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """
+    サービスを起動
+    @param argv コマンドライン引数のリスト
+    @return 終了コード
+    """
+    markov_tensor.DEBUG = False
+    arguments = parse_arguments(argv)
+    try:
+        check_local(arguments.host)
+        kernels = markov_tensor_runner.load_tensors(arguments.kernel)
+    except (OSError, ValueError, KeyError) as error:
+        print("cannot start: {0}".format(error), file=sys.stderr)
+        return markov_tensor_runner.EXIT_USAGE
+
+    service = create_service(arguments.workers, arguments.batch_window)
+    for name, tensor in kernels.items():
+        register_kernel(service, name, tensor)
+    server = create_server(service, arguments.host, arguments.port)
+    print("serving on http://{0}:{1}".format(*server.server_address[:2]), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        close_service(service)
+    return markov_tensor_runner.EXIT_SUCCESS
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,258 @@
+"""
+共有メモリに置いたテンソルの複数のプロセスからの利用
+
+テンソル a -> b の重みが 0 でないストランドを CSR 形式の配列 (indptr, indices, data) とし、
+multiprocessing.shared_memory の 1 個のセグメントに置く。ワーカーには名前とプロファイルのみの小さな辞書
+(ハンドル) を渡し、ワーカーは名前でセグメントに接続して、配列を複製せずに読み取り専用で使う。
+  shared = create_shared(tensor_d)
+  with concurrent.futures.ProcessPoolExecutor(4) as executor:
+      executor.map(work, [get_handle(shared)] * 4, ...)
+  release(shared)
+
+  def work(handle, ...):
+      with attached(handle) as kernel:
+          return composition(tensor_x, kernel)
+
+寿命の管理
+- create_shared で作ったプロセス (所有者) が release を呼ぶまでセグメントは残る。sharing を使うと with を抜けるときに release する。
+- 接続したプロセスは detach (または attached の with を抜ける) で接続を閉じる。
+- 配列はセグメントのバッファを参照として保持する。to_csr の疎行列など、配列を参照するオブジェクトが残っている間は
+  detach と release は BufferError を送出し、セグメントを閉じない (参照を消してから呼び直す)。
+- 接続したプロセスが終了してもセグメントは削除しない (所有者のみが削除する)。
+
+重みは markov_tensor_numpy と同じく確率の float64 (float32 モードなら float32) とし、行と列の順序も同じ。
+"""
+import contextlib
+import inspect
+import secrets
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import numpy as np
+import scipy.sparse
+import markov_tensor
+import markov_tensor_numpy
+
+# セグメントの名前の接頭辞
+NAME_PREFIX = "markov_tensor_"
+# 資源の追跡への登録を一時的に止める間の排他
+TRACKER_LOCK = threading.Lock()
+
+
+def segment_layout(shape, strands, index_dtype, dtype):
+    # セグメント内の indptr, indices, data の (開始位置, 要素数, 型) と全体のバイト数
+    layout = []
+    offset = 0
+    for count, item_dtype in ((shape[0] + 1, index_dtype), (strands, index_dtype), (strands, dtype)):
+        item_dtype = np.dtype(item_dtype)
+        offset = (offset + item_dtype.itemsize - 1) // item_dtype.itemsize * item_dtype.itemsize
+        layout.append((offset, count, item_dtype))
+        offset += count * item_dtype.itemsize
+    return layout, max(offset, 1)
+
+
+def map_arrays(shared, segment):
+    # セグメントのバッファ上に indptr, indices, data の配列を作る (読み取り専用)
+    # np.frombuffer はバッファをエクスポートとして保持するので、配列が残っている間は segment.close() が BufferError になる
+    layout, _ = segment_layout(shared["shape"], shared["strands"], shared["index_dtype"], shared["dtype"])
+    for key, (offset, count, item_dtype) in zip(("indptr", "indices", "data"), layout):
+        array = np.frombuffer(segment.buf, dtype=item_dtype, count=count, offset=offset)
+        array.flags.writeable = False
+        shared[key] = array
+    shared["segment"] = segment
+    return shared
+
+
+def create_shared(tensor, name=None):
+    """
+    テンソルを共有メモリのセグメントに置く
+    @param tensor テンソル a -> b
+    @param name セグメントの名前 (省略時は NAME_PREFIX に乱数を付けた名前)
+    @return shared 共有テンソル (所有者として release を呼ぶこと)
+    """
+    tensor = markov_tensor.materialize(tensor)
+    mode = markov_tensor.get_mode(tensor)
+    dtype = markov_tensor_numpy.get_dtype(mode)
+    rows, columns, data, shape = markov_tensor_numpy.to_coo_arrays(tensor, dtype)
+    # SciPy が複製せずに使えるよう、収まる場合は番号を int32 とする
+    index_dtype = np.int32 if max(shape[0], shape[1], len(data)) < 2 ** 31 else np.int64
+    order = np.lexsort((columns, rows))
+
+    shared = {}
+    shared["profile"] = tensor["profile"]
+    shared["mode"] = mode if mode in (markov_tensor.MODE_FLOAT64, markov_tensor.MODE_FLOAT32) else markov_tensor.MODE_FLOAT64
+    shared["shape"] = shape
+    shared["strands"] = len(data)
+    shared["index_dtype"] = np.dtype(index_dtype).str
+    shared["dtype"] = np.dtype(dtype).str
+    _, size = segment_layout(shape, len(data), index_dtype, dtype)
+    segment = shared_memory.SharedMemory(name=name or NAME_PREFIX + secrets.token_hex(8), create=True, size=size)
+    shared["name"] = segment.name
+    shared["owner"] = True
+
+    layout, _ = segment_layout(shape, len(data), index_dtype, dtype)
+    indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+    for (offset, count, item_dtype), values in zip(layout, (indptr, columns[order], data[order])):
+        np.frombuffer(segment.buf, dtype=item_dtype, count=count, offset=offset)[:] = values
+    return map_arrays(shared, segment)
+
+
+def get_handle(shared):
+    """
+    ワーカーに渡すハンドル (セグメントの名前と形のみの、pickle できる小さな辞書) を取得
+    @param shared 共有テンソル
+    """
+    return {key: shared[key] for key in ("name", "profile", "mode", "shape", "strands", "index_dtype", "dtype")}
+
+
+def open_segment(name):
+    # 既存のセグメントに接続 (接続したプロセスの終了時にセグメントが削除されないよう、資源の追跡に登録しない)
+    if "track" in inspect.signature(shared_memory.SharedMemory).parameters:
+        return shared_memory.SharedMemory(name=name, track=False)
+    with TRACKER_LOCK:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def attach(handle):
+    """
+    ハンドルの名前のセグメントに接続 (配列は複製しない)
+    @param handle get_handle で取得したハンドル
+    @return shared 共有テンソル (読み取り専用、使い終えたら detach を呼ぶこと)
+    """
+    shared = dict(handle)
+    shared["owner"] = False
+    return map_arrays(shared, open_segment(handle["name"]))
+
+
+def detach(shared):
+    """
+    セグメントへの接続を閉じる
+    配列を参照するオブジェクト (to_csr の疎行列など) が残っている場合は BufferError を送出し、接続を保つ。
+    @param shared 共有テンソル
+    """
+    # 以前に閉じられなかったマッピングを閉じ直す
+    stale = []
+    for segment in shared.get("stale", []):
+        try:
+            segment.close()
+        except BufferError:
+            stale.append(segment)
+    shared["stale"] = stale
+    segment = shared.get("segment")
+    if segment is None:
+        if stale:
+            raise BufferError("{0} is still referenced by arrays or matrices created from it".format(shared["name"]))
+        return
+    for key in ("indptr", "indices", "data"):
+        shared[key] = None
+    shared["segment"] = None
+    try:
+        segment.close()
+    except BufferError:
+        # 閉じられなかったマッピングは参照が消えるまで残るので、名前で接続し直して共有テンソルを使える状態に戻す
+        shared["stale"].append(segment)
+        map_arrays(shared, open_segment(shared["name"]))
+        raise BufferError("{0} is still referenced by arrays or matrices created from it".format(shared["name"]))
+
+
+def release(shared):
+    """
+    所有者が接続を閉じ、セグメントを削除する
+    接続している他のプロセスは、それぞれが閉じるまで配列を使える。
+    所有者のプロセスに配列を参照するオブジェクトが残っている場合は BufferError を送出し、削除しない。
+    @param shared create_shared で作った共有テンソル
+    """
+    if not shared["owner"]:
+        raise ValueError("only the owner can release {0}".format(shared["name"]))
+    segment = shared.get("segment")
+    detach(shared)
+    if segment is not None:
+        segment.unlink()
+
+
+@contextlib.contextmanager
+def sharing(tensor, name=None):
+    """
+    with を抜けるときに release する create_shared
+    @param tensor テンソル a -> b
+    @param name セグメントの名前
+    """
+    shared = create_shared(tensor, name)
+    try:
+        yield shared
+    finally:
+        release(shared)
+
+
+@contextlib.contextmanager
+def attached(handle):
+    """
+    with を抜けるときに detach する attach
+    @param handle get_handle で取得したハンドル
+    """
+    shared = attach(handle)
+    try:
+        yield shared
+    finally:
+        detach(shared)
+
+
+def to_csr(shared):
+    """
+    共有テンソルを、セグメントの配列をそのまま使う SciPy の CSR 形式の疎行列にする
+    @param shared 共有テンソル
+    """
+    if shared.get("segment") is None:
+        raise ValueError("{0} is detached".format(shared["name"]))
+    return scipy.sparse.csr_matrix(
+        (shared["data"], shared["indices"], shared["indptr"]), shape=tuple(shared["shape"]), copy=False)
+
+
+def to_tensor(shared):
+    """
+    共有テンソルを辞書のテンソルに複製する
+    @param shared 共有テンソル
+    @return tensor_result テンソル a -> b (重み 0 のストランドを除く)
+    """
+    matrix = to_csr(shared).tocoo()
+    return markov_tensor_numpy.from_coo_arrays(matrix.row, matrix.col, matrix.data, shared["profile"], shared["mode"])
+
+
+def get_column(shared, domain_point):
+    """
+    域の格子点を与えたときの余域上の分布を、その行のみを読んで作成
+    @param shared 共有テンソル a -> b
+    @param domain_point 域の格子点
+    @return tensor_result テンソル [] -> b
+    """
+    domain_profile = shared["profile"][markov_tensor.DOMAIN_PROFILE]
+    row = markov_tensor_numpy.lattice_point_index(domain_profile, domain_point)
+    start, stop = shared["indptr"][row], shared["indptr"][row + 1]
+    return markov_tensor_numpy.from_coo_arrays(
+        np.zeros(stop - start, dtype=np.int64), shared["indices"][start:stop], shared["data"][start:stop],
+        [[], shared["profile"][markov_tensor.CODOMAIN_PROFILE]], shared["mode"])
+
+
+def composition(tensor_x, shared):
+    """
+    テンソルと共有テンソルの結合を疎行列の積として算出 (共有テンソルの配列は複製しない)
+    @param tensor_x テンソル x -> a
+    @param shared 共有テンソル a -> b
+    @return tensor_result テンソル x -> b (重み 0 のストランドを除く)
+    """
+    tensor_x = markov_tensor.materialize(tensor_x)
+    if tensor_x["profile"][markov_tensor.CODOMAIN_PROFILE] != shared["profile"][markov_tensor.DOMAIN_PROFILE]:
+        raise ValueError("cannot compose")
+    rows, columns, data, shape = markov_tensor_numpy.to_coo_arrays(tensor_x)
+    matrix_x = scipy.sparse.csr_matrix((data, (rows, columns)), shape=shape)
+    matrix = (matrix_x @ to_csr(shared)).tocoo()
+    return markov_tensor_numpy.from_coo_arrays(matrix.row, matrix.col, matrix.data, [
+        tensor_x["profile"][markov_tensor.DOMAIN_PROFILE],
+        shared["profile"][markov_tensor.CODOMAIN_PROFILE]
+    ], shared["mode"])
@@ -0,0 +1,70 @@
+"""
+SciPy の疎行列によるマルコフ・テンソルの計算
+
+重みが 0 でないストランドのみを CSR 形式の行列 (行が域、列が余域の格子点) として保持する。
+markov_tensor の疎なバックエンド "sparse" として OPERATIONS の演算を提供する。
+"""
+import scipy.sparse
+import markov_tensor
+import markov_tensor_numpy
+
+
+def to_csr(tensor, dtype=None):
+    """
+    テンソルを CSR 形式の疎行列に変換
+    @param tensor テンソル a -> b
+    @param dtype 要素の型 (省略時は数値モードに対応する型)
+    @return matrix |a| x |b| の疎行列
+    """
+    if dtype is None:
+        dtype = markov_tensor_numpy.get_dtype(markov_tensor.get_mode(tensor))
+    rows, columns, data, shape = markov_tensor_numpy.to_coo_arrays(tensor, dtype)
+    return scipy.sparse.csr_matrix((data, (rows, columns)), shape=shape)
+
+
+def from_csr(matrix, profile, mode=markov_tensor.MODE_FLOAT64):
+    """
+    疎行列からテンソルを作成 (0 でない要素のみをストランドとする)
+    @param matrix |a| x |b| の疎行列
+    @param profile プロファイル [a, b]
+    @param mode 数値モード
+    @return tensor_result テンソル a -> b
+    """
+    matrix = matrix.tocoo()
+    return markov_tensor_numpy.from_coo_arrays(matrix.row, matrix.col, matrix.data, profile, mode)
+
+
+def composition(tensor_x, tensor_y, mode):
+    """
+    結合を疎行列の積として算出
+    @param tensor_x テンソル a -> b
+    @param tensor_y テンソル b -> c
+    @param mode 数値モード
+    @return tensor_result テンソル a -> c
+    """
+    profile = [
+        tensor_x["profile"][markov_tensor.DOMAIN_PROFILE],
+        tensor_y["profile"][markov_tensor.CODOMAIN_PROFILE]
+    ]
+    return from_csr(to_csr(tensor_x) @ to_csr(tensor_y), profile, mode)
+
+
+def tensor_product(tensor_x, tensor_y, mode):
+    """
+    テンソル積を疎行列のクロネッカー積として算出
+    @param tensor_x テンソル a -> b
+    @param tensor_y テンソル c -> d
+    @param mode 数値モード
+    @return tensor_result テンソル a#c -> b#d
+    """
+    profile = [
+        tensor_x["profile"][markov_tensor.DOMAIN_PROFILE] + tensor_y["profile"][markov_tensor.DOMAIN_PROFILE],
+        tensor_x["profile"][markov_tensor.CODOMAIN_PROFILE] + tensor_y["profile"][markov_tensor.CODOMAIN_PROFILE]
+    ]
+    return from_csr(scipy.sparse.kron(to_csr(tensor_x), to_csr(tensor_y), format="csr"), profile, mode)
+
+
+OPERATIONS = {
+    "composition": composition,
+    "tensor_product": tensor_product
+}
@@ -0,0 +1,144 @@
+"""
+固有値分解による任意の時刻の分布の算出
+
+テンソル a -> a の行列 P を P = V diag(w) V^-1 と一度だけ固有値分解する。
+分布 [] -> a の行ベクトル x に対し、時刻 t の分布 x P^t を ((x V) w^t) V^-1 として
+基底の変換と対角成分のべき乗のみで求める。t は整数でなくてもよい (連続時間の補間)。
+  spectral = prepare_spectral(tensor_d)
+  evolve(tensor_m, spectral, 10 ** 6)
+
+prepare_spectral が返す分解はカーネルの代わりに evolve, kernel_power, evolve_matrix に渡せる。
+カーネルを渡した場合は、テンソルの辞書を変更せず、ストランドの辞書ごとに SPECTRA に保持した分解を使う
+(ストランドの辞書が置き換えられるか数が変われば分解し直す。重みをその場で変更した場合は prepare_spectral を呼び直す)。
+
+固有ベクトルの行列 V の条件数が CONDITION_LIMIT を超える (対角化できない、またはそれに近い) 場合は、
+固有値分解を使わずに P^t を繰り返し二乗法で求める。この場合 t は 0 以上の整数に限る。
+"""
+from collections import OrderedDict
+import numpy as np
+import markov_tensor
+import markov_tensor_numpy
+
+CONDITION_LIMIT = 1e8
+# 固有値分解した結果の虚部を捨てるときに許す大きさ
+IMAGINARY_TOLERANCE = 1e-9
+
+
+# prepare_spectral で作成した固有値分解 (ストランドの辞書の id をキーとし、最近使った順に SPECTRAL_CACHE_SIZE 個まで保持)
+SPECTRA = OrderedDict()
+SPECTRAL_CACHE_SIZE = 16
+
+
+def decompose(kernel):
+    """
+    テンソル a -> a の行列を固有値分解
+    @param kernel テンソル a -> a
+    @return spectral 固有値、固有ベクトルの行列とその逆行列、条件数をもつ辞書
+    """
+    if kernel["profile"][markov_tensor.DOMAIN_PROFILE] != kernel["profile"][markov_tensor.CODOMAIN_PROFILE]:
+        raise ValueError("kernel must be a -> a")
+    matrix = markov_tensor_numpy.to_matrix(kernel)
+    eigenvalues, eigenvectors = np.linalg.eig(matrix)
+    condition = np.linalg.cond(eigenvectors)
+
+    spectral = {}
+    spectral["profile"] = kernel["profile"]
+    # 分解が残っている間に id が再利用されないよう、ストランドの辞書への参照を保持する
+    spectral["strands"] = kernel["strands"]
+    spectral["size"] = len(kernel["strands"])
+    spectral["matrix"] = matrix
+    spectral["eigenvalues"] = eigenvalues
+    spectral["eigenvectors"] = eigenvectors
+    spectral["condition"] = condition
+    spectral["stable"] = bool(np.isfinite(condition) and condition <= CONDITION_LIMIT)
+    spectral["inverse"] = np.linalg.inv(eigenvectors) if spectral["stable"] else None
+    return spectral
+
+
+def prepare_spectral(kernel):
+    """
+    テンソル a -> a を固有値分解して SPECTRA に保持
+    @param kernel テンソル a -> a
+    @return spectral 分解 (カーネルの代わりに evolve などに渡せる)
+    """
+    kernel = markov_tensor.materialize(kernel)
+    spectral = decompose(kernel)
+    SPECTRA[id(kernel["strands"])] = spectral
+    SPECTRA.move_to_end(id(kernel["strands"]))
+    while len(SPECTRA) > SPECTRAL_CACHE_SIZE:
+        SPECTRA.popitem(last=False)
+    return spectral
+
+
+def is_spectral(kernel):
+    # prepare_spectral が返した分解か
+    return "eigenvalues" in kernel
+
+
+def get_spectral(kernel):
+    """
+    カーネルの固有値分解を取得 (ストランドの辞書が置き換えられるか数が変わっていれば分解し直す)
+    @param kernel テンソル a -> a、または prepare_spectral が返した分解
+    """
+    if is_spectral(kernel):
+        return kernel
+    strands = kernel.get("strands")
+    spectral = SPECTRA.get(id(strands))
+    if spectral is None or spectral["strands"] is not strands or spectral["size"] != len(strands):
+        return prepare_spectral(kernel)
+    SPECTRA.move_to_end(id(strands))
+    return spectral
+
+
+def matrix_power(spectral, time):
+    # 繰り返し二乗法による P^t
+    if time < 0 or int(time) != time:
+        raise ValueError("kernel is ill-conditioned (condition number {0:g}); time must be a non-negative integer".format(
+            spectral["condition"]))
+    return np.linalg.matrix_power(spectral["matrix"], int(time))
+
+
+def evolve_matrix(matrix, kernel, time):
+    """
+    行ベクトル (を並べた行列) を時刻 time まで時間発展
+    @param matrix k x |a| の行列
+    @param kernel テンソル a -> a、または prepare_spectral が返した分解
+    @param time 時刻 (ステップ数)
+    @return k x |a| の行列
+    """
+    spectral = get_spectral(kernel)
+    if not spectral["stable"]:
+        return matrix @ matrix_power(spectral, time)
+
+    powers = np.power(spectral["eigenvalues"].astype(complex), time)
+    result = ((matrix @ spectral["eigenvectors"]) * powers) @ spectral["inverse"]
+    if np.max(np.abs(result.imag), initial=0) > IMAGINARY_TOLERANCE:
+        # 負や複素数の固有値の非整数乗は実数の分布にならない
+        raise ValueError("evolution to time {0} is not real for this kernel".format(time))
+    return result.real
+
+
+def evolve(tensor_distribution, kernel, time):
+    """
+    分布 [] -> a にテンソル a -> a を time 回結合した分布を算出
+    @param tensor_distribution テンソル [] -> a
+    @param kernel テンソル a -> a、または prepare_spectral が返した分解
+    @param time 時刻 (ステップ数。整数でなくてもよい)
+    @return tensor_result テンソル [] -> a (モード float64)
+    """
+    if not markov_tensor.check_composable(tensor_distribution, kernel):
+        raise ValueError("cannot compose")
+    matrix = evolve_matrix(markov_tensor_numpy.to_matrix(tensor_distribution), kernel, time)
+    return markov_tensor_numpy.from_matrix(matrix, tensor_distribution["profile"])
+
+
+def kernel_power(kernel, time):
+    """
+    テンソル a -> a の time 乗を算出
+    @param kernel テンソル a -> a、または prepare_spectral が返した分解
+    @param time 時刻 (ステップ数。整数でなくてもよい)
+    @return tensor_result テンソル a -> a (モード float64)
+    """
+    spectral = get_spectral(kernel)
+    matrix = evolve_matrix(np.identity(spectral["matrix"].shape[0]), spectral, time)
+    return markov_tensor_numpy.from_matrix(matrix, kernel["profile"])
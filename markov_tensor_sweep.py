@@ -0,0 +1,243 @@
+"""
+重みの組を並べたバッチによるパラメータ・スイープ
+
+同じプロファイルで重みの異なる B 個のテンソル a -> b を、次の辞書 (バッチ・テンソル) として扱う。
+  {"profile": [a, b], "weights": 形が (B, |a|, |b|) の float64 の配列}
+行列の行と列の順序は markov_tensor_numpy と同じ。
+
+各演算はバッチの軸をそろえて一度に NumPy で計算し、結果もバッチ・テンソルとして返す。
+バッチの大きさが 1 のテンソル (または通常の辞書のテンソル) は、もう一方のバッチの大きさに合わせて使う。
+  kernels = perturb(tensor_h, 500, scale=0.1, seed=0)
+  posterior = conversion(first_marginalization(tensor_p, 2), kernels)
+  summary = summarize(posterior)
+"""
+import numpy as np
+import markov_tensor
+import markov_tensor_numpy
+
+
+def profile_shape(profile):
+    # テンソルの行列の形
+    return (
+        int(np.prod(markov_tensor_numpy.profile_sizes(profile[markov_tensor.DOMAIN_PROFILE]))),
+        int(np.prod(markov_tensor_numpy.profile_sizes(profile[markov_tensor.CODOMAIN_PROFILE]))))
+
+
+def create_batch(weights, profile):
+    """
+    重みの配列からバッチ・テンソルを作成
+    @param weights 形が (B, |a|, |b|) の配列
+    @param profile プロファイル [a, b]
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.ndim != 3 or weights.shape[1:] != profile_shape(profile):
+        raise ValueError("weights must have shape (B, {0}, {1})".format(*profile_shape(profile)))
+    return {"profile": profile, "weights": weights}
+
+
+def is_batch(tensor):
+    return "weights" in tensor
+
+
+def to_batch(tensor):
+    """
+    テンソルをバッチ・テンソルに変換 (通常のテンソルはバッチの大きさ 1 とする)
+    @param tensor テンソル、またはバッチ・テンソル
+    """
+    if is_batch(tensor):
+        return tensor
+    tensor = markov_tensor.materialize(tensor)
+    return create_batch(markov_tensor_numpy.to_matrix(tensor)[None], tensor["profile"])
+
+
+def stack(tensors):
+    """
+    同じプロファイルのテンソルのリストをバッチ・テンソルにまとめる
+    @param tensors テンソルのリスト
+    """
+    profile = tensors[0]["profile"]
+    if any(tensor["profile"] != profile for tensor in tensors):
+        raise ValueError("profiles differ")
+    return create_batch(np.stack([markov_tensor_numpy.to_matrix(tensor) for tensor in tensors]), profile)
+
+
+def get_tensor(tensor_batch, index):
+    """
+    バッチの index 番目のテンソルを取り出す
+    @param tensor_batch バッチ・テンソル
+    @param index バッチの番号
+    @return tensor_result テンソル (モード float64)
+    """
+    return markov_tensor_numpy.from_matrix(tensor_batch["weights"][index], tensor_batch["profile"])
+
+
+def batch_size(tensor_batch):
+    return tensor_batch["weights"].shape[0]
+
+
+def perturb(tensor, size, scale=0.1, seed=None):
+    """
+    各重みに対数正規分布の乱数を掛けてから域の格子点ごとに正規化し、摂動したテンソルのバッチを作成
+    重み 0 のストランドは 0 のままとする。
+    @param tensor テンソル
+    @param size バッチの大きさ B
+    @param scale 対数での摂動の標準偏差
+    @param seed 乱数の種
+    """
+    tensor = markov_tensor.materialize(tensor)
+    matrix = markov_tensor_numpy.to_matrix(tensor)
+    generator = np.random.default_rng(seed)
+    weights = matrix[None] * np.exp(scale * generator.standard_normal((size,) + matrix.shape))
+    total = weights.sum(axis=2, keepdims=True)
+    np.divide(weights, total, out=weights, where=total > 0)
+    return create_batch(weights, tensor["profile"])
+
+
+def broadcast(tensor_x, tensor_y):
+    # 2 個のテンソルをバッチ・テンソルにし、バッチの大きさをそろえられるか確認
+    tensor_x = to_batch(tensor_x)
+    tensor_y = to_batch(tensor_y)
+    size_x = batch_size(tensor_x)
+    size_y = batch_size(tensor_y)
+    if size_x != size_y and size_x != 1 and size_y != 1:
+        raise ValueError("batch sizes {0} and {1} differ".format(size_x, size_y))
+    return tensor_x, tensor_y
+
+
+def composition(tensor_x, tensor_y):
+    """
+    結合を算出
+    @param tensor_x バッチ・テンソル a -> b
+    @param tensor_y バッチ・テンソル b -> c
+    @return tensor_result バッチ・テンソル a -> c
+    """
+    tensor_x, tensor_y = broadcast(tensor_x, tensor_y)
+    if tensor_x["profile"][markov_tensor.CODOMAIN_PROFILE] != tensor_y["profile"][markov_tensor.DOMAIN_PROFILE]:
+        raise ValueError("cannot compose")
+    return create_batch(np.matmul(tensor_x["weights"], tensor_y["weights"]), [
+        tensor_x["profile"][markov_tensor.DOMAIN_PROFILE],
+        tensor_y["profile"][markov_tensor.CODOMAIN_PROFILE]
+    ])
+
+
+def tensor_product(tensor_x, tensor_y):
+    """
+    テンソル積を算出
+    @param tensor_x バッチ・テンソル a -> b
+    @param tensor_y バッチ・テンソル c -> d
+    @return tensor_result バッチ・テンソル a#c -> b#d
+    """
+    tensor_x, tensor_y = broadcast(tensor_x, tensor_y)
+    weights = np.einsum("...ij,...kl->...ikjl", tensor_x["weights"], tensor_y["weights"])
+    profile = [
+        tensor_x["profile"][markov_tensor.DOMAIN_PROFILE] + tensor_y["profile"][markov_tensor.DOMAIN_PROFILE],
+        tensor_x["profile"][markov_tensor.CODOMAIN_PROFILE] + tensor_y["profile"][markov_tensor.CODOMAIN_PROFILE]
+    ]
+    return create_batch(weights.reshape((weights.shape[0],) + profile_shape(profile)), profile)
+
+
+def jointification(tensor_x, tensor_y):
+    """
+    同時化を算出
+    @param tensor_x バッチ・テンソル [] -> a
+    @param tensor_y バッチ・テンソル a -> b
+    @return tensor_result バッチ・テンソル [] -> a#b
+    """
+    tensor_x, tensor_y = broadcast(tensor_x, tensor_y)
+    if tensor_x["profile"][markov_tensor.CODOMAIN_PROFILE] != tensor_y["profile"][markov_tensor.DOMAIN_PROFILE]:
+        raise ValueError("cannot jointify")
+    weights = tensor_x["weights"][:, 0, :, None] * tensor_y["weights"]
+    return create_batch(weights.reshape(weights.shape[0], 1, -1), [
+        [], tensor_y["profile"][markov_tensor.DOMAIN_PROFILE] + tensor_y["profile"][markov_tensor.CODOMAIN_PROFILE]
+    ])
+
+
+def split_codomain(tensor_batch, concat_start_index):
+    # [] -> a#b の重みを (B, |a|, |b|) に見た配列と、a と b のプロファイル
+    if tensor_batch["profile"][markov_tensor.DOMAIN_PROFILE] != []:
+        raise ValueError("tensor must be [] -> a#b")
+    codomain_profile = tensor_batch["profile"][markov_tensor.CODOMAIN_PROFILE]
+    profile_a = codomain_profile[0:concat_start_index - 1]
+    profile_b = codomain_profile[concat_start_index - 1:]
+    weights = tensor_batch["weights"].reshape(
+        batch_size(tensor_batch), profile_shape([[], profile_a])[1], profile_shape([[], profile_b])[1])
+    return weights, profile_a, profile_b
+
+
+def first_marginalization(tensor, concat_start_index):
+    """
+    第一周辺化を算出
+    @param tensor バッチ・テンソル [] -> a#b
+    @param concat_start_index 余域の a と b の区切りとして、b の開始に関する index
+    @return tensor_result バッチ・テンソル [] -> a
+    """
+    weights, profile_a, _ = split_codomain(to_batch(tensor), concat_start_index)
+    return create_batch(weights.sum(axis=2)[:, None, :], [[], profile_a])
+
+
+def second_marginalization(tensor, concat_start_index):
+    """
+    第二周辺化を算出
+    @param tensor バッチ・テンソル [] -> a#b
+    @param concat_start_index 余域の a と b の区切りとして、b の開始に関する index
+    @return tensor_result バッチ・テンソル [] -> b
+    """
+    weights, _, profile_b = split_codomain(to_batch(tensor), concat_start_index)
+    return create_batch(weights.sum(axis=1)[:, None, :], [[], profile_b])
+
+
+def normalize_rows(weights):
+    # 行ごとに和で割る (和が 0 の行は 0 のまま)
+    total = weights.sum(axis=2, keepdims=True)
+    result = np.zeros_like(weights)
+    np.divide(weights, total, out=result, where=total > 0)
+    return result
+
+
+def conditionalization(tensor, concat_start_index):
+    """
+    条件化を算出
+    @param tensor バッチ・テンソル [] -> a#b
+    @param concat_start_index 余域の a と b の区切りとして、b の開始に関する index
+    @return tensor_result バッチ・テンソル a -> b
+    """
+    weights, profile_a, profile_b = split_codomain(to_batch(tensor), concat_start_index)
+    return create_batch(normalize_rows(weights), [profile_a, profile_b])
+
+
+def conversion(tensor_empty_a, tensor_a_b):
+    """
+    反転を算出
+    @param tensor_empty_a バッチ・テンソル [] -> a
+    @param tensor_a_b バッチ・テンソル a -> b
+    @return tensor_result バッチ・テンソル b -> a
+    """
+    tensor_empty_a, tensor_a_b = broadcast(tensor_empty_a, tensor_a_b)
+    if tensor_empty_a["profile"][markov_tensor.CODOMAIN_PROFILE] != tensor_a_b["profile"][markov_tensor.DOMAIN_PROFILE]:
+        raise ValueError("cannot convert")
+    joint = tensor_empty_a["weights"][:, 0, :, None] * tensor_a_b["weights"]
+    return create_batch(normalize_rows(joint.transpose(0, 2, 1)), [
+        tensor_a_b["profile"][markov_tensor.CODOMAIN_PROFILE],
+        tensor_a_b["profile"][markov_tensor.DOMAIN_PROFILE]
+    ])
+
+
+def summarize(tensor_batch, quantiles=(0.05, 0.5, 0.95)):
+    """
+    ストランドごとにバッチの軸にわたる統計量を算出
+    @param tensor_batch バッチ・テンソル
+    @param quantiles 分位点のリスト
+    @return summary キー "min", "max", "mean", "std" と、分位点をキーとする辞書 "quantiles" に、統計量を重みとするテンソルをもつ辞書
+    """
+    weights = tensor_batch["weights"]
+    profile = tensor_batch["profile"]
+    summary = {
+        "min": markov_tensor_numpy.from_matrix(weights.min(axis=0), profile),
+        "max": markov_tensor_numpy.from_matrix(weights.max(axis=0), profile),
+        "mean": markov_tensor_numpy.from_matrix(weights.mean(axis=0), profile),
+        "std": markov_tensor_numpy.from_matrix(weights.std(axis=0), profile),
+        "quantiles": {}
+    }
+    for quantile, matrix in zip(quantiles, np.quantile(weights, quantiles, axis=0)):
+        summary["quantiles"][quantile] = markov_tensor_numpy.from_matrix(matrix, profile)
+    return summary
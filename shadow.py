@@ -391,33 +391,33 @@ def main():
             tensor_n
         )
 
-    for key in result["strands"].keys():
-        if eval(key)[0] == [['H'], ['S-'], ['C-']]:
-            print(key, result["strands"][key])
+    strands = markov_tensor.select_strands(result, domain_point=[['H'], ['S-'], ['C-']])
+    for key in strands.keys():
+        print(key, strands[key])
     # [[['H'], ['S-'], ['C-']], [['MO+']]] 32/239
     # [[['H'], ['S-'], ['C-']], [['MO-']]] 160/239
     # [[['H'], ['S-'], ['C-']], [['WO+']]] 12/239
     # [[['H'], ['S-'], ['C-']], [['WO-']]] 35/239
 
-    for key in result["strands"].keys():
-        if eval(key)[0] == [['L'], ['S-'], ['C+']]:
-            print(key, result["strands"][key])
+    strands = markov_tensor.select_strands(result, domain_point=[['L'], ['S-'], ['C+']])
+    for key in strands.keys():
+        print(key, strands[key])
     # [[['L'], ['S-'], ['C+']], [['MO+']]] 2/5
     # [[['L'], ['S-'], ['C+']], [['MO-']]] 0
     # [[['L'], ['S-'], ['C+']], [['WO+']]] 3/5
     # [[['L'], ['S-'], ['C+']], [['WO-']]] 0
 
-    for key in result["strands"].keys():
-        if eval(key)[0] == [['H'], ['S-'], ['C+']]:
-            print(key, result["strands"][key])
+    strands = markov_tensor.select_strands(result, domain_point=[['H'], ['S-'], ['C+']])
+    for key in strands.keys():
+        print(key, strands[key])
     # [[['H'], ['S-'], ['C+']], [['MO+']]] 8/11
     # [[['H'], ['S-'], ['C+']], [['MO-']]] 0
     # [[['H'], ['S-'], ['C+']], [['WO+']]] 3/11
     # [[['H'], ['S-'], ['C+']], [['WO-']]] 0
 
-    for key in result["strands"].keys():
-        if eval(key)[0] == [['M'], ['S+'], ['C+']]:
-            print(key, result["strands"][key])
+    strands = markov_tensor.select_strands(result, domain_point=[['M'], ['S+'], ['C+']])
+    for key in strands.keys():
+        print(key, strands[key])
     # [[['M'], ['S+'], ['C+']], [['MO+']]] 0
     # [[['M'], ['S+'], ['C+']], [['MO-']]] 0
     # [[['M'], ['S+'], ['C+']], [['WO+']]] 1
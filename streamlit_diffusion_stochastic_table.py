@@ -6,6 +6,7 @@ import pandas as pd
 import plotly.graph_objects as go
 import random
 import markov_tensor
+import markov_tensor_numpy
 from fractions import Fraction
 
 st.title('拡散確率テーブル')
@@ -106,21 +107,13 @@ def construct_tensor(num):
 
 def main():
     tensor_m, tensor_d = construct_default_data()
-    tensor_result = tensor_m
     fig = go.Figure()
     step = st.sidebar.slider('ステップ数',  min_value=0, max_value=20, step=1, value=0)
     st.write("Step {0}".format(step))
-    for item in range(step):
-        tensor_result = markov_tensor.composition(tensor_result, tensor_d)
-        markov_tensor.print_tensor(tensor_result)
-    val=[
-        [ 
-            tensor_result["strands"][str([[], [index_i + 1, index_j + 1]])] for index_i in range(tensor_result["profile"][1][0]) 
-        ] for index_j in range(tensor_result["profile"][1][1])
-    ]
+    trajectory = markov_tensor_numpy.trajectory(tensor_m, tensor_d, step + 1)
     fig.add_trace(
             go.Heatmap(
-                z=val, 
+                z=trajectory[step].T, 
                 colorscale = "Blues", 
                 colorbar=dict(
                     tick0=0,
@@ -0,0 +1,71 @@
+import os
+import sys
+from fractions import Fraction
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markov_tensor  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def reset_settings():
+    # 各テストの前後で、モジュールの設定を既定値に戻す
+    markov_tensor.DEBUG = False
+    markov_tensor.disable_cache()
+    yield
+    markov_tensor.DEBUG = False
+    markov_tensor.disable_cache()
+    markov_tensor.BACKEND = None
+    markov_tensor.MEMORY_BUDGET = None
+    markov_tensor.MEMORY_BUDGET_ACTION = "raise"
+    markov_tensor.RATIONAL_DENOMINATOR_BITS = None
+
+
+@pytest.fixture
+def tensor_d():
+    return {
+        "profile": [[2], [2]],
+        "strands": {
+            "[[1], [1]]": Fraction(2, 5),
+            "[[1], [2]]": Fraction(3, 5),
+            "[[2], [1]]": Fraction(1, 10),
+            "[[2], [2]]": Fraction(9, 10)
+        }
+    }
+
+
+@pytest.fixture
+def tensor_prior():
+    return {
+        "profile": [[], [2]],
+        "strands": {
+            "[[], [1]]": Fraction(1, 10),
+            "[[], [2]]": Fraction(9, 10)
+        }
+    }
+
+
+@pytest.fixture
+def tensor_joint():
+    return {
+        "profile": [[], [2, 2]],
+        "strands": {
+            "[[], [1, 1]]": Fraction(1, 10),
+            "[[], [1, 2]]": Fraction(2, 10),
+            "[[], [2, 1]]": Fraction(3, 10),
+            "[[], [2, 2]]": Fraction(4, 10)
+        }
+    }
+
+
+def assert_close(tensor_x, tensor_y, tolerance=1e-9):
+    # 2 個のテンソルのストランドの重みが (確率として) 近いことを確認 (片方にない重みは 0 とみなす)
+    assert tensor_x["profile"] == tensor_y["profile"]
+    mode_x = markov_tensor.get_mode(tensor_x)
+    mode_y = markov_tensor.get_mode(tensor_y)
+    for strand in set(tensor_x["strands"]) | set(tensor_y["strands"]):
+        value_x = markov_tensor.to_probability(tensor_x["strands"].get(strand, 0), mode_x) if strand in tensor_x["strands"] else 0
+        value_y = markov_tensor.to_probability(tensor_y["strands"].get(strand, 0), mode_y) if strand in tensor_y["strands"] else 0
+        assert abs(float(value_x) - float(value_y)) <= tolerance, strand
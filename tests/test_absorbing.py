@@ -0,0 +1,57 @@
+from fractions import Fraction
+
+import pytest
+
+import markov_tensor
+import markov_tensor_absorbing
+
+HALF = Fraction(1, 2)
+
+
+@pytest.fixture
+def tensor_ruin():
+    # 両端が吸収状態のランダム・ウォーク
+    return {"profile": [[4], [4]], "strands": {
+        "[[1], [1]]": 1, "[[2], [1]]": HALF, "[[2], [3]]": HALF,
+        "[[3], [2]]": HALF, "[[3], [4]]": HALF, "[[4], [4]]": 1}}
+
+
+def test_classes(tensor_ruin):
+    assert markov_tensor_absorbing.absorbing_classes(tensor_ruin) == {
+        "classes": [[[1]], [[4]]], "transient": [[2], [3]]}
+
+
+def test_exact_solutions(tensor_ruin):
+    probabilities = markov_tensor_absorbing.absorption_probabilities(tensor_ruin)
+    assert probabilities["profile"] == [[4], [["class 1", "class 2"]]]
+    assert probabilities["strands"]["[[2], [['class 1']]]"] == Fraction(2, 3)
+    assert probabilities["strands"]["[[4], [['class 2']]]"] == 1
+    assert markov_tensor.is_markov(probabilities)
+    steps = markov_tensor_absorbing.expected_steps(tensor_ruin)
+    assert steps["strands"]["[[2], []]"] == 2
+    assert steps["strands"]["[[1], []]"] == 0
+    visits = markov_tensor_absorbing.fundamental_matrix(tensor_ruin)
+    assert visits["strands"]["[[2], [2]]"] == Fraction(4, 3)
+    assert visits["strands"]["[[2], [3]]"] == Fraction(2, 3)
+
+
+def test_float_solutions_agree(tensor_ruin):
+    tensor = markov_tensor.convert_mode(tensor_ruin, markov_tensor.MODE_FLOAT64)
+    probabilities = markov_tensor_absorbing.absorption_probabilities(tensor)
+    assert probabilities["mode"] == markov_tensor.MODE_FLOAT64
+    assert probabilities["strands"]["[[3], [['class 1']]]"] == pytest.approx(1 / 3)
+    assert markov_tensor_absorbing.expected_steps(tensor)["strands"]["[[3], []]"] == pytest.approx(2)
+
+
+def test_classes_with_several_states():
+    # 状態 1 と 2 の間を巡る閉じたクラスと、吸収状態 3
+    tensor = {"profile": [[4], [4]], "strands": {
+        "[[1], [2]]": 1, "[[2], [1]]": 1, "[[3], [3]]": 1,
+        "[[4], [1]]": Fraction(1, 4), "[[4], [2]]": Fraction(1, 4), "[[4], [3]]": HALF}}
+    exact = markov_tensor_absorbing.absorption_probabilities(tensor)
+    approximate = markov_tensor_absorbing.absorption_probabilities(
+        markov_tensor.convert_mode(tensor, markov_tensor.MODE_FLOAT64))
+    for label in ("class 1", "class 2"):
+        strand = str([[4], [[label]]])
+        assert exact["strands"][strand] == HALF
+        assert approximate["strands"][strand] == pytest.approx(0.5)
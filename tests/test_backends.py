@@ -0,0 +1,77 @@
+import pytest
+
+import markov_tensor
+import markov_tensor_numpy
+
+
+def random_kernel(profile, density, seed):
+    numpy = pytest.importorskip("numpy")
+    generator = numpy.random.default_rng(seed)
+    shape = tuple(int(numpy.prod(markov_tensor_numpy.profile_sizes(side))) for side in profile)
+    matrix = generator.random(shape) * (generator.random(shape) < density)
+    matrix[:, 0] += 0.01
+    matrix /= matrix.sum(axis=1, keepdims=True)
+    return markov_tensor_numpy.from_matrix(matrix, profile)
+
+
+def run(backend, function):
+    markov_tensor.BACKEND = backend
+    try:
+        return function()
+    finally:
+        markov_tensor.BACKEND = None
+
+
+@pytest.mark.parametrize("backend", ["numpy", "sparse", "jit"])
+def test_composition_agrees_with_python(backend):
+    pytest.importorskip(markov_tensor.BACKENDS[backend])
+    kernel_x = random_kernel([[12], [12]], 0.2, 0)
+    kernel_y = random_kernel([[12], [12]], 0.2, 1)
+    expected = run("python", lambda: markov_tensor.composition(kernel_x, kernel_y))
+    result = run(backend, lambda: markov_tensor.composition(kernel_x, kernel_y))
+    assert set(result["strands"]) == set(expected["strands"])
+    for strand, weight in expected["strands"].items():
+        assert result["strands"][strand] == pytest.approx(weight)
+
+
+@pytest.mark.parametrize("backend", ["numpy", "sparse"])
+def test_tensor_product_agrees_with_python(backend):
+    pytest.importorskip(markov_tensor.BACKENDS[backend])
+    kernel_x = random_kernel([[3], [3]], 0.3, 2)
+    kernel_y = random_kernel([[2], [3]], 0.3, 3)
+    expected = run("python", lambda: markov_tensor.tensor_product(kernel_x, kernel_y))
+    result = run(backend, lambda: markov_tensor.tensor_product(kernel_x, kernel_y))
+    assert set(result["strands"]) == set(expected["strands"])
+
+
+def test_conditionalization_agrees_with_jit():
+    pytest.importorskip("numba")
+    joint = random_kernel([[], [6, 6]], 0.3, 4)
+    expected = run("python", lambda: markov_tensor.conditionalization(joint, 2))
+    result = run("jit", lambda: markov_tensor.conditionalization(joint, 2))
+    assert set(result["strands"]) == set(expected["strands"])
+    for strand, weight in expected["strands"].items():
+        assert result["strands"][strand] == pytest.approx(weight)
+
+
+def test_density_counts_nonzero_weights():
+    pytest.importorskip("scipy")
+    kernel = random_kernel([[20], [20]], 0.02, 5)
+    padded = dict(kernel, strands={strand: 0.0 for strand in markov_tensor_numpy.from_matrix(
+        markov_tensor_numpy.to_matrix(kernel) * 0, kernel["profile"])["strands"]})
+    padded["strands"].update({strand: weight for strand, weight in kernel["strands"].items() if weight != 0})
+    assert markov_tensor.select_backend("composition", padded, padded) == \
+        markov_tensor.select_backend("composition", kernel, kernel)
+
+
+def test_exact_tensors_stay_in_python(tensor_d):
+    assert markov_tensor.select_backend("composition", tensor_d, tensor_d) == "python"
+
+
+def test_missing_numba_falls_back_to_sparse(monkeypatch):
+    pytest.importorskip("scipy")
+    # numba を import できない環境を、存在しないモジュール名で再現する
+    monkeypatch.setitem(markov_tensor.BACKENDS, "jit", "markov_tensor_missing_backend")
+    monkeypatch.setattr(markov_tensor, "LOADED_BACKENDS", {})
+    kernel = {"profile": [[1000], [1000]], "strands": {"[[1], [1]]": 1.0}, "mode": "float64"}
+    assert markov_tensor.select_backend("composition", kernel, kernel) == "sparse"
@@ -0,0 +1,46 @@
+import markov_tensor
+
+
+def test_repeated_subexpression_hits(tensor_prior, tensor_d):
+    markov_tensor.enable_cache()
+    first = markov_tensor.composition(tensor_prior, tensor_d)
+    second = markov_tensor.composition(tensor_prior, tensor_d)
+    assert first == second
+    stats = markov_tensor.cache_stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+
+def test_results_are_copies(tensor_prior, tensor_d):
+    markov_tensor.enable_cache()
+    first = markov_tensor.composition(tensor_prior, tensor_d)
+    first["strands"]["[[], [1]]"] = 0
+    second = markov_tensor.composition(tensor_prior, tensor_d)
+    assert second["strands"]["[[], [1]]"] != 0
+
+
+def test_mutated_input_invalidates(tensor_prior, tensor_d):
+    markov_tensor.enable_cache()
+    before = markov_tensor.composition(tensor_prior, tensor_d)
+    tensor_d["strands"]["[[1], [1]]"], tensor_d["strands"]["[[1], [2]]"] = tensor_d["strands"]["[[1], [2]]"], tensor_d["strands"]["[[1], [1]]"]
+    after = markov_tensor.composition(tensor_prior, tensor_d)
+    assert before != after
+    assert markov_tensor.cache_stats()["hits"] == 0
+
+
+def test_error_bound_is_part_of_the_key(tensor_d):
+    kernel = markov_tensor.convert_mode(tensor_d, markov_tensor.MODE_FLOAT64)
+    bounded = dict(kernel, error_bound=0.5)
+    expected = markov_tensor.composition(bounded, bounded)
+    markov_tensor.enable_cache()
+    markov_tensor.composition(kernel, kernel)
+    assert markov_tensor.composition(bounded, bounded)["error_bound"] == expected["error_bound"]
+
+
+def test_settings_are_part_of_the_key(tensor_d):
+    kernel = markov_tensor.convert_mode(tensor_d, markov_tensor.MODE_RATIONAL)
+    markov_tensor.enable_cache()
+    exact = markov_tensor.composition(kernel, kernel)
+    markov_tensor.RATIONAL_DENOMINATOR_BITS = 4
+    fallback = markov_tensor.composition(kernel, kernel)
+    assert exact.get("mode") != fallback.get("mode")
+    assert markov_tensor.cache_stats()["hits"] == 0
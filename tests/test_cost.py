@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+import markov_tensor
+import markov_tensor_cost
+from conftest import assert_close
+
+
+def test_estimate_composition(tensor_prior, tensor_d):
+    estimate = markov_tensor_cost.estimate_operation("composition", tensor_prior, tensor_d)
+    assert estimate["profile"] == [[], [2]]
+    assert estimate["strands"] == 2
+    estimate = markov_tensor_cost.estimate_expression("conversion(p, d)", {"p": tensor_prior, "d": tensor_d["profile"]})
+    assert estimate["profile"] == [[2], [2]]
+
+
+def test_budget_raises_before_computing(tensor_prior, tensor_d):
+    markov_tensor.MEMORY_BUDGET = 10
+    with pytest.raises(MemoryError):
+        markov_tensor.composition(tensor_prior, tensor_d)
+
+
+def test_cached_result_skips_the_budget(tensor_prior, tensor_d):
+    markov_tensor.enable_cache()
+    expected = markov_tensor.composition(tensor_prior, tensor_d)
+    markov_tensor.MEMORY_BUDGET = 10
+    assert markov_tensor.composition(tensor_prior, tensor_d) == expected
+
+
+def test_out_of_core_route_and_cleanup(tmp_path, tensor_prior, tensor_d):
+    tensor_x = markov_tensor.convert_mode(tensor_prior, markov_tensor.MODE_FLOAT64)
+    tensor_y = markov_tensor.convert_mode(tensor_d, markov_tensor.MODE_FLOAT64)
+    expected = markov_tensor.composition(tensor_x, tensor_y)
+    markov_tensor.MEMORY_BUDGET = 10
+    markov_tensor.MEMORY_BUDGET_ACTION = "out_of_core"
+    with markov_tensor_cost.out_of_core_directory(str(tmp_path)) as directory:
+        result = markov_tensor.composition(tensor_x, tensor_y)
+        assert markov_tensor.is_blocked(result)
+        # 入力を分けたブロックは計算の後に削除する
+        assert os.listdir(result["directory"]) == ["result"]
+        assert_close(markov_tensor.materialize(result), expected)
+        markov_tensor_cost.remove_blocked(result)
+        assert not os.path.exists(result["directory"])
+        markov_tensor.composition(tensor_x, tensor_y)
+    assert not os.path.exists(directory)
+
+
+def test_exact_weights_are_not_downgraded(tmp_path, tensor_prior, tensor_d):
+    markov_tensor.MEMORY_BUDGET = 10
+    markov_tensor.MEMORY_BUDGET_ACTION = "out_of_core"
+    with markov_tensor_cost.out_of_core_directory(str(tmp_path)):
+        with pytest.raises(MemoryError):
+            markov_tensor.composition(tensor_prior, tensor_d)
+        blocked = markov_tensor.composition(markov_tensor.convert_mode(tensor_prior, markov_tensor.MODE_FLOAT64),
+                                            markov_tensor.convert_mode(tensor_d, markov_tensor.MODE_FLOAT64))
+        with pytest.raises(ValueError):
+            markov_tensor.composition(blocked, tensor_d)
@@ -0,0 +1,39 @@
+from fractions import Fraction
+
+import pytest
+
+import markov_tensor
+
+
+def test_dataframe_round_trip(tensor_d):
+    pytest.importorskip("pandas")
+    frame = markov_tensor.to_dataframe(tensor_d)
+    assert list(frame.index.names) == ["domain_0", "codomain_0"]
+    assert frame.loc[(2, 2), "weight"] == Fraction(9, 10)
+    assert markov_tensor.from_dataframe(frame) == tensor_d
+
+
+def test_dataframe_labels_and_mode():
+    pytest.importorskip("pandas")
+    tensor = {"profile": [[], [["H", "T"]]], "strands": {"[[], [['H']]]": 0.25, "[[], [['T']]]": 0.75}, "mode": "float64"}
+    frame = markov_tensor.to_dataframe(tensor)
+    assert str(frame["weight"].dtype) == "float64"
+    assert markov_tensor.from_dataframe(frame) == tensor
+    # attrs がなければ各階層の値からプロファイルを作る
+    frame.attrs = {}
+    assert markov_tensor.from_dataframe(frame)["profile"] == [[], [["H", "T"]]]
+
+
+def test_format_tensor(tensor_d):
+    lines = markov_tensor.format_tensor(tensor_d).split("\n")
+    assert lines[0].split() == ["1", "2"]
+    assert lines[2].split() == ["1", "2/5", "1/10"]
+    assert lines[3].split() == ["2", "3/5", "9/10"]
+
+
+def test_format_tensor_truncates():
+    tensor = markov_tensor.unit_tensor([30])
+    lines = markov_tensor.format_tensor(tensor, max_rows=3, max_columns=2).split("\n")
+    assert lines[0].split() == ["1", "2", "..."]
+    assert lines[-1] == "..."
+    assert len(lines) == 6
@@ -0,0 +1,52 @@
+from fractions import Fraction
+
+import pytest
+
+import markov_tensor
+
+
+def test_map_is_cached_and_scan_is_skipped(tensor_d, monkeypatch):
+    swap = markov_tensor.swap([2], [2])
+    index_map = markov_tensor.get_index_map(swap)
+    assert index_map is not None
+    assert markov_tensor.INDEX_MAPS[id(swap["strands"])]["map"] is index_map
+    # 2 回目以降は走査しない
+    monkeypatch.setattr(markov_tensor, "find_index_map", lambda tensor: pytest.fail("scanned again"))
+    assert markov_tensor.get_index_map(swap) is index_map
+    assert set(swap.keys()) == {"profile", "strands"}
+
+
+def test_non_deterministic_result_is_cached(tensor_d, monkeypatch):
+    assert markov_tensor.get_index_map(tensor_d) is None
+    monkeypatch.setattr(markov_tensor, "find_index_map", lambda tensor: pytest.fail("scanned again"))
+    assert not markov_tensor.is_deterministic(tensor_d)
+
+
+def test_changed_strands_are_detected_again(tensor_d):
+    function = {"profile": [[2], [2]], "strands": {"[[1], [2]]": Fraction(1), "[[2], [1]]": Fraction(1)}}
+    assert markov_tensor.is_deterministic(function)
+    function["strands"]["[[1], [1]]"] = Fraction(1)
+    assert not markov_tensor.is_deterministic(function)
+    function["strands"] = dict(tensor_d["strands"])
+    assert not markov_tensor.is_deterministic(function)
+
+
+def test_as_deterministic(tensor_d):
+    function = {"profile": [[2], [2]], "strands": {"[[1], [2]]": Fraction(1), "[[2], [1]]": Fraction(1)}}
+    assert markov_tensor.as_deterministic(function) is function
+    # 重みをその場で書き換えたら宣言し直す
+    function["strands"]["[[1], [2]]"] = Fraction(1, 2)
+    with pytest.raises(ValueError):
+        markov_tensor.as_deterministic(function)
+    assert not markov_tensor.is_deterministic(function)
+
+
+def test_composition_with_declared_function(tensor_d):
+    function = markov_tensor.as_deterministic(
+        {"profile": [[2], [2]], "strands": {"[[1], [2]]": Fraction(1), "[[2], [1]]": Fraction(1)}})
+    assert markov_tensor.composition(tensor_d, function)["strands"] == {
+        "[[1], [2]]": Fraction(2, 5), "[[1], [1]]": Fraction(3, 5),
+        "[[2], [2]]": Fraction(1, 10), "[[2], [1]]": Fraction(9, 10)}
+    assert markov_tensor.composition(function, tensor_d)["strands"] == {
+        "[[1], [1]]": Fraction(1, 10), "[[1], [2]]": Fraction(9, 10),
+        "[[2], [1]]": Fraction(2, 5), "[[2], [2]]": Fraction(3, 5)}
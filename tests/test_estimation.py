@@ -0,0 +1,47 @@
+import json
+from fractions import Fraction
+
+import pytest
+
+import markov_tensor
+import markov_tensor_estimation
+
+
+def test_estimate_counts_and_smoothing():
+    estimator = markov_tensor_estimation.create_estimator([[2], [2]])
+    observations = [([1], [1]), ([1], [2]), ([1], [2]), ([1], [2])]
+    markov_tensor_estimation.update(estimator, iter(observations), chunk_size=3)
+    assert estimator["observations"] == 4
+    tensor = markov_tensor_estimation.estimate(estimator)
+    assert tensor["strands"]["[[1], [1]]"] == Fraction(1, 4)
+    assert tensor["strands"]["[[1], [2]]"] == Fraction(3, 4)
+    # 観測のない域の格子点は一様分布
+    assert tensor["strands"]["[[2], [1]]"] == Fraction(1, 2)
+    assert markov_tensor.is_markov(tensor)
+    smoothed = markov_tensor_estimation.estimate(estimator, smoothing=1, mode=markov_tensor.MODE_FLOAT64)
+    assert smoothed["strands"]["[[1], [1]]"] == pytest.approx(2 / 6)
+
+
+def test_indexies_and_merge():
+    estimator_x = markov_tensor_estimation.create_estimator([[2], [2]])
+    markov_tensor_estimation.update_indexies(estimator_x, [0, 1, 1], [0, 0, 1])
+    estimator_y = markov_tensor_estimation.update(markov_tensor_estimation.create_estimator([[2], [2]]), [([2], [2])])
+    merged = markov_tensor_estimation.merge(estimator_x, estimator_y)
+    assert merged["observations"] == 4
+    assert markov_tensor_estimation.estimate(merged)["strands"]["[[2], [2]]"] == Fraction(2, 3)
+    with pytest.raises(ValueError):
+        markov_tensor_estimation.update_indexies(estimator_x, [2], [0])
+    with pytest.raises(ValueError):
+        markov_tensor_estimation.merge(estimator_x, markov_tensor_estimation.create_estimator([[3], [2]]))
+
+
+def test_estimate_files(tmp_path):
+    paths = []
+    for number, observations in enumerate([[[[1], [1]], [[2], [1]]], [[[2], [2]], [[2], [2]]]]):
+        path = tmp_path / "log{0}.jsonl".format(number)
+        path.write_text("".join(json.dumps(observation) + "\n" for observation in observations), encoding="utf-8")
+        paths.append(str(path))
+    estimator = markov_tensor_estimation.estimate_files(paths, [[2], [2]])
+    tensor = markov_tensor_estimation.estimate(estimator)
+    assert tensor["strands"]["[[1], [1]]"] == 1
+    assert tensor["strands"]["[[2], [2]]"] == Fraction(2, 3)
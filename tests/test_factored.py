@@ -0,0 +1,27 @@
+import markov_tensor
+
+
+def test_factored_product_materializes_to_the_product(tensor_prior, tensor_d):
+    factored = markov_tensor.tensor_product(tensor_prior, tensor_d, factored=True)
+    assert markov_tensor.is_factored(factored)
+    assert markov_tensor.get_factors(factored) == [tensor_prior, tensor_d]
+    assert factored["profile"] == [[2], [2, 2]]
+    assert markov_tensor.materialize(factored) == markov_tensor.tensor_product(tensor_prior, tensor_d)
+
+
+def test_composition_of_factored_products_stays_factored(tensor_d):
+    factored = markov_tensor.tensor_product(tensor_d, tensor_d, factored=True)
+    result = markov_tensor.composition(factored, factored)
+    assert markov_tensor.is_factored(result)
+    square = markov_tensor.composition(tensor_d, tensor_d)
+    assert markov_tensor.get_factors(result) == [square, square]
+    expanded = markov_tensor.tensor_product(tensor_d, tensor_d)
+    assert markov_tensor.materialize(result)["strands"] == markov_tensor.composition(expanded, expanded)["strands"]
+
+
+def test_mismatched_factor_boundaries_are_grouped(tensor_d):
+    # [2] # [2] と [2, 2] -> [2, 2] の結合は因子をまとめてから計算する
+    factored = markov_tensor.tensor_product(tensor_d, tensor_d, factored=True)
+    kernel = markov_tensor.tensor_product(tensor_d, tensor_d)
+    result = markov_tensor.composition(factored, kernel)
+    assert result["strands"] == markov_tensor.composition(kernel, kernel)["strands"]
@@ -0,0 +1,34 @@
+from fractions import Fraction
+
+import markov_tensor
+
+
+def test_independent_distribution_is_split(tensor_prior):
+    other = {"profile": [[], [3]], "strands": {
+        "[[], [1]]": Fraction(1, 2), "[[], [2]]": Fraction(1, 3), "[[], [3]]": Fraction(1, 6)}}
+    product = markov_tensor.tensor_product(tensor_prior, other)
+    factored = markov_tensor.factorize(product)
+    assert markov_tensor.is_factored(factored)
+    assert [factor["profile"] for factor in markov_tensor.get_factors(factored)] == [[[], [2]], [[], [3]]]
+    assert markov_tensor.materialize(factored)["strands"] == product["strands"]
+
+
+def test_kernel_products_are_split(tensor_d):
+    kernel = markov_tensor.tensor_product(tensor_d, markov_tensor.unit_tensor([2]))
+    factors = markov_tensor.get_factors(markov_tensor.factorize(kernel))
+    assert len(factors) == 2
+    assert factors[0]["strands"] == tensor_d["strands"]
+
+
+def test_dependent_tensor_is_returned_as_is(tensor_joint):
+    assert markov_tensor.factorize(tensor_joint) is tensor_joint
+
+
+def test_tolerance_records_error_bound(tensor_prior):
+    product = markov_tensor.convert_mode(markov_tensor.tensor_product(tensor_prior, tensor_prior), markov_tensor.MODE_FLOAT64)
+    product["strands"]["[[], [1, 1]]"] += 1e-9
+    product["strands"]["[[], [2, 2]]"] -= 1e-9
+    assert not markov_tensor.is_factored(markov_tensor.factorize(product))
+    factored = markov_tensor.factorize(product, tolerance=1e-6)
+    assert markov_tensor.is_factored(factored)
+    assert markov_tensor.get_factors(factored)[0]["error_bound"] > 0
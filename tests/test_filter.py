@@ -0,0 +1,67 @@
+import json
+import math
+from fractions import Fraction
+
+import pytest
+
+import markov_tensor
+import markov_tensor_filter
+from conftest import assert_close
+
+
+@pytest.fixture
+def tensor_h():
+    return {
+        "profile": [[2], [["H", "T"]]],
+        "strands": {
+            "[[1], [['H']]]": Fraction(1, 2),
+            "[[1], [['T']]]": Fraction(1, 2),
+            "[[2], [['H']]]": Fraction(9, 10),
+            "[[2], [['T']]]": Fraction(1, 10)
+        }
+    }
+
+
+def test_update_matches_conditionalization(tensor_prior, tensor_h):
+    state = markov_tensor_filter.create_filter(tensor_prior, tensor_h)
+    markov_tensor_filter.update(state, "H")
+    posterior = markov_tensor_filter.get_posterior(state)
+    # P(2 | H) = 0.9 * 0.9 / (0.1 * 0.5 + 0.9 * 0.9)
+    assert posterior["strands"]["[[], [2]]"] == Fraction(81, 86)
+
+
+def test_zero_probability_observation_leaves_state(tensor_h):
+    prior = {"profile": [[], [2]], "strands": {"[[], [1]]": Fraction(1), "[[], [2]]": Fraction(0)}}
+    kernel = dict(tensor_h, strands=dict(tensor_h["strands"], **{"[[1], [['H']]]": Fraction(0), "[[1], [['T']]]": Fraction(1)}))
+    state = markov_tensor_filter.create_filter(prior, kernel)
+    with pytest.raises(ValueError):
+        markov_tensor_filter.update(state, "H")
+    assert state["observations"] == 0
+
+
+def test_log_inputs_give_log_posterior(tensor_prior, tensor_h):
+    exact = markov_tensor_filter.create_filter(tensor_prior, tensor_h)
+    markov_tensor_filter.update(exact, "H")
+    state = markov_tensor_filter.create_filter(
+        markov_tensor.convert_mode(tensor_prior, markov_tensor.MODE_LOG),
+        markov_tensor.convert_mode(tensor_h, markov_tensor.MODE_LOG))
+    markov_tensor_filter.update(state, "H")
+    posterior = markov_tensor_filter.get_posterior(state)
+    assert posterior["mode"] == markov_tensor.MODE_LOG
+    assert posterior["strands"]["[[], [2]]"] == pytest.approx(math.log(81 / 86))
+    assert_close(posterior, markov_tensor_filter.get_posterior(exact))
+
+
+def test_transition_mode_is_promoted(tensor_prior, tensor_h, tensor_d):
+    transition = markov_tensor.convert_mode(tensor_d, markov_tensor.MODE_FLOAT32)
+    state = markov_tensor_filter.create_filter(tensor_prior, tensor_h, transition)
+    assert markov_tensor_filter.get_posterior(state)["mode"] == markov_tensor.MODE_FLOAT32
+
+
+def test_json_round_trip(tensor_prior, tensor_h, tensor_d):
+    state = markov_tensor_filter.create_filter(tensor_prior, tensor_h, tensor_d)
+    markov_tensor_filter.update(state, "H")
+    restored = markov_tensor_filter.from_json(json.loads(json.dumps(markov_tensor_filter.to_json(state))))
+    markov_tensor_filter.update(state, "T")
+    markov_tensor_filter.update(restored, "T")
+    assert markov_tensor_filter.get_posterior(restored) == markov_tensor_filter.get_posterior(state)
@@ -0,0 +1,65 @@
+import itertools
+import math
+
+import numpy as np
+import pytest
+
+import markov_tensor_hmm
+
+TRANSITION = [[0.7, 0.3], [0.2, 0.8]]
+EMISSION = [[0.9, 0.1], [0.3, 0.7]]
+PRIOR = [0.6, 0.4]
+SYMBOLS = ["H", "T"]
+
+
+@pytest.fixture
+def hmm():
+    transition = {"profile": [[2], [2]], "strands": {
+        str([[row + 1], [column + 1]]): TRANSITION[row][column] for row in range(2) for column in range(2)}}
+    emission = {"profile": [[2], [SYMBOLS]], "strands": {
+        str([[row + 1], [[SYMBOLS[column]]]]): EMISSION[row][column] for row in range(2) for column in range(2)}}
+    prior = {"profile": [[], [2]], "strands": {"[[], [1]]": PRIOR[0], "[[], [2]]": PRIOR[1]}}
+    return markov_tensor_hmm.create_hmm(transition, emission, prior)
+
+
+def joint_probability(path, sequence):
+    # 状態の系列と観測系列の同時確率を直接計算
+    probability = PRIOR[path[0]] * EMISSION[path[0]][SYMBOLS.index(sequence[0])]
+    for time in range(1, len(sequence)):
+        probability *= TRANSITION[path[time - 1]][path[time]] * EMISSION[path[time]][SYMBOLS.index(sequence[time])]
+    return probability
+
+
+def test_forward_backward_matches_enumeration(hmm):
+    sequences = [["H", "T", "T"], ["T", "H"]]
+    result = markov_tensor_hmm.forward_backward(hmm, sequences)
+    for row, sequence in enumerate(sequences):
+        paths = list(itertools.product(range(2), repeat=len(sequence)))
+        likelihood = sum(joint_probability(path, sequence) for path in paths)
+        assert result["log_likelihood"][row] == pytest.approx(math.log(likelihood))
+        for time in range(len(sequence)):
+            smoothed = [sum(joint_probability(path, sequence) for path in paths if path[time] == state) / likelihood
+                        for state in range(2)]
+            assert result["smoothed"][row, time] == pytest.approx(smoothed)
+    # 最後の時刻ではフィルタリングと平滑化が一致し、長さを超えた時刻は 0
+    assert result["filtered"][0, 2] == pytest.approx(result["smoothed"][0, 2])
+    assert not result["filtered"][1, 2].any()
+    distribution = markov_tensor_hmm.get_distribution(hmm, result["smoothed"], 0, 1)
+    assert sum(distribution["strands"].values()) == pytest.approx(1)
+
+
+def test_viterbi_matches_enumeration(hmm):
+    sequences = [["H", "T", "T", "H"], [], ["T"]]
+    result = markov_tensor_hmm.viterbi(hmm, sequences)
+    for row, sequence in enumerate(sequences):
+        if not sequence:
+            assert result["paths"][row] == []
+            continue
+        best = max(itertools.product(range(2), repeat=len(sequence)), key=lambda path: joint_probability(path, sequence))
+        assert result["paths"][row] == [[state + 1] for state in best]
+        assert result["log_probability"][row] == pytest.approx(math.log(joint_probability(best, sequence)))
+
+
+def test_forward_filtering_sums_to_one(hmm):
+    result = markov_tensor_hmm.forward(hmm, [["H", "H", "T"]])
+    assert result["filtered"].sum(axis=2) == pytest.approx(np.ones((1, 3)))
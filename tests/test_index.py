@@ -0,0 +1,40 @@
+from fractions import Fraction
+
+import markov_tensor
+
+
+def test_select_and_slice(tensor_joint, tensor_d):
+    assert markov_tensor.select_strands(tensor_d, domain_point=[2]) == {
+        "[[2], [1]]": Fraction(1, 10), "[[2], [2]]": Fraction(9, 10)}
+    assert markov_tensor.slice_tensor(tensor_joint, codomain_values={0: 2}) == {
+        "profile": [[], [2]], "strands": {"[[], [1]]": Fraction(3, 10), "[[], [2]]": Fraction(4, 10)}}
+    assert markov_tensor.get_column(tensor_d, [1])["strands"] == {"[[], [1]]": Fraction(2, 5), "[[], [2]]": Fraction(3, 5)}
+
+
+def test_input_is_not_mutated(tensor_d):
+    markov_tensor.select_strands(tensor_d, domain_point=[1])
+    assert set(tensor_d.keys()) == {"profile", "strands"}
+
+
+def test_replaced_key_rebuilds_index(tensor_d):
+    markov_tensor.select_strands(tensor_d, domain_point=[1])
+    # 数を変えずにキーを置き換える
+    del tensor_d["strands"]["[[1], [1]]"]
+    tensor_d["strands"]["[[1], [3]]"] = Fraction(2, 5)
+    assert markov_tensor.select_strands(tensor_d, domain_point=[1]) == {
+        "[[1], [2]]": Fraction(3, 5), "[[1], [3]]": Fraction(2, 5)}
+
+
+def test_replaced_strands_dict_rebuilds_index(tensor_d):
+    markov_tensor.select_strands(tensor_d, domain_point=[1])
+    tensor_d["strands"] = {"[[1], [2]]": Fraction(1)}
+    assert markov_tensor.select_strands(tensor_d, domain_point=[1]) == {"[[1], [2]]": Fraction(1)}
+
+
+def test_factored_tensors_are_materialized(tensor_prior, tensor_d):
+    factored = markov_tensor.tensor_product(tensor_prior, tensor_d, factored=True)
+    assert "factors" in factored
+    expected = markov_tensor.select_strands(markov_tensor.materialize(factored), domain_values={0: 2})
+    assert markov_tensor.select_strands(factored, domain_values={0: 2}) == expected
+    assert markov_tensor.slice_tensor(factored, domain_values={0: 2}) == markov_tensor.slice_tensor(
+        markov_tensor.materialize(factored), domain_values={0: 2})
@@ -0,0 +1,54 @@
+from fractions import Fraction
+
+import pytest
+
+import markov_tensor
+import markov_tensor_inference
+
+
+@pytest.fixture
+def network(tensor_prior, tensor_d):
+    return markov_tensor_inference.create_network({
+        "a": {"tensor": tensor_prior, "domain": [], "codomain": ["A"]},
+        "b": {"tensor": tensor_d, "domain": ["A"], "codomain": ["B"]},
+        "c": {"tensor": tensor_d, "domain": ["B"], "codomain": ["C"]}
+    })
+
+
+def test_query_matches_bayes_rule(network):
+    posterior = markov_tensor_inference.query(network, ["A"], {"B": 2})
+    # P(A = 2 | B = 2) = 0.9 * 0.9 / (0.1 * 0.6 + 0.9 * 0.9)
+    assert posterior["strands"] == {"[[], [1]]": Fraction(6, 87), "[[], [2]]": Fraction(81, 87)}
+
+
+def test_query_matches_composition(network, tensor_prior, tensor_d):
+    expected = markov_tensor.composition(markov_tensor.composition(tensor_prior, tensor_d), tensor_d)
+    assert markov_tensor_inference.query(network, ["C"])["strands"] == expected["strands"]
+
+
+def test_intermediate_factors_are_cached(network):
+    first = markov_tensor_inference.query(network, ["A"], {"C": 1})
+    hits = network["cache_hits"]
+    assert markov_tensor_inference.query(network, ["A"], {"C": 1}) == first
+    assert network["cache_hits"] > hits
+
+
+def test_query_variable_in_evidence_is_a_point_mass(network):
+    posterior = markov_tensor_inference.query(network, ["A", "B"], {"B": 2})
+    conditional = markov_tensor_inference.query(network, ["A"], {"B": 2})
+    assert posterior["strands"]["[[], [1, 1]]"] == 0
+    assert posterior["strands"]["[[], [2, 2]]"] == conditional["strands"]["[[], [2]]"]
+    assert markov_tensor_inference.query(network, ["B"], {"B": 2})["strands"] == {"[[], [1]]": 0, "[[], [2]]": 1}
+
+
+def test_zero_probability_evidence_raises(tensor_d, capsys):
+    prior = {"profile": [[], [2]], "strands": {"[[], [1]]": Fraction(1), "[[], [2]]": Fraction(0)}}
+    kernel = {"profile": [[2], [2]], "strands": {"[[1], [1]]": Fraction(1), "[[1], [2]]": Fraction(0),
+                                                  "[[2], [1]]": Fraction(0), "[[2], [2]]": Fraction(1)}}
+    network = markov_tensor_inference.create_network({
+        "a": {"tensor": prior, "domain": [], "codomain": ["A"]},
+        "b": {"tensor": kernel, "domain": ["A"], "codomain": ["B"]}
+    })
+    with pytest.raises(ValueError):
+        markov_tensor_inference.query(network, ["A"], {"B": 2})
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,38 @@
+from fractions import Fraction
+import math
+
+import markov_tensor
+from conftest import assert_close
+
+
+def test_rational_composition_is_exact(tensor_prior, tensor_d):
+    result = markov_tensor.composition(tensor_prior, tensor_d)
+    assert result["strands"] == {"[[], [1]]": Fraction(13, 100), "[[], [2]]": Fraction(87, 100)}
+
+
+def test_modes_promote_and_agree(tensor_prior, tensor_d):
+    exact = markov_tensor.composition(tensor_prior, tensor_d)
+    for mode in (markov_tensor.MODE_FLOAT64, markov_tensor.MODE_FLOAT32, markov_tensor.MODE_LOG):
+        result = markov_tensor.composition(markov_tensor.convert_mode(tensor_prior, mode), tensor_d)
+        assert result["mode"] == mode
+        assert_close(result, exact, 1e-6)
+
+
+def test_log_mode_stores_logarithms(tensor_d):
+    converted = markov_tensor.convert_mode(tensor_d, markov_tensor.MODE_LOG)
+    assert converted["strands"]["[[1], [1]]"] == math.log(0.4)
+
+
+def test_float32_conversion_records_error_bound(tensor_d):
+    converted = markov_tensor.convert_mode(tensor_d, markov_tensor.MODE_FLOAT32)
+    assert 0 < converted["error_bound"] < 1e-6
+
+
+def test_rational_fallback_on_large_denominators(tensor_d):
+    markov_tensor.RATIONAL_DENOMINATOR_BITS = 8
+    tensor_x = markov_tensor.convert_mode(tensor_d, markov_tensor.MODE_RATIONAL)
+    result = tensor_x
+    for _ in range(4):
+        result = markov_tensor.composition(result, tensor_x)
+    assert result["mode"] == markov_tensor.RATIONAL_FALLBACK_MODE
+    assert result["error_bound"] > 0
@@ -0,0 +1,48 @@
+import pytest
+
+import markov_tensor
+import markov_tensor_monte_carlo
+
+
+def assert_within(result, expected):
+    # 厳密な値が信頼区間に入る
+    for strand, weight in expected["strands"].items():
+        assert result["lower"]["strands"][strand] <= float(weight) <= result["upper"]["strands"][strand]
+
+
+def test_composition_and_marginal(tensor_prior, tensor_d):
+    particles = markov_tensor_monte_carlo.sample_tensor(tensor_prior, 20000, seed=0)
+    particles = markov_tensor_monte_carlo.composition(particles, tensor_d, seed=1)
+    result = markov_tensor_monte_carlo.marginal(particles, [0])
+    assert result["effective_size"] == pytest.approx(20000)
+    assert_within(result, markov_tensor.composition(tensor_prior, tensor_d))
+
+
+def test_factored_kernels_are_not_expanded(tensor_prior, tensor_d):
+    prior = markov_tensor.tensor_product(tensor_prior, tensor_prior, factored=True)
+    kernel = markov_tensor.tensor_product(tensor_d, tensor_d, factored=True)
+    particles = markov_tensor_monte_carlo.composition(
+        markov_tensor_monte_carlo.sample_tensor(prior, 20000, seed=2), kernel, seed=3)
+    assert particles["positions"].shape == (20000, 2)
+    assert_within(markov_tensor_monte_carlo.marginal(particles, [1]), markov_tensor.composition(tensor_prior, tensor_d))
+
+
+def test_condition_approximates_conversion(tensor_prior, tensor_d):
+    particles = markov_tensor_monte_carlo.sample_tensor(tensor_prior, 20000, seed=4)
+    posterior = markov_tensor_monte_carlo.condition(particles, tensor_d, [2])
+    result = markov_tensor_monte_carlo.marginal(posterior, [0])
+    assert result["effective_size"] < 20000
+    expected = markov_tensor.get_column(markov_tensor.conversion(tensor_prior, tensor_d), [2])
+    assert_within(result, expected)
+    resampled = markov_tensor_monte_carlo.resample(posterior, 1000, seed=5)
+    assert markov_tensor_monte_carlo.effective_size(resampled) == pytest.approx(1000)
+
+
+def test_conditional_and_required_size(tensor_prior, tensor_d):
+    particles = markov_tensor_monte_carlo.jointification(
+        markov_tensor_monte_carlo.sample_tensor(tensor_prior, 20000, seed=6), tensor_d, seed=7)
+    result = markov_tensor_monte_carlo.conditional(particles, {0: 1}, [1])
+    assert_within(result, markov_tensor.get_column(tensor_d, [1]))
+    assert markov_tensor_monte_carlo.required_size(0.01) == 9604
+    with pytest.raises(ValueError):
+        markov_tensor_monte_carlo.composition(particles, tensor_d)
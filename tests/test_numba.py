@@ -0,0 +1,38 @@
+import pytest
+
+import markov_tensor
+
+
+@pytest.fixture(autouse=True)
+def require_numba():
+    pytest.importorskip("numba")
+
+
+def run(backend, function):
+    markov_tensor.BACKEND = backend
+    try:
+        return function()
+    finally:
+        markov_tensor.BACKEND = None
+
+
+def test_is_markov_agrees_with_python(tensor_d):
+    kernel = markov_tensor.convert_mode(tensor_d, markov_tensor.MODE_FLOAT64)
+    assert run("jit", lambda: markov_tensor.is_markov(kernel))
+    broken = dict(kernel, strands=dict(kernel["strands"], **{"[[2], [2]]": 0.5}))
+    assert not run("jit", lambda: markov_tensor.is_markov(broken))
+    assert run("python", lambda: markov_tensor.is_markov(broken)) is False
+
+
+def test_conditionalization_keeps_mode_and_error_bound(tensor_joint):
+    joint = markov_tensor.convert_mode(tensor_joint, markov_tensor.MODE_FLOAT32)
+    joint["error_bound"] = 1e-3
+    expected = run("python", lambda: markov_tensor.conditionalization(joint, 2))
+    result = run("jit", lambda: markov_tensor.conditionalization(joint, 2))
+    assert result["mode"] == markov_tensor.MODE_FLOAT32
+    assert result["error_bound"] == pytest.approx(expected["error_bound"])
+    for strand, weight in expected["strands"].items():
+        assert result["strands"][strand] == pytest.approx(weight, rel=1e-6)
+
+    # float32 の和も 1 とちょうど等しいかで判定する
+    assert run("jit", lambda: markov_tensor.is_markov(result)) == run("python", lambda: markov_tensor.is_markov(result))
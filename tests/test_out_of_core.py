@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pytest
+
+import markov_tensor
+import markov_tensor_numpy
+import markov_tensor_out_of_core
+
+
+def random_tensor(profile, seed, normalize=True):
+    generator = np.random.default_rng(seed)
+    shape = tuple(int(np.prod(markov_tensor_numpy.profile_sizes(side))) for side in profile)
+    matrix = generator.random(shape)
+    if normalize:
+        matrix /= matrix.sum(axis=1, keepdims=True)
+    return markov_tensor_numpy.from_matrix(matrix, profile)
+
+
+def matrix_of(path):
+    return markov_tensor_numpy.to_matrix(markov_tensor_out_of_core.from_blocked(path))
+
+
+def test_composition_with_misaligned_blocks(tmp_path):
+    distribution = random_tensor([[], [9]], 0)
+    kernel_x = random_tensor([[7], [9]], 1)
+    kernel_y = random_tensor([[9], [5]], 2)
+    for name, tensor in (("p", distribution), ("x", kernel_x), ("y", kernel_y)):
+        markov_tensor_out_of_core.to_blocked(tensor, str(tmp_path / name), block_size=2)
+    markov_tensor_out_of_core.composition(str(tmp_path / "x"), str(tmp_path / "y"), str(tmp_path / "xy"))
+    markov_tensor_out_of_core.composition(str(tmp_path / "p"), str(tmp_path / "y"), str(tmp_path / "py"))
+    assert np.allclose(matrix_of(str(tmp_path / "xy")),
+                       markov_tensor_numpy.to_matrix(kernel_x) @ markov_tensor_numpy.to_matrix(kernel_y))
+    assert np.allclose(matrix_of(str(tmp_path / "py")),
+                       markov_tensor_numpy.to_matrix(distribution) @ markov_tensor_numpy.to_matrix(kernel_y))
+
+
+@pytest.mark.parametrize("profile_x, profile_y", [
+    ([[], [40]], [[40], [40]]),
+    ([[40], [40]], [[40], []]),
+    ([[], [40]], [[40], []])
+])
+def test_composition_reads_at_most_one_block_of_elements(tmp_path, monkeypatch, profile_x, profile_y):
+    tensor_x = random_tensor(profile_x, 5)
+    tensor_y = random_tensor(profile_y, 6)
+    markov_tensor_out_of_core.to_blocked(tensor_x, str(tmp_path / "x"), block_size=4)
+    markov_tensor_out_of_core.to_blocked(tensor_y, str(tmp_path / "y"), block_size=4)
+    sizes = []
+    read_region = markov_tensor_out_of_core.read_region
+
+    def recording_read_region(*arguments, **keywords):
+        region = read_region(*arguments, **keywords)
+        sizes.append(region.size)
+        return region
+
+    monkeypatch.setattr(markov_tensor_out_of_core, "read_region", recording_read_region)
+    markov_tensor_out_of_core.composition(str(tmp_path / "x"), str(tmp_path / "y"), str(tmp_path / "xy"))
+    assert max(sizes) <= 4 * 4
+    assert np.allclose(matrix_of(str(tmp_path / "xy")),
+                       markov_tensor_numpy.to_matrix(tensor_x) @ markov_tensor_numpy.to_matrix(tensor_y))
+
+
+def test_marginalization_and_conditionalization(tmp_path):
+    joint = random_tensor([[], [6, 5]], 3, normalize=False)
+    matrix = markov_tensor_numpy.to_matrix(joint).reshape(6, 5)
+    path = str(tmp_path / "joint")
+    markov_tensor_out_of_core.to_blocked(joint, path, block_size=3)
+    markov_tensor_out_of_core.first_marginalization(path, 2, str(tmp_path / "first"))
+    markov_tensor_out_of_core.second_marginalization(path, 2, str(tmp_path / "second"))
+    markov_tensor_out_of_core.conditionalization(path, 2, str(tmp_path / "conditional"))
+    assert np.allclose(matrix_of(str(tmp_path / "first"))[0], matrix.sum(axis=1))
+    assert np.allclose(matrix_of(str(tmp_path / "second"))[0], matrix.sum(axis=0))
+    assert np.allclose(matrix_of(str(tmp_path / "conditional")), matrix / matrix.sum(axis=1, keepdims=True))
+
+
+def test_single_row_tensors_use_wide_blocks(tmp_path):
+    joint = random_tensor([[], [8, 8]], 4, normalize=False)
+    path = str(tmp_path / "joint")
+    meta = markov_tensor_out_of_core.to_blocked(joint, path, block_size=4)
+    assert meta["block_shape"] == [1, 16]
+    assert len([name for name in os.listdir(path) if name.endswith(".npy")]) == 4
+
+
+def test_first_marginalization_loads_each_block_once(tmp_path, monkeypatch):
+    joint = random_tensor([[], [8, 8]], 5, normalize=False)
+    path = str(tmp_path / "joint")
+    markov_tensor_out_of_core.to_blocked(joint, path, block_size=4)
+    loads = []
+    load = np.load
+    monkeypatch.setattr(np, "load", lambda *args, **kwargs: loads.append(args[0]) or load(*args, **kwargs))
+    markov_tensor_out_of_core.first_marginalization(path, 2, str(tmp_path / "first"))
+    assert len(loads) == 4
+
+
+def test_resume_checks_the_fingerprint(tmp_path):
+    kernel_x = random_tensor([[4], [4]], 6)
+    kernel_y = random_tensor([[4], [4]], 7)
+    path_x = str(tmp_path / "x")
+    path_result = str(tmp_path / "xx")
+    markov_tensor_out_of_core.to_blocked(kernel_x, path_x, block_size=2)
+    markov_tensor_out_of_core.composition(path_x, path_x, path_result)
+    # 書き終えたブロックを消して、同じ引数で再開する
+    os.remove(markov_tensor_out_of_core.block_path(path_result, 1, 1))
+    done = []
+    markov_tensor_out_of_core.composition(path_x, path_x, path_result, progress=lambda count, total: done.append(count))
+    assert done[-1] == 4
+    assert np.allclose(matrix_of(path_result), markov_tensor_numpy.to_matrix(kernel_x) @ markov_tensor_numpy.to_matrix(kernel_x))
+
+    with pytest.raises(ValueError):
+        markov_tensor_out_of_core.to_blocked(kernel_y, path_x, block_size=2)
+    path_y = str(tmp_path / "y")
+    markov_tensor_out_of_core.to_blocked(kernel_y, path_y, block_size=2)
+    with pytest.raises(ValueError):
+        markov_tensor_out_of_core.composition(path_x, path_y, path_result)
@@ -0,0 +1,46 @@
+import pytest
+
+import markov_tensor
+import markov_tensor_numpy
+import markov_tensor_plan
+
+
+def assert_same_weights(tensor_result, expected):
+    for strand, weight in tensor_result["strands"].items():
+        assert weight == pytest.approx(float(expected["strands"].get(strand, 0)))
+
+
+def test_plan_matches_dict_implementation(tensor_joint, tensor_d):
+    expression = "conversion(first_marginalization(p, 2), h)"
+    plan = markov_tensor_plan.compile_plan(expression, {"p": tensor_joint["profile"], "h": tensor_d["profile"]})
+    result = markov_tensor_plan.run_plan_tensors(plan, {"p": tensor_joint, "h": tensor_d})
+    assert result["profile"] == [[2], [2]]
+    assert_same_weights(result, markov_tensor.conversion(markov_tensor.first_marginalization(tensor_joint, 2), tensor_d))
+
+
+def test_composition_chain_and_constants(tensor_d):
+    expression = "composition(composition(tensor_product(d, d), swap([2], [2])), tensor_product(d, d))"
+    plan = markov_tensor_plan.compile_plan(expression, {"d": tensor_d["profile"]})
+    result = markov_tensor_plan.run_plan_tensors(plan, {"d": tensor_d})
+    product = markov_tensor.tensor_product(tensor_d, tensor_d)
+    expected = markov_tensor.composition(markov_tensor.composition(product, markov_tensor.swap([2], [2])), product)
+    assert_same_weights(result, expected)
+
+
+def test_rerun_with_new_weights_reuses_buffers(tensor_d):
+    plan = markov_tensor_plan.compile_plan("composition(d, d)", {"d": tensor_d["profile"]})
+    first = markov_tensor_plan.run_plan(plan, {"d": markov_tensor_numpy.to_matrix(tensor_d)})
+    identity = markov_tensor_numpy.to_matrix(markov_tensor.unit_tensor([2]))
+    second = markov_tensor_plan.run_plan(plan, {"d": identity})
+    assert second is first
+    assert second == pytest.approx(identity)
+
+
+def test_invalid_plans_and_weights(tensor_d):
+    with pytest.raises(ValueError):
+        markov_tensor_plan.compile_plan("composition(d, x)", {"d": tensor_d["profile"]})
+    with pytest.raises(ValueError):
+        markov_tensor_plan.compile_plan("open(d)", {"d": tensor_d["profile"]})
+    plan = markov_tensor_plan.compile_plan("composition(d, d)", {"d": tensor_d["profile"]})
+    with pytest.raises(ValueError):
+        markov_tensor_plan.run_plan(plan, {"d": [[1.0]]})
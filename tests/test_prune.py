@@ -0,0 +1,55 @@
+from fractions import Fraction
+
+import pytest
+
+import markov_tensor
+
+
+@pytest.fixture
+def measure():
+    # 域の格子点ごとの和が 1 でない (部分的な) テンソル
+    return {
+        "profile": [[2], [3]],
+        "strands": {
+            "[[1], [1]]": Fraction(1, 4), "[[1], [2]]": Fraction(1, 4), "[[1], [3]]": Fraction(1, 20),
+            "[[2], [1]]": Fraction(1, 2), "[[2], [2]]": Fraction(1, 2), "[[2], [3]]": Fraction(0)
+        }
+    }
+
+
+def column_sums(tensor):
+    sums = {}
+    for strand, weight in tensor["strands"].items():
+        strand_from, _ = markov_tensor.get_lattice_points(strand)
+        sums[str(strand_from)] = sums.get(str(strand_from), 0) + weight
+    return sums
+
+
+def test_prune_discards_small_and_zero_weights(measure):
+    result = markov_tensor.prune(measure, threshold=Fraction(1, 10))
+    assert set(result["strands"]) == {"[[1], [1]]", "[[1], [2]]", "[[2], [1]]", "[[2], [2]]"}
+    assert result["error_bound"] == pytest.approx(0.05)
+
+
+def test_renormalize_restores_column_sums(measure):
+    result = markov_tensor.prune(measure, threshold=Fraction(1, 10), renormalize=True)
+    assert column_sums(result) == column_sums(measure)
+    assert result["strands"]["[[1], [1]]"] == Fraction(11, 40)
+    # 捨てた重み d と、残りの重みの増分 d の和
+    assert result["error_bound"] == pytest.approx(0.1)
+
+
+def test_renormalize_normalizes_markov_columns(tensor_d):
+    kernel = markov_tensor.convert_mode(tensor_d, markov_tensor.MODE_LOG)
+    result = markov_tensor.prune(kernel, top_k=1, renormalize=True)
+    assert result["strands"] == {"[[1], [2]]": pytest.approx(0.0), "[[2], [2]]": pytest.approx(0.0)}
+
+
+def test_error_bound_covers_chained_approximation(tensor_prior, tensor_d):
+    exact = tensor_prior
+    approximate = tensor_prior
+    for _ in range(5):
+        exact = markov_tensor.composition(exact, tensor_d)
+        approximate = markov_tensor.approximate_composition(approximate, tensor_d, threshold=Fraction(1, 5), renormalize=True)
+    error = sum(abs(exact["strands"][strand] - approximate["strands"].get(strand, 0)) for strand in exact["strands"])
+    assert error <= approximate["error_bound"]
@@ -0,0 +1,42 @@
+import json
+
+import markov_tensor
+import markov_tensor_runner
+
+
+def test_expression_to_jsonl(tmp_path, capsys, tensor_prior, tensor_d):
+    markov_tensor.save_tensor(tensor_prior, str(tmp_path / "p.json"))
+    markov_tensor.save_tensor(tensor_d, str(tmp_path / "d.json"))
+    output = tmp_path / "result.jsonl"
+    status = markov_tensor_runner.main([
+        "-t", str(tmp_path / "p.json"), "-t", "kernel=" + str(tmp_path / "d.json"),
+        "-e", "composition(p, kernel)", "-o", str(output)])
+    assert status == markov_tensor_runner.EXIT_SUCCESS
+    record = json.loads(output.read_text(encoding="utf-8"))
+    assert record["status"] == "ok"
+    assert markov_tensor.tensor_from_json(record["result"]) == markov_tensor.composition(tensor_prior, tensor_d)
+    assert "1 jobs, 0 failed" in capsys.readouterr().err
+
+
+def test_failed_job_sets_exit_code(tmp_path, capsys, tensor_d):
+    markov_tensor.save_tensor(tensor_d, str(tmp_path / "d.json"))
+    jobs = tmp_path / "jobs.jsonl"
+    jobs.write_text(
+        json.dumps({"name": "ok", "expression": "composition(d, d)"}) + "\n\n" +
+        json.dumps({"expression": "undefined(d)"}) + "\n", encoding="utf-8")
+    status = markov_tensor_runner.main(["-t", str(tmp_path / "d.json"), "-j", str(jobs), "-f", "text"])
+    assert status == markov_tensor_runner.EXIT_JOB_FAILED
+    out = capsys.readouterr().out
+    assert "--- ok (ok" in out
+    assert "--- job3 (failed" in out
+    assert "NameError" in out
+
+
+def test_builtins_are_not_available(tensor_d):
+    record = markov_tensor_runner.run_job({"name": "open", "expression": "open('x')"}, {"d": tensor_d})
+    assert record["status"] == "failed"
+
+
+def test_missing_tensor_file_is_a_usage_error(tmp_path, capsys):
+    status = markov_tensor_runner.main(["-t", str(tmp_path / "missing.json"), "-e", "p"])
+    assert status == markov_tensor_runner.EXIT_USAGE
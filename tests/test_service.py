@@ -0,0 +1,44 @@
+from fractions import Fraction
+
+import pytest
+
+import markov_tensor
+import markov_tensor_service
+
+
+@pytest.fixture
+def service(tensor_d):
+    service = markov_tensor_service.create_service(workers=2)
+    markov_tensor_service.register_kernel(service, "d", tensor_d)
+    yield service
+    markov_tensor_service.close_service(service)
+
+
+def test_exact_requests_stay_exact(service, tensor_prior, tensor_d):
+    kernel = markov_tensor_service.get_kernel(service, "d")
+    result = markov_tensor_service.compute_batch("composition", kernel, [tensor_prior, tensor_prior])
+    expected = markov_tensor.composition(tensor_prior, tensor_d)
+    assert result == [expected, expected]
+    assert all(type(weight) == Fraction for weight in result[0]["strands"].values())
+
+    evolved = markov_tensor_service.compute_batch("evolve", kernel, [tensor_prior], time=3)[0]
+    assert evolved["strands"] == markov_tensor.composition(
+        markov_tensor.composition(expected, tensor_d), tensor_d)["strands"]
+    with pytest.raises(ValueError):
+        markov_tensor_service.compute_batch("evolve", kernel, [tensor_prior], time=0.5)
+
+
+def test_float_requests_are_batched(service, tensor_prior, tensor_d):
+    kernel = markov_tensor_service.register_kernel(
+        service, "f", markov_tensor.convert_mode(tensor_d, markov_tensor.MODE_FLOAT64))
+    distribution = markov_tensor.convert_mode(tensor_prior, markov_tensor.MODE_FLOAT64)
+    result = markov_tensor_service.compute_batch("composition", kernel, [distribution, distribution])
+    assert result[0]["strands"]["[[], [1]]"] == pytest.approx(0.1 * 0.4 + 0.9 * 0.1)
+    assert result[1] == result[0]
+
+
+def test_submit_through_route(service, tensor_prior):
+    status, body = markov_tensor_service.route(service, "POST", ["compute", "composition"], {
+        "kernel": "d", "tensor": markov_tensor.tensor_to_json(tensor_prior)})
+    assert status == 200
+    assert body["result"]["strands"] == {"[[], [1]]": "13/100", "[[], [2]]": "87/100"}
@@ -0,0 +1,64 @@
+import concurrent.futures
+import gc
+import multiprocessing
+from fractions import Fraction
+
+import pytest
+
+import markov_tensor
+import markov_tensor_shared
+from conftest import assert_close
+
+
+def compose_in_worker(handle, tensor_x):
+    with markov_tensor_shared.attached(handle) as kernel:
+        return markov_tensor_shared.composition(tensor_x, kernel)
+
+
+def test_round_trip_and_composition(tensor_prior, tensor_d):
+    with markov_tensor_shared.sharing(tensor_d) as shared:
+        assert_close(markov_tensor_shared.to_tensor(shared), tensor_d)
+        assert_close(markov_tensor_shared.get_column(shared, [2]), {
+            "profile": [[], [2]], "strands": {"[[], [1]]": Fraction(1, 10), "[[], [2]]": Fraction(9, 10)}})
+        assert_close(markov_tensor_shared.composition(tensor_prior, shared),
+                     markov_tensor.composition(tensor_prior, tensor_d))
+
+
+def test_release_refuses_while_matrix_is_alive(tensor_d):
+    shared = markov_tensor_shared.create_shared(tensor_d)
+    matrix = markov_tensor_shared.to_csr(shared)
+    with pytest.raises(BufferError):
+        markov_tensor_shared.release(shared)
+    # 送出した後も共有テンソルと疎行列は使える
+    assert matrix.toarray().sum() == pytest.approx(2.0)
+    assert markov_tensor_shared.to_csr(shared).nnz == 4
+    del matrix
+    gc.collect()
+    markov_tensor_shared.release(shared)
+    assert shared["segment"] is None
+    with pytest.raises(ValueError):
+        markov_tensor_shared.to_csr(shared)
+
+
+def test_attached_refuses_to_close_leaked_views(tensor_d):
+    with markov_tensor_shared.sharing(tensor_d) as shared:
+        handle = markov_tensor_shared.get_handle(shared)
+        with pytest.raises(BufferError):
+            with markov_tensor_shared.attached(handle) as kernel:
+                leaked = kernel["data"]
+        assert leaked.sum() == pytest.approx(2.0)
+        del leaked
+        gc.collect()
+        markov_tensor_shared.detach(kernel)
+
+
+def test_workers_share_the_segment(tensor_prior, tensor_d):
+    expected = markov_tensor.composition(tensor_prior, tensor_d)
+    # 他のテストで起動したスレッドを複製しないよう、ワーカーは spawn で起動する
+    with markov_tensor_shared.sharing(tensor_d) as shared:
+        handle = markov_tensor_shared.get_handle(shared)
+        with concurrent.futures.ProcessPoolExecutor(
+                2, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(compose_in_worker, [handle] * 3, [tensor_prior] * 3))
+    for result in results:
+        assert_close(result, expected)
@@ -0,0 +1,33 @@
+import pytest
+
+import markov_tensor
+import markov_tensor_spectral
+from conftest import assert_close
+
+
+def test_evolve_matches_repeated_composition(tensor_prior, tensor_d):
+    expected = tensor_prior
+    for _ in range(5):
+        expected = markov_tensor.composition(expected, tensor_d)
+    assert_close(markov_tensor_spectral.evolve(tensor_prior, tensor_d, 5), expected)
+    spectral = markov_tensor_spectral.prepare_spectral(tensor_d)
+    assert_close(markov_tensor_spectral.evolve(tensor_prior, spectral, 5), expected)
+
+
+def test_fractional_power_squares_to_kernel(tensor_d):
+    root = markov_tensor_spectral.kernel_power(tensor_d, 0.5)
+    assert_close(markov_tensor.composition(root, root), tensor_d)
+
+
+def test_kernel_is_not_mutated_and_decomposition_is_reused(tensor_prior, tensor_d):
+    markov_tensor_spectral.evolve(tensor_prior, tensor_d, 3)
+    assert set(tensor_d.keys()) == {"profile", "strands"}
+    spectral = markov_tensor_spectral.get_spectral(tensor_d)
+    assert markov_tensor_spectral.get_spectral(tensor_d) is spectral
+
+
+def test_replaced_weights_are_decomposed_again(tensor_prior, tensor_d):
+    markov_tensor_spectral.evolve(tensor_prior, tensor_d, 1)
+    tensor_d["strands"] = {"[[1], [2]]": 1, "[[2], [1]]": 1}
+    result = markov_tensor_spectral.evolve(tensor_prior, tensor_d, 1)
+    assert result["strands"]["[[], [1]]"] == pytest.approx(0.9)
@@ -0,0 +1,47 @@
+import pytest
+
+import markov_tensor
+import markov_tensor_sweep
+
+
+def assert_matches(tensor_result, expected):
+    for strand, weight in tensor_result["strands"].items():
+        assert weight == pytest.approx(float(expected["strands"].get(strand, 0)))
+
+
+def test_batch_operations_match_dict_implementation(tensor_joint, tensor_d):
+    batch = markov_tensor_sweep.stack([tensor_joint, tensor_joint])
+    assert markov_tensor_sweep.batch_size(batch) == 2
+    prior = markov_tensor_sweep.first_marginalization(batch, 2)
+    assert_matches(markov_tensor_sweep.get_tensor(prior, 1), markov_tensor.first_marginalization(tensor_joint, 2))
+    assert_matches(markov_tensor_sweep.get_tensor(markov_tensor_sweep.conditionalization(batch, 2), 0),
+                   markov_tensor.conditionalization(tensor_joint, 2))
+    # バッチの大きさ 1 のテンソルは、もう一方に合わせて使う
+    posterior = markov_tensor_sweep.conversion(prior, tensor_d)
+    assert markov_tensor_sweep.batch_size(posterior) == 2
+    assert_matches(markov_tensor_sweep.get_tensor(posterior, 0),
+                   markov_tensor.conversion(markov_tensor.first_marginalization(tensor_joint, 2), tensor_d))
+    assert_matches(markov_tensor_sweep.get_tensor(markov_tensor_sweep.composition(prior, tensor_d), 1),
+                   markov_tensor.composition(markov_tensor.first_marginalization(tensor_joint, 2), tensor_d))
+
+
+def test_perturb_keeps_zeros_and_normalizes():
+    kernel = {"profile": [[2], [2]], "strands": {"[[1], [1]]": 1, "[[2], [1]]": 0.5, "[[2], [2]]": 0.5}}
+    batch = markov_tensor_sweep.perturb(kernel, 50, scale=0.2, seed=0)
+    weights = batch["weights"]
+    assert weights.shape == (50, 2, 2)
+    assert (weights[:, 0, 1] == 0).all()
+    assert weights.sum(axis=2) == pytest.approx(1)
+    summary = markov_tensor_sweep.summarize(batch)
+    assert summary["min"]["strands"]["[[2], [1]]"] <= summary["quantiles"][0.5]["strands"]["[[2], [1]]"] <= \
+        summary["max"]["strands"]["[[2], [1]]"]
+
+
+def test_mismatched_batches_are_rejected(tensor_prior, tensor_d):
+    with pytest.raises(ValueError):
+        markov_tensor_sweep.composition(
+            markov_tensor_sweep.perturb(tensor_prior, 2, seed=0), markov_tensor_sweep.perturb(tensor_d, 3, seed=0))
+    with pytest.raises(ValueError):
+        markov_tensor_sweep.stack([tensor_prior, tensor_d])
+    with pytest.raises(ValueError):
+        markov_tensor_sweep.create_batch([[1.0, 0.0]], tensor_d["profile"])
@@ -0,0 +1,44 @@
+import pytest
+
+import markov_tensor
+import markov_tensor_numpy
+
+
+def test_trajectory_matches_repeated_composition(tensor_prior, tensor_d):
+    result = markov_tensor_numpy.trajectory(tensor_prior, tensor_d, 4)
+    assert result.shape == (4, 2)
+    distribution = tensor_prior
+    for step in range(4):
+        assert result[step] == pytest.approx(markov_tensor_numpy.to_array(distribution))
+        distribution = markov_tensor.composition(distribution, tensor_d)
+
+
+def test_trajectory_keeps_factor_shape(tensor_joint, tensor_d):
+    kernel = markov_tensor.tensor_product(tensor_d, tensor_d)
+    result = markov_tensor_numpy.trajectory(tensor_joint, kernel, 3)
+    assert result.shape == (3, 2, 2)
+    assert result.sum(axis=(1, 2)) == pytest.approx([1, 1, 1])
+
+
+def test_trajectory_rejects_other_kernels(tensor_prior, tensor_joint):
+    with pytest.raises(ValueError):
+        markov_tensor_numpy.trajectory(tensor_prior, tensor_joint, 2)
+
+
+def test_sparse_kernel_matches_dense():
+    # 格子上の拡散のような疎なカーネル (各状態から自分と隣の状態のみ)
+    size = 40
+    strands = {}
+    for state in range(1, size + 1):
+        neighbours = [item for item in (state - 1, state, state + 1) if 1 <= item <= size]
+        for item in neighbours:
+            strands[str([[state], [item]])] = 1 / len(neighbours)
+    kernel = {"profile": [[size], [size]], "strands": strands, "mode": "float64"}
+    assert markov_tensor.count_nonzero(kernel) <= markov_tensor.SPARSE_MAX_DENSITY * size * size
+    distribution = {"profile": [[], [size]], "strands": {"[[], [1]]": 1.0}, "mode": "float64"}
+    result = markov_tensor_numpy.trajectory(distribution, kernel, 30)
+    expected = markov_tensor_numpy.to_matrix(distribution)[0]
+    matrix = markov_tensor_numpy.to_matrix(kernel)
+    for step in range(30):
+        assert result[step] == pytest.approx(expected)
+        expected = expected @ matrix
@@ -2,6 +2,7 @@ import plotly.graph_objects as go
 import numpy as np
 import random
 import markov_tensor
+import markov_tensor_numpy
 from fractions import Fraction
 
 fig = go.Figure()
@@ -65,17 +66,12 @@ tensor_d = {
     }
 }
 
-tensor_result = tensor_m
-for step in range(20):
-    val=[
-        [ 
-            tensor_result["strands"][str([[], [index_i + 1, index_j + 1]])] for index_i in range(tensor_result["profile"][1][0]) 
-        ] for index_j in range(tensor_result["profile"][1][1])
-    ]
-
+# 各ステップの分布を形が (ステップ数, 3, 2) の配列として一度に算出
+trajectory = markov_tensor_numpy.trajectory(tensor_m, tensor_d, 20)
+for step in range(len(trajectory)):
     fig.add_trace(
             go.Heatmap(
-                z=val, 
+                z=trajectory[step].T, 
                 colorscale = "Blues", 
                 colorbar=dict(
                     tick0=0,
@@ -84,9 +80,6 @@ for step in range(20):
             )
     )
 
-    tensor_result = markov_tensor.composition(tensor_result, tensor_d)
-    markov_tensor.print_tensor(tensor_result)
-
 
 # Create and add slider
 steps = []